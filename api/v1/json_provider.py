@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+"""Flask JSON provider backed by orjson, when it is installed
+
+orjson encodes the to_dict() rows of the list endpoints several times
+faster than the json module. Dates keep going through Flask's default
+handler so the output does not change; anything orjson cannot encode
+falls back to it as well. Without orjson the app keeps Flask's provider.
+"""
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """DefaultJSONProvider with dumps() and response() done by orjson"""
+
+    def __options(self, indent=None):
+        """orjson option flags matching the provider settings"""
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def __encode(self, obj, indent=None):
+        """Returns obj encoded as JSON bytes"""
+        return orjson.dumps(obj, default=self.default,
+                            option=self.__options(indent))
+
+    def dumps(self, obj, **kwargs):
+        """Serialize data as JSON to a string"""
+        indent = kwargs.pop('indent', None)
+        kwargs.pop('separators', None)
+        if kwargs:
+            # options only the json module understands (cls=, ...)
+            return super().dumps(obj, indent=indent, **kwargs)
+        try:
+            return self.__encode(obj, indent).decode()
+        except TypeError:
+            return super().dumps(obj, indent=indent)
+
+    def response(self, *args, **kwargs):
+        """Serialize the arguments as JSON into a response"""
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or \
+            self.compact is False
+        try:
+            body = self.__encode(obj, indent) + b'\n'
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+def json_provider(app):
+    """Returns the fastest JSON provider available for app"""
+    if orjson is None:
+        return DefaultJSONProvider(app)
+    return OrjsonProvider(app)
@@ -0,0 +1,2 @@
+#!/usr/bin/python3
+"""Model serving: the registry of the fitted ML artifacts"""
@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+"""HTTP client for remote prediction backends
+
+One PredictionClient per backend url, shared by all request threads:
+    - a requests.Session with a keep-alive pool of UMPIRE_REMOTE_POOL
+      connections
+    - connect and read timeouts, and a deadline over all the attempts
+    - retries of connection errors, timeouts and 502/503/504 answers,
+      after a jittered exponential backoff
+    - a circuit breaker: after UMPIRE_REMOTE_BREAKER_FAILURES failed calls
+      in a row, calls fail at once with CircuitOpen for
+      UMPIRE_REMOTE_BREAKER_RESET seconds, then one trial call decides
+      whether the backend is back
+    - coalescing: identical payloads posted while a call is in flight
+      wait for that call and share its answer
+
+    client = client_for(url)
+    data, status = client.post({"agency_id": 5, "day_name": "monday"})
+
+Settings:
+    UMPIRE_REMOTE_CONNECT_TIMEOUT    seconds to open a connection [1]
+    UMPIRE_REMOTE_READ_TIMEOUT       seconds to wait for an answer [3]
+    UMPIRE_REMOTE_DEADLINE           seconds for all attempts of a call [5]
+    UMPIRE_REMOTE_RETRIES            extra attempts after a failure [1]
+    UMPIRE_REMOTE_BACKOFF            base backoff in seconds [0.1]
+    UMPIRE_REMOTE_POOL               connections kept per backend [10]
+    UMPIRE_REMOTE_BREAKER_FAILURES   failed calls that open the circuit [5]
+    UMPIRE_REMOTE_BREAKER_RESET      seconds the circuit stays open [30]
+"""
+
+import json
+import os
+import random
+import threading
+from collections import Counter
+from time import monotonic, sleep
+import requests
+from requests.adapters import HTTPAdapter
+
+connect_timeout = float(os.getenv("UMPIRE_REMOTE_CONNECT_TIMEOUT", 1))
+read_timeout = float(os.getenv("UMPIRE_REMOTE_READ_TIMEOUT", 3))
+deadline = float(os.getenv("UMPIRE_REMOTE_DEADLINE", 5))
+retries = int(os.getenv("UMPIRE_REMOTE_RETRIES", 1))
+backoff = float(os.getenv("UMPIRE_REMOTE_BACKOFF", 0.1))
+pool_size = int(os.getenv("UMPIRE_REMOTE_POOL", 10))
+breaker_failures = int(os.getenv("UMPIRE_REMOTE_BREAKER_FAILURES", 5))
+breaker_reset = float(os.getenv("UMPIRE_REMOTE_BREAKER_RESET", 30))
+# answers worth another attempt
+retry_statuses = (502, 503, 504)
+
+
+class CircuitOpen(requests.exceptions.RequestException):
+    """Raised instead of calling a backend known to be unhealthy"""
+
+
+class CircuitBreaker:
+    """Closed, open or half-open state of one backend"""
+
+    def __init__(self, failures=breaker_failures, reset=breaker_reset):
+        """Starts closed"""
+        self.failures = failures
+        self.reset = reset
+        self.state = 'closed'
+        self.__count = 0
+        self.__opened = 0.0
+        self.__lock = threading.Lock()
+
+    def allow(self):
+        """Tells whether a call may go to the backend now. Once the
+        reset delay is over, a single trial call is let through."""
+        with self.__lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and \
+                    monotonic() - self.__opened >= self.reset:
+                self.state = 'half-open'
+                return True
+            return False
+
+    def success(self):
+        """Records a healthy answer: closes the circuit"""
+        with self.__lock:
+            self.state = 'closed'
+            self.__count = 0
+
+    def failure(self):
+        """Records a failed call, opening the circuit past the limit
+        or when the trial call failed"""
+        with self.__lock:
+            self.__count += 1
+            if self.state == 'half-open' or self.__count >= self.failures:
+                self.state = 'open'
+                self.__opened = monotonic()
+
+
+class InFlight:
+    """A call other threads with the same payload wait for"""
+
+    def __init__(self):
+        """Not finished yet"""
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class PredictionClient:
+    """Pooled, timed out, retried, circuit broken and coalescing POSTs
+    to one prediction backend"""
+
+    def __init__(self, url, breaker=None, timeout=None, deadline=deadline,
+                 retries=retries, backoff=backoff, pool_size=pool_size):
+        """Creates the session and its connection pool"""
+        self.url = url
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = timeout or (connect_timeout, read_timeout)
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.counters = Counter()
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=0)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        self.__inflight = {}
+        self.__lock = threading.Lock()
+
+    def post(self, payload):
+        """POSTs payload as JSON; returns (decoded body, status code).
+        Raises CircuitOpen, or the requests exception of the last
+        attempt when the backend could not be reached."""
+        key = json.dumps(payload, sort_keys=True, default=str)
+        with self.__lock:
+            call = self.__inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self.__inflight[key] = InFlight()
+        if not leader:
+            self.counters['coalesced'] += 1
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            data, status = call.result
+            return (dict(data) if type(data) == dict else data), status
+        try:
+            call.result = self.__call(payload)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                del self.__inflight[key]
+            call.done.set()
+
+    def __call(self, payload):
+        """Runs the attempts of one call through the breaker"""
+        if not self.breaker.allow():
+            self.counters['short_circuited'] += 1
+            raise CircuitOpen("{} is failing, not called".format(self.url))
+        self.counters['calls'] += 1
+        started = monotonic()
+        attempt = 0
+        while True:
+            error = None
+            try:
+                response = self.__session.post(
+                    self.url, json=payload,
+                    timeout=self.__attempt_timeout(started))
+                if response.status_code not in retry_statuses:
+                    if response.status_code >= 500:
+                        self.counters['failures'] += 1
+                        self.breaker.failure()
+                    else:
+                        self.breaker.success()
+                    try:
+                        return response.json(), response.status_code
+                    except ValueError:
+                        return {"error": response.text[:200]}, \
+                            response.status_code
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                error = e
+                response = None
+            except requests.exceptions.RequestException:
+                self.counters['failures'] += 1
+                self.breaker.failure()
+                raise
+            pause = random.uniform(0, self.backoff * 2 ** attempt)
+            attempt += 1
+            if attempt > self.retries or \
+                    monotonic() - started + pause >= self.deadline:
+                self.counters['failures'] += 1
+                self.breaker.failure()
+                if error is not None:
+                    raise error
+                return {"error": "Failed to fetch prediction"}, \
+                    response.status_code
+            self.counters['retries'] += 1
+            sleep(pause)
+
+    def __attempt_timeout(self, started):
+        """Returns the (connect, read) timeout of the next attempt, cut
+        down to what is left of the deadline of the call"""
+        connect, read = self.timeout
+        left = max(self.deadline - (monotonic() - started), 0.001)
+        return min(connect, left), min(read, left)
+
+    def stats(self):
+        """Returns the counters and the breaker state"""
+        return dict(self.counters, state=self.breaker.state)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def client_for(url):
+    """Returns the shared PredictionClient of url"""
+    with _clients_lock:
+        client = _clients.get(url)
+        if client is None:
+            client = _clients[url] = PredictionClient(url)
+        return client
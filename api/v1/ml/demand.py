@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+"""Demand prediction: in-process inference, or the remote service
+
+The local engine reproduces the pandas recipe of demand_model_serve.py
+(Categorical day_name + get_dummies, reindexed on the model's columns)
+with plain numpy: each (agency_id, day_name) pair becomes one row of a
+zero matrix holding agency_id and a 1 in the column of its day. Any
+number of pairs goes through a single predict() call, made by the
+compiled forest of forest.py for small batches.
+
+Settings:
+    UMPIRE_DEMAND_BACKEND  local (the shipped .joblib model) or remote [local]
+    UMPIRE_DEMAND_URL      url of the remote prediction service, called
+                           through the pooled client of client.py
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from api.v1.ml import forest, prediction_cache
+from api.v1.ml.client import client_for
+from api.v1.ml.executor import executor
+from api.v1.ml.registry import registry
+
+backend = os.getenv("UMPIRE_DEMAND_BACKEND", "local")
+remote_url = os.getenv("UMPIRE_DEMAND_URL",
+                       "https://ml-prediction-103109607498.europe-west1.run.app/")
+# registry names of the artifacts a prediction needs
+artifact_names = ('demand_model', 'demand_columns', 'demand_day_categories')
+
+
+class DemandEngine:
+    """One-hot encoder and model of a given version of the artifacts"""
+
+    def __init__(self, model, columns, day_categories):
+        """Resolves the column of agency_id and of every day"""
+        self.model = model
+        self.columns = list(columns)
+        position = {name: n for n, name in enumerate(self.columns)}
+        self.agency_column = position['agency_id']
+        self.day_columns = {day: position.get('day_name_' + day)
+                            for day in day_categories}
+        # the model was fitted on a DataFrame and checks the names
+        self.named = hasattr(model, 'feature_names_in_')
+
+    def encode(self, pairs):
+        """Returns the feature matrix of (agency_id, day_name) pairs.
+        An unknown day sets no day column, as get_dummies does."""
+        matrix = np.zeros((len(pairs), len(self.columns)))
+        if not pairs:
+            return matrix
+        matrix[:, self.agency_column] = [agency for agency, _ in pairs]
+        rows, cols = [], []
+        for n, (_, day_name) in enumerate(pairs):
+            col = self.day_columns.get(day_name)
+            if col is not None:
+                rows.append(n)
+                cols.append(col)
+        matrix[rows, cols] = 1
+        return matrix
+
+    def predict(self, pairs):
+        """Returns the predicted demand of each pair, as a numpy array"""
+        if not pairs:
+            return np.empty(0)
+        matrix = self.encode(pairs)
+        compiled = forest.for_batch('demand_model', len(pairs))
+        if compiled is not None:
+            return compiled.predict(matrix)
+        if self.named:
+            matrix = pd.DataFrame(matrix, columns=self.columns, copy=False)
+        return self.model.predict(matrix)
+
+
+_engine = (None, None)
+
+
+def engine():
+    """Returns the DemandEngine of the loaded artifacts, raising
+    ArtifactMissing when one of them is not available"""
+    global _engine
+    artifacts = tuple(registry.get(name) for name in artifact_names)
+    version = registry.version(*artifact_names)
+    current_version, current = _engine
+    if current_version != version:
+        current = DemandEngine(*artifacts)
+        _engine = (version, current)
+    return current
+
+
+def version():
+    """Returns the version key of the loaded demand model"""
+    return registry.version(*artifact_names)
+
+
+def predict_cached(pairs):
+    """Predicts (agency_id, day_name) pairs through the prediction
+    cache; returns floats"""
+    engine()  # raises ArtifactMissing here rather than in a worker
+    return prediction_cache.cached_predictions(
+        'demand', version(), [(int(agency), day) for agency, day in pairs],
+        lambda pairs: executor.predict('demand', pairs))
+
+
+prediction_cache.register('demand', artifact_names)
+
+
+def predict_remote(agency_id, day_name):
+    """Asks the remote service for one prediction; returns its JSON
+    response and status code. Raises CircuitOpen or a requests
+    exception when the service cannot answer."""
+    data, status = client_for(remote_url).post({"agency_id": agency_id,
+                                                "day_name": day_name})
+    if status != 200:
+        print(f"==========Response status code: {status}==========")
+        return {"error": "Failed to fetch prediction"}, status
+    return data, 200
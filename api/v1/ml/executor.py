@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+"""Model inference off the request threads, in a pool of processes
+
+With UMPIRE_INFERENCE_WORKERS > 0, predict() does not run the model in
+the calling thread: the request is put on a bounded queue and waits for
+its answer. A dispatcher thread drains the queue, merges the requests
+that arrived within UMPIRE_INFERENCE_BATCH_WAIT milliseconds into one
+batch per model, and hands each batch to a worker process, so under
+load many small requests share one predict() call and the GIL of the
+API process stays free for the other endpoints.
+
+start() loads the models, then forks the workers while the process is
+still single threaded (call it at startup), so the workers share the
+loaded models copy-on-write. A pool replaced after a worker died is
+started from a forkserver and loads the models in each worker. When the queue is full predict() raises
+Overloaded at once, which the views turn into a 503.
+
+Settings:
+    UMPIRE_INFERENCE_WORKERS      worker processes, 0 = inline [0]
+    UMPIRE_INFERENCE_QUEUE        requests waiting for a worker [256]
+    UMPIRE_INFERENCE_BATCH_WAIT   milliseconds to gather a batch [2]
+    UMPIRE_INFERENCE_BATCH_ROWS   rows after which a batch is sent [4096]
+    UMPIRE_INFERENCE_TIMEOUT      seconds a request waits [10]
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from time import monotonic
+import numpy as np
+
+workers = int(os.getenv("UMPIRE_INFERENCE_WORKERS", 0))
+queue_size = int(os.getenv("UMPIRE_INFERENCE_QUEUE", 256))
+batch_wait = float(os.getenv("UMPIRE_INFERENCE_BATCH_WAIT", 2)) / 1000
+batch_rows = int(os.getenv("UMPIRE_INFERENCE_BATCH_ROWS", 4096))
+timeout = float(os.getenv("UMPIRE_INFERENCE_TIMEOUT", 10))
+
+
+class Overloaded(Exception):
+    """Raised when the inference queue is full"""
+
+
+class InferenceExecutor:
+    """Bounded queue, micro-batching dispatcher and process pool"""
+
+    def __init__(self, workers=workers, queue_size=queue_size,
+                 batch_wait=batch_wait, batch_rows=batch_rows,
+                 timeout=timeout):
+        """Configures the executor; the pool starts on first use"""
+        self.workers = workers
+        self.batch_wait = batch_wait
+        self.batch_rows = batch_rows
+        self.timeout = timeout
+        self.batches = 0
+        self.requests = 0
+        self.rejected = 0
+        self.__queue = queue.Queue(queue_size)
+        # batches handed to the pool and not answered yet
+        self.__slots = threading.BoundedSemaphore(max(workers, 1) * 2)
+        self.__pool = None
+        self.__dispatcher = None
+        self.__lock = threading.Lock()
+        self.__counters_lock = threading.Lock()
+
+    def start(self):
+        """Starts the worker processes and the dispatcher thread"""
+        with self.__lock:
+            if self.__dispatcher is not None or self.workers <= 0 or \
+                    multiprocessing.parent_process() is not None:
+                # a worker importing the app never starts a pool
+                return
+            from api.v1.ml import worker
+            worker.warm()
+            self.__pool = self.__new_pool()
+            # forks every worker now, before the request threads exist
+            self.__pool.submit(worker.warm).result()
+            self.__dispatcher = threading.Thread(target=self.__dispatch,
+                                                 daemon=True)
+            self.__dispatcher.start()
+
+    def __new_pool(self, restart=False):
+        """Creates the process pool: forked where the platform can,
+        spawned (and warmed by each worker) elsewhere. A restart happens
+        once request threads exist, when forking could copy a lock held
+        by one of them: its workers come from a forkserver instead."""
+        from api.v1.ml import worker
+        methods = multiprocessing.get_all_start_methods()
+        if restart:
+            method = 'forkserver' if 'forkserver' in methods else 'spawn'
+        else:
+            method = 'fork' if 'fork' in methods else 'spawn'
+        context = multiprocessing.get_context(method)
+        if method == 'forkserver':
+            # the server imports the worker code, not the __main__ module
+            # (the app, which would start a pool of its own)
+            context.set_forkserver_preload(['api.v1.ml.worker'])
+        return ProcessPoolExecutor(self.workers, mp_context=context,
+                                   initializer=worker.warm)
+
+    def predict(self, model, rows):
+        """Returns the predictions of rows by model, as a numpy array.
+        Raises Overloaded when the queue is full."""
+        rows = list(rows)
+        if not rows:
+            return np.empty(0)
+        if self.workers <= 0:
+            return run_batch(model, rows)
+        self.start()
+        future = Future()
+        try:
+            self.__queue.put_nowait((model, rows, future))
+        except queue.Full:
+            self.__count('rejected')
+            raise Overloaded("inference queue is full") from None
+        self.__count('requests')
+        return future.result(timeout=self.timeout)
+
+    def __count(self, counter):
+        """Increments one of the counters, from any thread"""
+        with self.__counters_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def __dispatch(self):
+        """Dispatcher thread: gathers queued requests into batches"""
+        while True:
+            try:
+                self.__dispatch_batch()
+            except Exception as e:
+                # the thread must outlive any one batch
+                print("Inference dispatcher error: {}".format(e))
+
+    def __dispatch_batch(self):
+        """Waits for a request, gathers a batch around it and submits it"""
+        first = self.__queue.get()
+        batch = [first]
+        size = len(first[1])
+        deadline = monotonic() + self.batch_wait
+        while size < self.batch_rows:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.__queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[1])
+        by_model = {}
+        for item in batch:
+            by_model.setdefault(item[0], []).append(item)
+        for model, items in by_model.items():
+            self.__submit(model, items)
+
+    def __submit(self, model, items):
+        """Sends the rows of items to a worker as one batch"""
+        rows = [row for _, item_rows, _ in items for row in item_rows]
+        self.__slots.acquire()
+        self.__count('batches')
+        for attempt in range(2):
+            with self.__lock:
+                pool = self.__pool
+            try:
+                done = pool.submit(run_batch, model, rows)
+                break
+            except Exception as e:
+                # RuntimeError: a callback thread restarted the pool
+                # between the read above and submit(); try the new one
+                if isinstance(e, RuntimeError) and attempt == 0 and \
+                        pool is not self.__pool:
+                    continue
+                self.__slots.release()
+                if isinstance(e, BrokenProcessPool):
+                    self.__restart(pool)
+                for _, _, future in items:
+                    future.set_exception(e)
+                return
+        done.add_done_callback(
+            lambda done: self.__answer(done, items, pool))
+
+    def __answer(self, done, items, pool):
+        """Splits the predictions of a batch between its requests"""
+        self.__slots.release()
+        error = done.exception()
+        if error is not None:
+            if isinstance(error, BrokenProcessPool):
+                self.__restart(pool)
+            for _, _, future in items:
+                future.set_exception(error)
+            return
+        values = done.result()
+        start = 0
+        for _, rows, future in items:
+            future.set_result(values[start:start + len(rows)])
+            start += len(rows)
+
+    def __restart(self, broken):
+        """Replaces broken, the pool whose worker died, unless another
+        thread already did"""
+        with self.__lock:
+            if broken is not self.__pool:
+                return
+            self.__pool = self.__new_pool(restart=True)
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """Returns the settings and counters of the executor"""
+        return {
+            'workers': self.workers,
+            'queued': self.__queue.qsize(),
+            'requests': self.requests,
+            'batches': self.batches,
+            'rejected': self.rejected,
+        }
+
+
+def run_batch(model, rows):
+    """Predicts one batch, in a worker or inline"""
+    from api.v1.ml import worker
+    return worker.run(model, rows)
+
+
+executor = InferenceExecutor()
@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+"""Random forests compiled to flat arrays, predicted with numpy
+
+export() writes the trees of a fitted forest regressor into one file,
+laid out like the columnar snapshots of the storage engine:
+    MAGIC                     12 bytes
+    header length             8 bytes, little endian
+    header                    JSON: source version, sizes, array blocks
+    array blocks              8-byte aligned
+The nodes of all the trees are concatenated, so each array holds one
+entry per node of the forest:
+    feature    int32    feature compared at the node
+    threshold  float64  the node sends x[feature] <= threshold left
+    children   int32    left and right child of node n at 2n and 2n + 1
+    value      float64  prediction of the node (read at the leaves)
+plus the root node of every tree. A leaf is its own left and right
+child, so the paths that reached one can keep stepping in place until
+every path has.
+
+CompiledForest maps the file read-only: the API process and every
+inference worker share one copy of the trees in the page cache. Its
+predict() compares the float32 features with the thresholds as sklearn
+does, and adds up the leaf values tree by tree in the same order before
+dividing by the number of trees, so it returns the same bits as the
+model's predict().
+
+compiled(name) returns the CompiledForest of a registry artifact,
+exporting it next to the .joblib file (or keeping it in memory when
+that directory is read-only) the first time a version is seen.
+
+    python -m api.v1.ml.forest            # export the shipped forests
+    python -m api.v1.ml.forest --verify   # and check their predictions
+
+Walking the trees costs a few numpy operations per level for every
+(row, tree) pair, which beats the fixed cost of sklearn's predict() on
+the small batches of the request path but not its compiled loops on
+large ones: for_batch() leaves batches of more than
+UMPIRE_FOREST_MAX_ROWS rows to the model.
+
+Settings:
+    UMPIRE_FOREST            1 to predict random forests with numpy [1]
+    UMPIRE_FOREST_MAX_ROWS   largest batch predicted with numpy [128]
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import threading
+import numpy as np
+from api.v1.ml.registry import registry
+
+enabled = os.getenv("UMPIRE_FOREST", "1") == "1"
+max_rows = int(os.getenv("UMPIRE_FOREST_MAX_ROWS", 128))
+MAGIC = b'UMPIRE-RFX1\n'
+ALIGN = 8
+# the arrays of a compiled forest and their types
+layout = (('roots', '<i4'), ('feature', '<i4'), ('threshold', '<f8'),
+          ('children', '<i4'), ('value', '<f8'))
+# registry names of the forests compiled() is used for
+forest_names = ('travel_time_model', 'demand_model')
+
+
+def supported(model):
+    """Tells whether model is a single output forest regressor whose
+    predict() is the mean of its trees"""
+    trees = getattr(model, 'estimators_', None)
+    return getattr(model, '_estimator_type', None) == 'regressor' and \
+        type(trees) == list and len(trees) > 0 and \
+        getattr(model, 'n_outputs_', None) == 1 and \
+        all(hasattr(tree, 'tree_') for tree in trees)
+
+
+def flatten(model):
+    """Returns the arrays of layout, in a dict, for a fitted forest"""
+    roots, features, thresholds, children, values = [], [], [], [], []
+    base = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left == -1
+        left = np.where(leaf, nodes, tree.children_left) + base
+        right = np.where(leaf, nodes, tree.children_right) + base
+        roots.append(base)
+        features.append(np.where(leaf, 0, tree.feature))
+        thresholds.append(tree.threshold)
+        children.append(np.stack([left, right], axis=1).ravel())
+        values.append(tree.value.reshape(tree.node_count))
+        base += tree.node_count
+    arrays = {
+        'roots': np.array(roots),
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'children': np.concatenate(children),
+        'value': np.concatenate(values),
+    }
+    return {name: np.ascontiguousarray(arrays[name], dtype=dtype)
+            for name, dtype in layout}
+
+
+def describe(model, source=None):
+    """Returns the header facts of a fitted forest"""
+    return {
+        'source': source,
+        'trees': len(model.estimators_),
+        'features': int(model.n_features_in_),
+        'max_depth': max(int(tree.tree_.max_depth)
+                         for tree in model.estimators_),
+    }
+
+
+def export(model, path, source=None):
+    """Writes the compiled form of model to path, atomically. source
+    names the version of the model it was compiled from."""
+    arrays = flatten(model)
+    header = describe(model, source)
+    header['arrays'] = {}
+    blocks = []
+    offset = 0
+    for name, dtype in layout:
+        data = arrays[name].tobytes()
+        pad = -len(data) % ALIGN
+        header['arrays'][name] = {'dtype': dtype, 'offset': offset,
+                                  'count': len(arrays[name])}
+        blocks.append(data + b'\0' * pad)
+        offset += len(data) + pad
+    raw = json.dumps(header).encode()
+    raw += b' ' * (-(len(MAGIC) + 8 + len(raw)) % ALIGN)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<Q', len(raw)))
+            f.write(raw)
+            for block in blocks:
+                f.write(block)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class CompiledForest:
+    """The trees of a forest regressor as flat arrays"""
+
+    def __init__(self, header, arrays, mapped=None):
+        """Wraps arrays, which may be views of the mapped file"""
+        self.source = header.get('source')
+        self.trees = header['trees']
+        self.features = header['features']
+        self.max_depth = header['max_depth']
+        self.mapped = mapped is not None
+        self.__map = mapped
+        self.roots = arrays['roots']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.children = arrays['children']
+        self.value = arrays['value']
+        self.leaf = self.children[0::2] == np.arange(len(self.feature))
+
+    @classmethod
+    def open(cls, path):
+        """Maps a file written by export()"""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mapped[:len(MAGIC)] != MAGIC:
+            mapped.close()
+            raise ValueError("{} is not a compiled forest".format(path))
+        start = len(MAGIC) + 8
+        size, = struct.unpack('<Q', mapped[len(MAGIC):start])
+        header = json.loads(mapped[start:start + size])
+        base = start + size
+        arrays = {}
+        for name, meta in header['arrays'].items():
+            arrays[name] = np.frombuffer(mapped, dtype=meta['dtype'],
+                                         count=meta['count'],
+                                         offset=base + meta['offset'])
+        return cls(header, arrays, mapped)
+
+    @classmethod
+    def from_model(cls, model, source=None):
+        """Compiles model in memory, without a file"""
+        return cls(describe(model, source), flatten(model))
+
+    def predict(self, X):
+        """Returns the prediction of each row of X (a 2d array, a
+        DataFrame or a sparse matrix) as a float64 array"""
+        if hasattr(X, 'toarray'):
+            X = X.toarray()
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.features:
+            raise ValueError("X has {} features, the forest expects {}"
+                             .format(X.shape[-1], self.features))
+        if not np.isfinite(X).all():
+            raise ValueError("Input contains NaN or infinity")
+        count = X.shape[0]
+        if count == 0:
+            return np.empty(0)
+        flat = X.ravel()
+        # one path per (row, tree), walked down one level per step
+        offsets = np.repeat(np.arange(count, dtype=np.intp) * self.features,
+                            self.trees)
+        nodes = np.tile(self.roots.astype(np.intp), count)
+        for step in range(1, self.max_depth + 1):
+            x = flat[offsets + self.feature[nodes]]
+            nodes = self.children[2 * nodes + (x > self.threshold[nodes])]
+            if step % 4 == 0 and self.leaf[nodes].all():
+                break
+        leaves = self.value[nodes].reshape(count, self.trees)
+        # the sum of the trees in sklearn's order gives the same bits
+        result = np.zeros(count)
+        for tree in range(self.trees):
+            result += leaves[:, tree]
+        result /= self.trees
+        return result
+
+    def close(self):
+        """Unmaps the file, if any"""
+        if self.__map is not None:
+            self.__map.close()
+
+
+def forest_path(name):
+    """Returns the path of the compiled form of the artifact name"""
+    return os.path.splitext(registry.path(name))[0] + '.forest'
+
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def compiled(name):
+    """Returns the CompiledForest of the loaded version of the artifact
+    name, or None when it is not a supported forest. Raises
+    ArtifactMissing when the artifact is not available."""
+    model = registry.get(name)
+    version = registry.version(name)
+    current = _compiled.get(name)
+    if current is not None and current[0] == version:
+        return current[1]
+    with _compiled_lock:
+        current = _compiled.get(name)
+        if current is not None and current[0] == version:
+            return current[1]
+        forest = load(name, model, version)
+        _compiled[name] = (version, forest)
+        return forest
+
+
+def load(name, model, version):
+    """Maps the compiled file of model, exporting it first when it is
+    missing or was compiled from another version"""
+    if not supported(model):
+        return None
+    path = forest_path(name)
+    try:
+        forest = CompiledForest.open(path)
+        if forest.source == version:
+            return forest
+        forest.close()
+    except (OSError, ValueError):
+        pass
+    try:
+        export(model, path, version)
+        forest = CompiledForest.open(path)
+        print("Compiled model artifact {} to {}".format(name, path))
+        return forest
+    except OSError as e:
+        print("Compiled model artifact {} in memory: {}".format(name, e))
+        return CompiledForest.from_model(model, version)
+
+
+def for_batch(name, rows):
+    """Returns the CompiledForest to predict a batch of rows with, or
+    None when the model itself should"""
+    if not enabled or rows > max_rows:
+        return None
+    return compiled(name)
+
+
+def warm():
+    """Compiles every available forest of forest_names"""
+    if not enabled:
+        return
+    for name in forest_names:
+        if registry.available(name):
+            compiled(name)
+
+
+def verify(name, X):
+    """Asserts that the compiled forest of name predicts X exactly as
+    the model does; returns the number of rows checked"""
+    model = registry.get(name)
+    forest = compiled(name)
+    assert forest is not None, "{} is not a supported forest".format(name)
+    expected = model.predict(X)
+    got = forest.predict(X)
+    assert got.dtype == expected.dtype and np.array_equal(got, expected), \
+        "{}: {} of {} predictions differ".format(
+            name, int((got != expected).sum()), len(expected))
+    return len(expected)
+
+
+def verify_shipped(rows=20000):
+    """Checks the shipped forests on their input domain and on random
+    feature vectors"""
+    from api.v1.ml import demand, travel_time
+    rng = np.random.default_rng(0)
+    checked = {}
+    if registry.available('demand_model'):
+        engine = demand.engine()
+        days = list(registry.get('demand_day_categories')) + ['holiday']
+        pairs = [(agency, day) for agency in range(0, 2001)
+                 for day in days]
+        X = engine.encode(pairs)
+        noise = engine.encode([(int(agency), days[day]) for agency, day in
+                               zip(rng.integers(-10 ** 6, 10 ** 6, rows),
+                                   rng.integers(0, len(days), rows))])
+        noise[:, engine.agency_column] += rng.uniform(-1, 1, rows)
+        if engine.named:
+            import pandas as pd
+            X = pd.DataFrame(X, columns=engine.columns)
+            noise = pd.DataFrame(noise, columns=engine.columns)
+        checked['demand_model'] = verify('demand_model', X) + \
+            verify('demand_model', noise)
+    if all(registry.available(name) for name in travel_time.artifact_names):
+        model, feature_columns, preprocessor = travel_time.models()
+        import pandas as pd
+        frame = pd.DataFrame({
+            'route_type': travel_time.route_type,
+            'hour_of_day': rng.integers(0, 24, rows),
+            'trip_distance_km': rng.uniform(0, 60, rows),
+            'day_name': rng.choice(travel_time.days, rows),
+            'origin': rng.choice(['Accra', 'Madina', 'Tema', 'Circle'], rows),
+            'destination': rng.choice(['Accra', 'Lapaz', 'Kaneshie'], rows),
+        })[list(feature_columns)]
+        X = preprocessor.transform(frame)
+        checked['travel_time_model'] = verify('travel_time_model', X)
+    return checked
+
+
+if __name__ == '__main__':
+    for _name in forest_names:
+        if not registry.available(_name):
+            print("{}: artifact missing".format(_name))
+            continue
+        _forest = compiled(_name)
+        if _forest is None:
+            print("{}: not a forest regressor".format(_name))
+            continue
+        print("{}: {} trees, {} nodes, depth {}, {}".format(
+            _name, _forest.trees, len(_forest.feature), _forest.max_depth,
+            forest_path(_name) if _forest.mapped else 'in memory'))
+    if '--verify' in sys.argv[1:]:
+        for _name, _count in verify_shipped().items():
+            print("{}: {} predictions identical to sklearn".format(
+                _name, _count))
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+"""Precomputed travel times for every route, day and hour
+
+The travel time features only take a few hundred routes x 7 days x 24
+hours of distinct values, so the model is run once over that whole grid
+and the predictions are kept in a float64 array of shape
+(routes, 7, 24); a request is then an index lookup.
+
+The grid is tagged with the Route generation of the storage cache and
+the version of the travel time model. When either moved on, lookup()
+answers None (the caller predicts as before) and a background thread
+rebuilds the grid; a model reload announced by the registry starts the
+rebuild straight away. A failed build is not retried for the same
+routes and model until UMPIRE_TRAVEL_GRID_RETRY seconds have passed.
+
+Unless the storage cache shares its generations between processes
+(UMPIRE_CACHE_URL), the Route generation only moves with the writes of
+this process, so the grid is also rebuilt, in the background while it
+keeps answering, once it is UMPIRE_TRAVEL_GRID_MAX_AGE seconds old.
+
+    python -m api.v1.ml.grid        # build once and report the timings
+
+Settings:
+    UMPIRE_TRAVEL_GRID           1 to serve travel times from the grid [1]
+    UMPIRE_TRAVEL_GRID_MAX_AGE   seconds before a rebuild [UMPIRE_CACHE_TTL]
+    UMPIRE_TRAVEL_GRID_RETRY     seconds before a failed build is retried [60]
+"""
+
+import os
+import threading
+from time import monotonic, perf_counter
+import numpy as np
+from api.v1.ml import travel_time
+from api.v1.ml.registry import registry, ArtifactMissing
+from backend.models import storage, storage_type, Route
+from backend.models.engine.cache import cache_ttl
+
+enabled = os.getenv("UMPIRE_TRAVEL_GRID", "1") == "1"
+max_age = float(os.getenv("UMPIRE_TRAVEL_GRID_MAX_AGE", cache_ttl))
+retry_after = float(os.getenv("UMPIRE_TRAVEL_GRID_RETRY", 60))
+day_index = {day: n for n, day in enumerate(travel_time.days)}
+# inputs per predict call while building, about 30 routes
+build_chunk = 5000
+
+
+class TravelTimeGrid:
+    """The (route, day, hour) array of predictions and its freshness"""
+
+    def __init__(self):
+        """Starts empty: the first lookup schedules a build"""
+        # (route id -> row, values, route generation, model version)
+        self.__state = None
+        self.__built_at = None
+        # ((route generation, model version), time) of the last failure
+        self.__failed = None
+        self.__lock = threading.Lock()
+        self.__building = None
+        self.build_ms = None
+
+    def __current(self):
+        """Returns (route generation, model version) right now"""
+        travel_time.models()  # lets the registry notice a new file
+        return storage.generation(Route), travel_time.version()
+
+    def build(self):
+        """Evaluates the model over every route, day and hour"""
+        started = perf_counter()
+        generation, version = self.__current()
+        routes = list(storage.all(Route).values())
+        values = np.empty((len(routes), len(travel_time.days),
+                           len(travel_time.hours)))
+        per_route = values[0].size if routes else 1
+        flat = values.reshape(-1)
+        step = max(build_chunk // per_route, 1)
+        for start in range(0, len(routes), step):
+            inputs = [(route, day, hour)
+                      for route in routes[start:start + step]
+                      for day in travel_time.days
+                      for hour in travel_time.hours]
+            flat[start * per_route:start * per_route + len(inputs)] = \
+                travel_time.predict_many(inputs)
+        index = {route.id: n for n, route in enumerate(routes)}
+        self.__state = (index, values, generation, version)
+        self.__built_at = monotonic()
+        self.__failed = None
+        self.build_ms = (perf_counter() - started) * 1000
+        print("Travel time grid: {} routes in {:.0f}ms".format(
+            len(routes), self.build_ms))
+
+    def __build_in_background(self):
+        """Thread body: builds, then releases the thread's session"""
+        current = None
+        try:
+            current = self.__current()
+            self.build()
+        except ArtifactMissing as e:
+            self.__failed = (current, monotonic())
+            print("Travel time grid not built: {}".format(e))
+        except Exception as e:
+            self.__failed = (current, monotonic())
+            print("Travel time grid build failed: {}".format(e))
+        finally:
+            if storage_type == "db":
+                storage.close()
+            with self.__lock:
+                self.__building = None
+
+    def refresh(self):
+        """Starts a background rebuild unless one is running"""
+        with self.__lock:
+            if self.__building is not None:
+                return
+            self.__building = threading.Thread(
+                target=self.__build_in_background, daemon=True)
+            self.__building.start()
+
+    def fresh(self):
+        """Returns the state when it matches the routes and model, and
+        schedules a rebuild otherwise, or when it grew too old to trust
+        the per-process Route generation"""
+        try:
+            current = self.__current()
+        except ArtifactMissing:
+            return None
+        state = self.__state
+        if state is not None and state[2:] == current:
+            if not storage.shared_generations() and \
+                    monotonic() - self.__built_at >= max_age:
+                self.__retry(current)
+            return state
+        self.__retry(current)
+        return None
+
+    def __retry(self, current):
+        """Starts a rebuild, unless the last one failed for the same
+        routes and model less than retry_after seconds ago"""
+        failed = self.__failed
+        if failed is None or failed[0] != current or \
+                monotonic() - failed[1] >= retry_after:
+            self.refresh()
+
+    def lookup(self, route_id, day_name, hour_of_day):
+        """Returns the predicted travel time, or None when the grid
+        cannot answer (not built, stale or outside the grid)"""
+        state = self.fresh()
+        if state is None:
+            return None
+        row = state[0].get(route_id)
+        day = day_index.get(day_name)
+        if row is None or day is None or \
+                type(hour_of_day) != int or not 0 <= hour_of_day <= 23:
+            return None
+        return float(state[1][row, day, hour_of_day])
+
+    def lookup_many(self, inputs):
+        """Returns the predictions of (route, day_name, hour_of_day)
+        inputs as an array, or None when one of them is not in a fresh
+        grid"""
+        state = self.fresh()
+        if state is None:
+            return None
+        index, values = state[0], state[1]
+        rows = [index.get(route.id) for route, _, _ in inputs]
+        if None in rows:
+            return None
+        days = [day_index[day_name] for _, day_name, _ in inputs]
+        hours = [hour for _, _, hour in inputs]
+        return values[rows, days, hours]
+
+    def stats(self):
+        """Returns the size and freshness facts of the grid"""
+        state = self.__state
+        failed = self.__failed
+        return {
+            'routes': len(state[0]) if state else 0,
+            'bytes': state[1].nbytes if state else 0,
+            'route_generation': state[2] if state else None,
+            'model_version': state[3] if state else None,
+            'build_ms': self.build_ms,
+            'age_s': monotonic() - self.__built_at if state else None,
+            'failed_s_ago': monotonic() - failed[1] if failed else None,
+            'building': self.__building is not None,
+        }
+
+
+grid = TravelTimeGrid()
+
+
+def model_reloaded(name, version):
+    """Registry callback: rebuilds the grid for the new model"""
+    if enabled and name in travel_time.artifact_names:
+        grid.refresh()
+
+
+registry.subscribe(model_reloaded)
+
+
+if __name__ == '__main__':
+    grid.build()
+    print(grid.stats())
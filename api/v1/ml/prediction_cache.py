@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+"""Memoized predictions, keyed on the model inputs
+
+Riders ask for the same few thousand inputs over and over: the same
+route, day and hour, the same agency and day. Each model gets an
+LRUCache, as used by the storage cache, whose keys are
+    (model version, canonical feature tuple)
+so a new version of a model never serves the answers of the old one.
+The registry also clears the LRU of a model when it reloads one of its
+artifacts, to free the entries that can no longer be hit.
+
+    values = cached_predictions('demand', demand.version(), pairs,
+                                demand.engine().predict)
+
+Settings:
+    UMPIRE_PREDICTION_CACHE        1 to memoize predictions [1]
+    UMPIRE_PREDICTION_CACHE_SIZE   entries kept per model [100000]
+    UMPIRE_PREDICTION_CACHE_TTL    seconds an entry is served [3600]
+"""
+
+import os
+import threading
+from api.v1.ml.registry import registry
+
+enabled = os.getenv("UMPIRE_PREDICTION_CACHE", "1") == "1"
+cache_size = int(os.getenv("UMPIRE_PREDICTION_CACHE_SIZE", 100000))
+cache_ttl = int(os.getenv("UMPIRE_PREDICTION_CACHE_TTL", 3600))
+# model name -> the registry artifacts it is made of, and its LRUCache
+model_artifacts = {}
+caches = {}
+caches_lock = threading.Lock()
+
+
+def register(model, artifact_names):
+    """Declares the artifacts a model is built from"""
+    model_artifacts[model] = tuple(artifact_names)
+
+
+def cache_of(model):
+    """Returns the LRUCache of model, created on first use (the
+    inference workers import the models but never cache)"""
+    cache = caches.get(model)
+    if cache is None:
+        from backend.models.engine.cache import LRUCache
+        with caches_lock:
+            cache = caches.setdefault(model, LRUCache(cache_size, cache_ttl))
+    return cache
+
+
+def cached_predictions(model, version, features, compute):
+    """Returns the prediction of each feature tuple, in order, as
+    floats. The tuples missing from the cache go through a single
+    compute(missing tuples) call, which returns their predictions."""
+    if not enabled:
+        return [float(v) for v in compute(features)] if features else []
+    cache = cache_of(model)
+    results = []
+    missing = {}
+    for n, key in enumerate(features):
+        value = cache.get((version, key))
+        results.append(value)
+        if value is None:
+            missing.setdefault(key, []).append(n)
+    if missing:
+        keys = list(missing)
+        for key, value in zip(keys, compute(keys)):
+            value = float(value)
+            cache.set((version, key), value)
+            for n in missing[key]:
+                results[n] = value
+    return results
+
+
+def stats():
+    """Returns the counters of the cache of every model"""
+    return {model: cache_of(model).stats() for model in model_artifacts}
+
+
+def artifact_reloaded(name, version):
+    """Registry callback: drops the entries of the reloaded model"""
+    for model, names in model_artifacts.items():
+        if name in names and model in caches:
+            caches[model].clear()
+
+
+registry.subscribe(artifact_reloaded)
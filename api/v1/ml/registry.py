@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+"""Process-wide registry of the fitted ML artifacts
+
+Each artifact is unpickled once, on first use (or by preload() at
+startup), and the same object is then shared by every request thread.
+get() stats the file at most every UMPIRE_MODEL_CHECK seconds; when its
+mtime or size changed the file is hashed, and a new hash loads the new
+version, which replaces the old one atomically once fully loaded.
+Subscribers are told about every reload, so anything derived from a
+model (precomputed grids, cached predictions) can be refreshed.
+
+    from api.v1.ml.registry import registry
+    model = registry.get('travel_time_model')
+
+Settings:
+    UMPIRE_MODEL_DIR      directory of the .joblib files [api/v1/views]
+    UMPIRE_MODEL_CHECK    seconds between two mtime checks, 0 = always [5]
+    UMPIRE_MODEL_PRELOAD  1 to load every artifact when the app starts [0]
+"""
+
+import hashlib
+import os
+import resource
+import threading
+from time import monotonic, perf_counter, time
+import joblib
+
+model_dir = os.getenv("UMPIRE_MODEL_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'views'))
+check_interval = float(os.getenv("UMPIRE_MODEL_CHECK", 5))
+# the process memory is shared: loads are measured one at a time
+_measure_lock = threading.Lock()
+
+# registry names of the artifacts shipped with the API
+artifacts = {
+    'travel_time_model': 'ml_model_travel_time_rf_travel_time_model.joblib',
+    'travel_time_features':
+        'ml_model_travel_time_travel_time_features.joblib',
+    'travel_time_preprocessor':
+        'ml_model_travel_time_travel_time_preprocessor.joblib',
+    'demand_model': 'ml_model_demand_rf_demand_model.joblib',
+    'demand_columns': 'ml_model_demand_rf_demand_columns.joblib',
+    'demand_day_categories': 'ml_model_demand_day_categories.joblib',
+}
+
+
+class ArtifactMissing(LookupError):
+    """Raised when the file of an artifact does not exist"""
+
+
+def resident_bytes():
+    """Returns the resident memory of the process, in bytes"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak, not current, resident size outside Linux (kB)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def file_hash(path):
+    """Returns the sha1 hex digest of the file at path"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Artifact:
+    """One loaded artifact and the facts about its current version"""
+
+    def __init__(self, name, path, loader=joblib.load):
+        """Describes an artifact that is not loaded yet"""
+        self.name = name
+        self.path = path
+        self.loader = loader
+        self.value = None
+        self.loaded = False
+        self.mtime = None
+        self.size = None
+        self.digest = None
+        self.version = 0
+        self.load_ms = None
+        self.memory_bytes = None
+        self.loaded_at = None
+        self.checked = 0.0
+        self.lock = threading.Lock()
+
+    def stat(self):
+        """Returns (mtime, size) of the file, raising ArtifactMissing"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            raise ArtifactMissing("{} not found at {}".format(
+                self.name, self.path)) from None
+        return st.st_mtime_ns, st.st_size
+
+    def load(self, mtime, size, digest):
+        """Unpickles the file, measuring the time it takes and the
+        resident memory it adds (the first load also pays for imports)"""
+        with _measure_lock:
+            before = resident_bytes()
+            started = perf_counter()
+            value = self.loader(self.path)
+            elapsed = (perf_counter() - started) * 1000
+            memory = resident_bytes() - before
+        # the value goes first: a reader seeing the new digest or
+        # version is served the new value
+        self.value = value
+        self.mtime, self.size, self.digest = mtime, size, digest
+        self.load_ms = elapsed
+        self.memory_bytes = max(memory, 0)
+        self.loaded_at = time()
+        self.version += 1
+        self.loaded = True
+        print("Loaded model artifact {} ({:.1f}ms, {:.1f}MB)".format(
+            self.name, elapsed, self.memory_bytes / 1e6))
+
+    def to_dict(self):
+        """Returns the load facts of the artifact"""
+        return {
+            'name': self.name,
+            'file': os.path.basename(self.path),
+            'loaded': self.loaded,
+            'version': self.version,
+            'sha1': self.digest,
+            'size_bytes': self.size,
+            'load_ms': self.load_ms,
+            'memory_bytes': self.memory_bytes,
+            'loaded_at': self.loaded_at,
+        }
+
+
+class ModelRegistry:
+    """Named, lazily loaded, hot-reloaded artifacts shared by all threads"""
+
+    def __init__(self, directory=model_dir, interval=check_interval):
+        """Creates a registry reading its files from directory"""
+        self.directory = directory
+        self.interval = interval
+        self.__artifacts = {}
+        self.__subscribers = []
+
+    def register(self, name, filename, loader=joblib.load):
+        """Declares the artifact name, stored in filename"""
+        path = os.path.join(self.directory, filename)
+        self.__artifacts[name] = Artifact(name, path, loader)
+
+    def subscribe(self, callback):
+        """Calls callback(name, version) after every reload of an
+        artifact that had already been loaded"""
+        self.__subscribers.append(callback)
+
+    def __artifact(self, name):
+        """Returns the Artifact registered as name"""
+        try:
+            return self.__artifacts[name]
+        except KeyError:
+            raise KeyError("unknown model artifact {}".format(name)) from None
+
+    def __refresh(self, artifact, force=False):
+        """Loads artifact, or reloads it when its file changed"""
+        now = monotonic()
+        if artifact.loaded and not force and \
+                now - artifact.checked < self.interval:
+            return
+        with artifact.lock:
+            if artifact.loaded and not force and \
+                    now - artifact.checked < self.interval:
+                return
+            try:
+                mtime, size = artifact.stat()
+            except ArtifactMissing:
+                if not artifact.loaded:
+                    raise
+                # removed under a running app: keep the version we have
+                artifact.checked = now
+                return
+            artifact.checked = now
+            if artifact.loaded and (mtime, size) == \
+                    (artifact.mtime, artifact.size):
+                return
+            digest = file_hash(artifact.path)
+            if artifact.loaded and digest == artifact.digest:
+                # touched, same content
+                artifact.mtime, artifact.size = mtime, size
+                return
+            reloaded = artifact.loaded
+            try:
+                artifact.load(mtime, size, digest)
+            except Exception as e:
+                if not reloaded:
+                    raise
+                # a half copied file: retried at the next check
+                print("Reloading model artifact {} failed: {}".format(
+                    artifact.name, e))
+                return
+        if reloaded:
+            for callback in list(self.__subscribers):
+                callback(artifact.name, artifact.version)
+
+    def get(self, name):
+        """Returns the current value of the artifact name, raising
+        ArtifactMissing when its file does not exist"""
+        artifact = self.__artifact(name)
+        self.__refresh(artifact)
+        return artifact.value
+
+    def version(self, *names):
+        """Returns a key naming the loaded versions of the artifacts,
+        changing whenever one of them is reloaded"""
+        return ':'.join((self.__artifact(name).digest or '-')[:12]
+                        for name in names)
+
+    def path(self, name):
+        """Returns the path of the file of the artifact name"""
+        return self.__artifact(name).path
+
+    def available(self, name):
+        """Returns True when the file of the artifact exists"""
+        return os.path.exists(self.__artifact(name).path)
+
+    def reload(self, name=None):
+        """Checks the files now, loading what changed"""
+        names = [name] if name else list(self.__artifacts)
+        for each in names:
+            artifact = self.__artifact(each)
+            if artifact.loaded or self.available(each):
+                self.__refresh(artifact, force=True)
+
+    def preload(self):
+        """Loads every registered artifact whose file exists"""
+        for name, artifact in self.__artifacts.items():
+            if self.available(name):
+                self.__refresh(artifact)
+            else:
+                print("Model artifact {} is missing: {}".format(
+                    name, artifact.path))
+
+    def stats(self):
+        """Returns the load facts of every registered artifact"""
+        result = []
+        for name, artifact in self.__artifacts.items():
+            facts = artifact.to_dict()
+            facts['available'] = self.available(name)
+            result.append(facts)
+        return result
+
+
+registry = ModelRegistry()
+for _name, _filename in artifacts.items():
+    registry.register(_name, _filename)
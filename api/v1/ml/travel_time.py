@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+"""Travel time features and vectorized inference
+
+The model takes, per trip:
+    route_type, hour_of_day, trip_distance_km, day_name, origin, destination
+where origin and destination come from the route name ("A to B").
+predict_many() turns any number of (route, day_name, hour_of_day) inputs
+into one feature frame and runs a single transform() and predict() on it;
+predict_cached() only does so for the feature rows it has not memoized.
+Both run the model through the inference executor; predict_rows() is
+what runs in the worker. The preprocessor stays sklearn's, the forest
+itself is walked by forest.py for small batches.
+"""
+
+import pandas as pd
+from api.v1.ml import forest, prediction_cache
+from api.v1.ml.executor import executor
+from api.v1.ml.registry import registry
+
+days = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+        'saturday', 'sunday')
+hours = tuple(range(24))
+route_type = "bus"
+default_distance_km = 5.0
+# registry names of the artifacts a prediction needs
+artifact_names = ('travel_time_model', 'travel_time_features',
+                  'travel_time_preprocessor')
+
+
+def route_features(route):
+    """Returns the features that only depend on the route"""
+    name = route.name or ''
+    origin = name.split(" to ")[0] if " to " in name else name
+    destination = name.split(" to ")[-1] if " to " in name else name
+    distance = getattr(route, 'distance_km', None)
+    if distance is None:
+        distance = default_distance_km
+    return {
+        "route_type": route_type,
+        "trip_distance_km": distance,
+        "origin": origin,
+        "destination": destination,
+    }
+
+
+def models():
+    """Returns (model, feature_columns, preprocessor), raising
+    ArtifactMissing when one of them is not available"""
+    return tuple(registry.get(name) for name in artifact_names)
+
+
+def version():
+    """Returns the version key of the loaded travel time model"""
+    return registry.version(*artifact_names)
+
+
+def feature_rows(inputs, feature_columns):
+    """Returns the feature tuple, in feature_columns order, of each
+    (route, day_name, hour_of_day) input"""
+    by_route = {}
+    rows = []
+    for route, day_name, hour_of_day in inputs:
+        features = by_route.get(route.id)
+        if features is None:
+            features = by_route[route.id] = route_features(route)
+        features = dict(features, day_name=day_name, hour_of_day=hour_of_day)
+        rows.append(tuple(features[name] for name in feature_columns))
+    return rows
+
+
+def predict_rows(rows):
+    """Predicts feature tuples with one transform() and one predict()"""
+    model, feature_columns, preprocessor = models()
+    frame = pd.DataFrame(rows, columns=list(feature_columns))
+    X = preprocessor.transform(frame)
+    compiled = forest.for_batch('travel_time_model', len(rows))
+    if compiled is not None:
+        return compiled.predict(X)
+    return model.predict(X)
+
+
+def predict_many(inputs):
+    """Predicts the travel time of each (route, day_name, hour_of_day)
+    input with one transform() and one predict() call.
+    Returns the predictions as a numpy array, in the order of inputs.
+    """
+    feature_columns = models()[1]
+    return executor.predict('travel_time',
+                            feature_rows(inputs, feature_columns))
+
+
+def predict_cached(inputs):
+    """predict_many() through the prediction cache; returns floats"""
+    feature_columns = models()[1]
+    return prediction_cache.cached_predictions(
+        'travel_time', version(), feature_rows(inputs, feature_columns),
+        lambda rows: executor.predict('travel_time', rows))
+
+
+prediction_cache.register('travel_time', artifact_names)
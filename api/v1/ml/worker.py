@@ -0,0 +1,29 @@
+#!/usr/bin/python3
+"""Code run by the inference worker processes
+
+The executor loads every artifact in the API process before forking the
+workers, so they start with the libraries and the models in memory and
+share those pages copy-on-write; where processes are spawned instead,
+warm() loads them in each worker. The compiled forests are mapped
+files, shared through the page cache either way.
+"""
+
+from api.v1.ml import demand, forest, travel_time
+from api.v1.ml.registry import registry
+
+
+def warm():
+    """Loads every model artifact of this process and maps the
+    compiled forests"""
+    registry.preload()
+    forest.warm()
+
+
+def run(model, rows):
+    """Predicts rows (feature tuples of travel_time, (agency_id, day_name)
+    pairs of demand) with the worker's copy of the model"""
+    if model == 'travel_time':
+        return travel_time.predict_rows(rows)
+    if model == 'demand':
+        return demand.engine().predict(rows)
+    raise KeyError("unknown model {}".format(model))
@@ -17,6 +17,7 @@ from api.v1.views.agencies import *
 from api.v1.views.demand_prediction import *
 from api.v1.views.travel_time_prediction import *
 from api.v1.views.terminal_prediction import *
+from api.v1.views.model_registry import *
 
 # Optimization views
 from api.v1.views.optimization import *
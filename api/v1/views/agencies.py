@@ -6,24 +6,37 @@ from backend.models import storage
 from backend.models import Agency
 from flask import jsonify, request
 from werkzeug.exceptions import NotFound, MethodNotAllowed, BadRequest
-from .commons import (fetch_data, fetch_data_id, fetch_process,
-                      reach_endpoint, allows)
+from .commons import (fetch_data, fetch_data_id, parse_include, embed,
+                      collection_response, wants_page, page_response,
+                      wants_stream, stream_response, reach_endpoint, allows,
+                      create_many)
+
+# relationships that can be embedded with include=
+agency_includes = ('terminals', 'routes')
 
 
 def get_agency(agency_id=None):
     """Returns the agency using the given id.
     """
-    agencies = fetch_data(Agency)
+    include = parse_include(agency_includes)
+    if agency_id:
+        agency = fetch_data_id(Agency, agency_id, include=include)
+        return jsonify([embed(agency, include)] if agency else [])
+
+    if wants_stream():
+        return stream_response(Agency)
+    if wants_page():
+        return page_response(Agency, include=include)
+
+    if not include:
+        return collection_response(Agency, "No agencies found")
+
+    agencies = fetch_data(Agency, include=include)
     if not agencies:
         return jsonify(
             {"error": "No agencies found"}), 404
 
-    if agency_id:
-        results = [v.to_dict() for v in agencies if v.id == agency_id]
-    else:
-        results = [v.to_dict() for v in agencies]
-
-    return jsonify(results)
+    return jsonify([embed(v, include) for v in agencies])
 
 def add_agency(agency_id=None):
     """Add new agency into the system.
@@ -33,19 +46,15 @@ def add_agency(agency_id=None):
         raise BadRequest(description='Not a JSON')
 
     if type(data) == list and len(data) > 0:
-        i = 0
-        j = 0
         for agency in data:
             if type(agency) is not dict:
                 raise BadRequest(description='Not a JSON')
             if 'name' not in agency:
                 raise BadRequest(description='Missing name')
-            agency = storage.get_or_create(Agency, **agency)
-            if agency:
-                agency.save()
-                j += 1
-            i += 1
-        return jsonify({"message": f"[{j}/{i} agencies added successfully"}), 201
+        results = create_many(Agency, data)
+        j = len([r for r in results if r['status'] == 'created'])
+        return jsonify({"message": f"{j}/{len(data)} agencies added successfully",
+                        "results": results}), 201 if j else 200
 
     if type(data) is not dict:
         raise BadRequest(description='Not a JSON')
@@ -59,9 +68,9 @@ def add_agency(agency_id=None):
 def delete_agency(agency_id=None):
     """Deletes agency using given id.
     """
-    results = fetch_process(Agency, filter, agency_id)
-    if results:
-        storage.delete(results[0])
+    agency = fetch_data_id(Agency, agency_id)
+    if agency:
+        storage.delete(agency)
         storage.save()
         return jsonify({}), 200
     raise NotFound()
@@ -71,13 +80,12 @@ def update_agency(agency_id=None):
     """
     table_cols = ('id', 'created_at', 'updated_at')
 
-    results = fetch_process(Agency, filter, agency_id)
+    agency_old = fetch_data_id(Agency, agency_id)
 
-    if results:
+    if agency_old:
         data = request.get_json()
         if type(data) is not dict:
             raise BadRequest(description='Not a JSON')
-        agency_old = results[0]
         for key, value in data.items():
             if key not in table_cols:
                 setattr(agency_old, key, value)
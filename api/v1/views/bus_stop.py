@@ -6,24 +6,24 @@ from backend.models import storage
 from backend.models import BusStop
 from flask import jsonify, request
 from werkzeug.exceptions import NotFound, MethodNotAllowed, BadRequest
-from .commons import (fetch_data, fetch_data_id, fetch_process,
-                      reach_endpoint, allows)
+from .commons import (fetch_data_id, collection_response, wants_page,
+                      page_response, wants_stream, stream_response,
+                      reach_endpoint, allows, create_many)
 
 
 def get_bus_stop(bus_stop_id=None):
     """Returns the bus stop using the given id.
     """
-    bus_stops = fetch_data(BusStop)
-    if not bus_stops:
-        return jsonify(
-            {"error": "No bus stops found"}), 404
-
     if bus_stop_id:
-        results = [v.to_dict() for v in bus_stops if v.id == bus_stop_id]
-    else:
-        results = [v.to_dict() for v in bus_stops]
+        bus_stop = fetch_data_id(BusStop, bus_stop_id)
+        return jsonify([bus_stop.to_dict()] if bus_stop else [])
+
+    if wants_stream():
+        return stream_response(BusStop)
+    if wants_page():
+        return page_response(BusStop)
 
-    return jsonify(results)
+    return collection_response(BusStop, "No bus stops found")
 
 def add_bus_stop(bus_stop_id=None):
     """Add new bus stop into the system.
@@ -33,19 +33,15 @@ def add_bus_stop(bus_stop_id=None):
         raise BadRequest(description='Not a JSON')
 
     if type(data) == list and len(data) > 0:
-        i = 0
-        j = 0
         for sub in data:
             if type(sub) is not dict:
                 raise BadRequest(description='Not a JSON')
             if 'name' not in sub:
                 raise BadRequest(description='Missing name')
-            bus_stop = storage.get_or_create(BusStop, **sub)
-            if bus_stop:
-                bus_stop.save()
-                j += 1
-            i += 1
-        return jsonify({"message": f"[{j}/{i} bus stops added successfully"}), 201
+        results = create_many(BusStop, data)
+        j = len([r for r in results if r['status'] == 'created'])
+        return jsonify({"message": f"{j}/{len(data)} bus stops added successfully",
+                        "results": results}), 201 if j else 200
 
     if type(data) is not dict:
         raise BadRequest(description='Not a JSON')
@@ -59,9 +55,9 @@ def add_bus_stop(bus_stop_id=None):
 def delete_bus_stop(bus_stop_id=None):
     """Deletes bus stop using given id.
     """
-    results = fetch_process(BusStop, filter, bus_stop_id)
-    if results:
-        storage.delete(results[0])
+    bus_stop = fetch_data_id(BusStop, bus_stop_id)
+    if bus_stop:
+        storage.delete(bus_stop)
         storage.save()
         return jsonify({}), 200
     raise NotFound()
@@ -71,13 +67,12 @@ def update_bus_stop(bus_stop_id=None):
     """
     table_cols = ('id', 'created_at', 'updated_at')
 
-    results = fetch_process(BusStop, filter, bus_stop_id)
+    bus_stop_old = fetch_data_id(BusStop, bus_stop_id)
 
-    if results:
+    if bus_stop_old:
         data = request.get_json()
         if type(data) is not dict:
             raise BadRequest(description='Not a JSON')
-        bus_stop_old = results[0]
         for key, value in data.items():
             if key not in table_cols:
                 setattr(bus_stop_old, key, value)
@@ -1,43 +1,288 @@
 #!/usr/bin/bash
 """Has functions and other items common to all views"""
-from flask import current_app, jsonify
+import base64
+import gzip
+import hashlib
+import json
+import threading
+from datetime import datetime
+from itertools import chain
+from time import monotonic
+from urllib.parse import urlencode
+from flask import (current_app, jsonify, request, Response,
+                   stream_with_context)
+from werkzeug.exceptions import BadRequest
 from backend.models import storage
+from backend.models.base_model import BaseModel
 
 
 # Variables
 err_msg = ['Not a JSON', 'Missing name']
 allows = ['GET', 'POST', 'DELETE', 'PUT']
+page_args = ('limit', 'cursor', 'fields')
+page_default = 100
+page_max = 1000
+stream_formats = {'ndjson': 'application/x-ndjson',
+                  'json': 'application/json'}
+stream_batch = 500
+# relationship names of the db models -> file storage property names
+include_aliases = {'bus_stops': 'stops'}
+# class name -> (generation, expiry, etag, body, gzipped body) of full
+# listings; the expiry is None when the generations are shared
+serialized = {}
+serialized_lock = threading.Lock()
 
 
 # helpers
-def manipulate(fn, id_, data):
-    """A helper func that applies a given function on data using id_"""
-    if fn is filter:
-        return list(filter(lambda x: x.id == id_, data))
-    elif fn is map:
-        return list(map(lambda x: x.to_dict(), data))
-
-def fetch_data(obj):
-    """Retrieves data from data base"""
+def fetch_data(obj, filters=None, order_by=None, limit=None, offset=None,
+               include=None):
+    """Retrieves data from data base, filtered and sliced by the storage"""
     try:
-        return storage.all(obj).values()
+        return storage.query(obj, filters=filters, order_by=order_by,
+                             limit=limit, offset=offset, include=include)
     except Exception as e:
         print(f"----------------Error fetching data: {e}----------------")
         return []
 
 
-def fetch_data_id(obj, id_):
-    """Retrieves data from data base"""
+def fetch_data_id(obj, id_, include=None):
+    """Retrieves a single object from data base by its id"""
     try:
-        return storage.get(obj, id_)
+        return storage.get(obj, id_, include=include)
     except Exception as e:
-        return {"error": str(e)}
+        print(f"----------------Error fetching data: {e}----------------")
+        return None
+
+
+def create_many(obj, rows):
+    """Creates the rows of a list POST with storage.bulk_create; keys
+    that are not fields of obj answer 400"""
+    try:
+        return storage.bulk_create(obj, rows)
+    except KeyError as e:
+        raise BadRequest(description=str(e.args[0]))
+
+
+def encode_cursor(row):
+    """Builds the opaque cursor pointing after the given row"""
+    created_at = row['created_at'] if type(row) is dict else row.created_at
+    id_ = row['id'] if type(row) is dict else row.id
+    raw = json.dumps([created_at.isoformat(), id_]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the (created_at, id) tuple stored in a cursor"""
+    try:
+        created_at, id_ = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(created_at), id_)
+    except (ValueError, TypeError):
+        raise BadRequest(description='Invalid cursor')
+
+
+def parse_fields():
+    """Returns the list of columns asked for with fields=, or None"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return list(dict.fromkeys(f.strip() for f in fields.split(',')
+                              if f.strip()))
 
 
-def fetch_process(obj, fn, id_):
-    """Retrieve and process data"""
-    data = fetch_data(obj)
-    return manipulate(fn, id_, data)
+def parse_include(allowed):
+    """Returns the relationships asked for with include=, or None.
+    Names outside allowed are rejected with a 400.
+    """
+    include = request.args.get('include')
+    if not include:
+        return None
+    names = list(dict.fromkeys(i.strip() for i in include.split(',')
+                               if i.strip()))
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise BadRequest(description='Unknown include: {}'.format(
+            ', '.join(unknown)))
+    return names
+
+
+def embed(obj, include=None):
+    """Returns obj.to_dict() with the included relationships embedded"""
+    data = obj.to_dict()
+    for name in include or ():
+        value = getattr(obj, include_aliases.get(name, name), [])
+        if value is None or isinstance(value, BaseModel):
+            data[name] = value.to_dict() if value is not None else None
+        else:
+            data[name] = [v.to_dict() for v in value]
+    return data
+
+
+def serialize_row(row, fields=None):
+    """Turns a storage row (object or projected dict) into a JSON dict"""
+    if fields is None:
+        return row.to_dict()
+    return {f: (row[f].isoformat() if isinstance(row[f], datetime)
+                else row[f]) for f in fields}
+
+
+def fresh_entry(entry, generation):
+    """Tells whether a serialized entry may still be served"""
+    return entry is not None and entry[0] == generation and \
+        (entry[1] is None or entry[1] > monotonic())
+
+
+def serialized_collection(obj):
+    """Returns (etag, body, gzipped body) of the full listing of obj,
+    encoded once per write generation of its class, or None if empty.
+    Unless the generations are shared between processes, the writes of
+    other processes go unseen, so the blob also expires after the
+    cache TTL, as the cached rows do.
+    """
+    name = obj.__name__
+    generation = storage.generation(obj)
+    entry = serialized.get(name)
+    if fresh_entry(entry, generation):
+        return entry[2:]
+    with serialized_lock:
+        entry = serialized.get(name)
+        if fresh_entry(entry, generation):
+            return entry[2:]
+        rows = fetch_data(obj)
+        if not rows:
+            return None
+        body = current_app.json.dumps([v.to_dict() for v in rows]).encode()
+        expiry = None if storage.shared_generations() \
+            else monotonic() + storage.ttl
+        entry = (generation, expiry, hashlib.sha1(body).hexdigest(), body,
+                 gzip.compress(body, compresslevel=6))
+        serialized[name] = entry
+    return entry[2:]
+
+
+def collection_response(obj, empty_msg):
+    """Returns the full listing of obj from its pre-serialized blob.
+    The response carries a strong ETag; a matching If-None-Match gets a
+    304 with no body, and gzip capable clients get the compressed blob.
+    """
+    entry = serialized_collection(obj)
+    if entry is None:
+        return jsonify({"error": empty_msg}), 404
+    etag, body, gzipped = entry
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif request.accept_encodings['gzip']:
+        response = Response(gzipped, mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def wants_page():
+    """Tells whether the request asks for a paginated or projected listing"""
+    return any(arg in request.args for arg in page_args)
+
+
+def page_response(obj, include=None):
+    """Returns one keyset page of obj following the request's limit,
+    cursor and fields arguments.
+    The body stays a JSON array; the cursor of the next page, if any,
+    is sent in the X-Next-Cursor and Link headers.
+    include is ignored when fields projects the rows.
+    """
+    args = request.args
+    limit = args.get('limit')
+    cursor = args.get('cursor')
+    fields = parse_fields()
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise BadRequest(description='limit must be a positive integer')
+        limit = min(int(limit), page_max)
+    elif cursor:
+        limit = page_default
+    after = decode_cursor(cursor) if cursor else None
+
+    if fields:
+        # the cursor keys are always selected, then dropped if not asked for
+        selected = fields + [f for f in ('created_at', 'id') if f not in fields]
+    else:
+        selected = None
+    if fields:
+        include = None
+    try:
+        rows = storage.page(obj, limit=limit, after=after, fields=selected,
+                            include=include)
+    except KeyError as e:
+        raise BadRequest(description=str(e.args[0]))
+
+    if include:
+        response = jsonify([embed(row, include) for row in rows])
+    else:
+        response = jsonify([serialize_row(row, fields) for row in rows])
+
+    if limit is not None and len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1])
+        params = request.args.to_dict()
+        params['cursor'] = next_cursor
+        params['limit'] = str(limit)
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = '<{}?{}>; rel="next"'.format(
+            request.base_url, urlencode(params))
+    return response
+
+
+def wants_stream():
+    """Tells whether the request asks for a streamed listing, either with
+    stream=ndjson|json or with an Accept: application/x-ndjson header"""
+    if request.args.get('stream') in stream_formats:
+        return True
+    return request.accept_mimetypes.best == stream_formats['ndjson']
+
+
+def stream_response(obj):
+    """Streams every row of obj as NDJSON or as a chunked JSON array.
+    Rows are pulled from storage in batches and written out as soon as a
+    batch is encoded, so memory stays flat whatever the table size.
+    Related objects are not embedded: include= answers 400.
+    """
+    if request.args.get('include'):
+        raise BadRequest(description='include is not supported with stream')
+    fmt = request.args.get('stream')
+    if fmt not in stream_formats:
+        fmt = 'ndjson'
+    fields = parse_fields()
+    try:
+        rows = storage.stream(obj, batch_size=stream_batch, fields=fields)
+        # pull the first row now so bad fields fail before headers are sent
+        first = next(rows, None)
+    except KeyError as e:
+        raise BadRequest(description=str(e.args[0]))
+    # the app's encoder, orjson when installed, as for jsonify()
+    dumps = current_app.json.dumps
+
+    def generate():
+        head = [first] if first is not None else []
+        chunk = []
+        if fmt == 'json':
+            yield '['
+        for n, row in enumerate(chain(head, rows)):
+            line = dumps(serialize_row(row, fields))
+            if fmt == 'ndjson':
+                chunk.append(line + '\n')
+            else:
+                chunk.append(',' + line if n else line)
+            if len(chunk) >= stream_batch:
+                yield ''.join(chunk)
+                chunk = []
+        if fmt == 'json':
+            chunk.append(']')
+        yield ''.join(chunk)
+
+    return Response(stream_with_context(generate()),
+                    mimetype=stream_formats[fmt])
 
 
 def reach_endpoint(endpoints):
@@ -71,3 +316,31 @@ def fetch_data_url(url):
     else:
         print(f"Error fetching data: {response.status_code} - {response.text}")
         return {"error": "Failed to fetch data"}, response.status_code
+
+
+def iter_data_url(url, fields=None):
+    """Streams the rows of an internal list URL one dict at a time.
+    The listing is requested as NDJSON and parsed line by line, so the
+    caller never holds the whole collection in memory.
+    """
+    params = {'stream': 'ndjson'}
+    if fields:
+        params['fields'] = ','.join(fields)
+    client = current_app.test_client()
+    response = client.get(url, query_string=params, buffered=False)
+    if response.status_code != 200:
+        print(f"Error fetching data: {response.status_code} - {response.text}")
+        response.close()
+        return
+    try:
+        pending = b''
+        for chunk in response.iter_encoded():
+            pending += chunk
+            *lines, pending = pending.split(b'\n')
+            for line in lines:
+                if line:
+                    yield json.loads(line)
+        if pending.strip():
+            yield json.loads(pending)
+    finally:
+        response.close()
@@ -1,10 +1,10 @@
 import pandas as pd
-import joblib
+from api.v1.ml.registry import registry
 
 # Load model and feature structure
-model = joblib.load("rf_demand_model.joblib")
-feature_columns = joblib.load("rf_demand_columns.joblib")
-day_categories = joblib.load("day_categories.joblib")
+model = registry.get('demand_model')
+feature_columns = registry.get('demand_columns')
+day_categories = registry.get('demand_day_categories')
 
 # Example user input
 input_dict = {"agency_id": 23, "day_name": "monday"}
@@ -7,6 +7,13 @@ import pandas as pd
 import joblib
 import os
 import requests
+from api.v1.ml import demand, travel_time
+from api.v1.ml.registry import ArtifactMissing
+from api.v1.ml.client import CircuitOpen
+from api.v1.ml.executor import Overloaded
+
+# largest number of (agency, day) pairs a batch may ask for
+batch_max = int(os.getenv("UMPIRE_DEMAND_BATCH_MAX", 10000))
 
 
 # def data_input(input_dict, feature_s, feature_categories):
@@ -73,33 +80,126 @@ import requests
 
 
 
+def demand_input(data):
+    """Returns the (agency_id, day_name) pair of one input, or raises
+    ValueError with the reason it is invalid"""
+    if not data.get('agency_id'):
+        raise ValueError("agency_id is required")
+    if not data.get('day_name'):
+        raise ValueError("day_name is required")
+    try:
+        agency_id = int(data['agency_id'])
+    except (TypeError, ValueError):
+        raise ValueError("agency_id is not int") from None
+    if type(data['day_name']) != str:
+        raise ValueError("day_name is not a string")
+    return agency_id, data['day_name'].lower()
+
+
 @app_views.route('/demand_prediction', methods=['GET'])
 def get_demand_prediction():
-    """Sends input to ML service and returns demand prediction."""
+    """Returns the demand prediction of an agency on a day.
+    Args (JSON body or query string):
+        agency_id (int): The agency
+        day_name (str): The day of the week
+    """
+    input_data = request.get_json(silent=True) or request.args.to_dict()
+    if not input_data:
+        return jsonify({"error": "No input data provided"}), 400
+    try:
+        agency_id, day_name = demand_input(input_data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if demand.backend == "remote":
+        try:
+            prediction_data, status = demand.predict_remote(agency_id,
+                                                            day_name)
+        except CircuitOpen:
+            return jsonify({"error": "Prediction service is unavailable"}), 503
+        except requests.exceptions.Timeout:
+            return jsonify({"error": "Prediction service timed out"}), 504
+        except requests.exceptions.RequestException as e:
+            return jsonify({"error": f"Failed to fetch prediction: {str(e)}"}), 500
+        return jsonify(prediction_data), status
+
+    try:
+        prediction = demand.predict_cached([(agency_id, day_name)])
+    except ArtifactMissing as e:
+        print(f"Demand model unavailable: {e}")
+        return jsonify({"error": "Demand model is not available"}), 503
+    except Overloaded:
+        return jsonify({"error": "Too many predictions in progress"}), 503
+    except TimeoutError:
+        return jsonify({"error": "Prediction timed out"}), 504
+    return jsonify({"predicted_demand": prediction[0]}), 200
+
+
+@app_views.route('/demand_prediction/batch', methods=['POST'])
+def post_demand_batch():
+    """Predicts the demand of many (agency, day) pairs in one call.
+    Body, either a list of inputs:
+        {"inputs": [{"agency_id": .., "day_name": ..}]}
+    or a cross product (days defaults to the whole week):
+        {"agency_ids": [..], "days": [..]}
+    Returns the predictions in input order, each with its values and
+    either predicted_demand or an error.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({"error": "Not a JSON"}), 400
+    if 'inputs' in body:
+        inputs = body['inputs']
+    else:
+        agency_ids = body.get('agency_ids')
+        days = body.get('days', list(travel_time.days))
+        if not isinstance(agency_ids, list) or not isinstance(days, list):
+            return jsonify({"error": "agency_ids and days must be lists"}), 400
+        inputs = [{"agency_id": agency_id, "day_name": day}
+                  for agency_id in agency_ids for day in days]
+    if not isinstance(inputs, list) or \
+            not all(isinstance(i, dict) for i in inputs):
+        return jsonify({"error": "inputs must be a list of objects"}), 400
+    if len(inputs) > batch_max:
+        return jsonify({"error": "batch of {} inputs is over {}".format(
+            len(inputs), batch_max)}), 400
+
+    results = []
+    pairs = []
+    for data in inputs:
+        row = {"agency_id": data.get("agency_id"),
+               "day_name": data.get("day_name")}
+        try:
+            pairs.append(demand_input(data))
+        except ValueError as e:
+            row["error"] = str(e)
+        results.append(row)
+
+    if demand.backend == "remote":
+        pending = iter(pairs)
+        for row in results:
+            if "error" in row:
+                continue
+            try:
+                prediction_data, status = demand.predict_remote(*next(pending))
+            except requests.exceptions.RequestException as e:
+                prediction_data, status = {"error": str(e)}, 500
+            if status == 200:
+                row.update(prediction_data)
+            else:
+                row["error"] = prediction_data.get("error", "Failed to fetch prediction")
+        return jsonify({"predictions": results}), 200
 
     try:
-        prediction_url = "https://ml-prediction-103109607498.europe-west1.run.app/"
-        
-        if request.method != 'GET':
-            return jsonify({"error": "Method not allowed"}), 405
-        input_data = request.get_json(silent=True)
-        if not input_data:
-            return jsonify({"error": "No input data provided"}), 400
-        if 'agency_id' not in input_data or not input_data['agency_id']:
-            return jsonify({"error": "agency_id is required"}), 400
-        if 'day_name' not in input_data or not input_data['day_name']:
-            return jsonify({"error": "day_name is required"}), 400
-        
-        input_data['day_name'] = input_data['day_name'].lower()  # Ensure day_name is lowercase
-        input_data['agency_id'] = int(input_data['agency_id'])  # Ensure agency_id is an integer
-        
-        response = requests.post(prediction_url, json=input_data)
-        print(f"==========Response status code: {response.status_code}==========")
-        if response.status_code != 200:
-            return jsonify({"error": "Failed to fetch prediction"}), response.status_code
-
-        prediction_data = response.json()
-        return jsonify(prediction_data), 200
-
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Failed to fetch prediction: {str(e)}"}), 500
\ No newline at end of file
+        predictions = iter(demand.predict_cached(pairs))
+    except ArtifactMissing as e:
+        print(f"Demand model unavailable: {e}")
+        return jsonify({"error": "Demand model is not available"}), 503
+    except Overloaded:
+        return jsonify({"error": "Too many predictions in progress"}), 503
+    except TimeoutError:
+        return jsonify({"error": "Prediction timed out"}), 504
+    for row in results:
+        if "error" not in row:
+            row["predicted_demand"] = next(predictions)
+    return jsonify({"predictions": results}), 200
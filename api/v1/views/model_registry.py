@@ -0,0 +1,35 @@
+#!/usr/bin/python3
+"""Renders the state of the loaded ML models"""
+from api.v1.views import app_views
+from api.v1.ml.registry import registry
+from api.v1.ml.grid import grid
+from api.v1.ml import prediction_cache
+from api.v1.ml.executor import executor
+from flask import jsonify
+
+
+@app_views.route('/models', methods=['GET'])
+def get_models():
+    """Returns, for each model artifact, its version, load time
+    and memory"""
+    return jsonify(registry.stats()), 200
+
+
+@app_views.route('/models/travel_time_grid', methods=['GET'])
+def get_travel_time_grid():
+    """Returns the size and freshness of the precomputed travel times"""
+    return jsonify(grid.stats()), 200
+
+
+@app_views.route('/models/prediction_cache', methods=['GET'])
+def get_prediction_cache():
+    """Returns the size and hit/miss/eviction counters of the cached
+    predictions of each model"""
+    return jsonify(prediction_cache.stats()), 200
+
+
+@app_views.route('/models/executor', methods=['GET'])
+def get_executor():
+    """Returns the workers, queue length and batch counters of the
+    inference executor"""
+    return jsonify(executor.stats()), 200
@@ -8,24 +8,37 @@ from backend.models import Route, Agency
 from flask import jsonify, request
 from werkzeug.exceptions import NotFound, MethodNotAllowed, BadRequest
 
-from .commons import (fetch_data, fetch_data_id, fetch_process,
-                      reach_endpoint, allows)
+from .commons import (fetch_data, fetch_data_id, parse_include, embed,
+                      collection_response, wants_page, page_response,
+                      wants_stream, stream_response, reach_endpoint, allows,
+                      create_many)
+
+# relationships that can be embedded with include=
+route_includes = ('bus_stops', 'terminals', 'vehicles', 'agencies')
 
 
 def get_route(route_id=None):
     """Returns the route using the given id.
     """
-    routes = fetch_data(Route)
+    include = parse_include(route_includes)
+    if route_id:
+        route = fetch_data_id(Route, route_id, include=include)
+        return jsonify([embed(route, include)] if route else [])
+
+    if wants_stream():
+        return stream_response(Route)
+    if wants_page():
+        return page_response(Route, include=include)
+
+    if not include:
+        return collection_response(Route, "No routes found")
+
+    routes = fetch_data(Route, include=include)
     if not routes:
         return jsonify(
             {"error": "No routes found"}), 404
 
-    if route_id:
-        results = [v.to_dict() for v in routes if v.id == route_id]
-    else:
-        results = [v.to_dict() for v in routes]
-
-    return jsonify(results)
+    return jsonify([embed(v, include) for v in routes])
 
 @app_views.route('/route/<path:route_name>', methods=['GET'])
 def get_route_by_name(route_name=None):
@@ -35,11 +48,12 @@ def get_route_by_name(route_name=None):
     if not route_name:
         return jsonify({"error": "Route name is required"}), 400
 
-    route = storage.get_one_by(Route, name=route_name)
+    include = parse_include(route_includes)
+    route = storage.get_one_by(Route, name=route_name, include=include)
     if not route:
         return jsonify({"error": "Route not found"}), 404
 
-    return jsonify(route.to_dict()), 200
+    return jsonify(embed(route, include)), 200
 
 @app_views.route('/route/<path:route_name>/agencies', methods=['GET'])
 def get_route_agencies(route_name=None):
@@ -49,7 +63,8 @@ def get_route_agencies(route_name=None):
     try:
         print("Fetching agencies for route:", route_name)
 
-        route = storage.get_one_by(Route, name=route_name)
+        route = storage.get_one_by(Route, name=route_name,
+                                   include=['agencies'])
         if route and route.agencies:
             agencies = [agency.agency_id for agency in route.agencies]
             if not agencies:
@@ -70,19 +85,15 @@ def add_route(route_id=None):
         raise BadRequest(description='Not a JSON')
 
     if type(data) == list and len(data) > 0:
-        i = 0
-        j = 0
         for sub in data:
             if type(sub) is not dict:
                 raise BadRequest(description='Not a JSON')
             if 'name' not in sub:
                 raise BadRequest(description='Missing name')
-            route = storage.get_or_create(Route, **sub)
-            if route:
-                route.save()
-                j += 1
-            i += 1
-        return jsonify({"message": f"[{j}/{i} routes added successfully"}), 201
+        results = create_many(Route, data)
+        j = len([r for r in results if r['status'] == 'created'])
+        return jsonify({"message": f"{j}/{len(data)} routes added successfully",
+                        "results": results}), 201 if j else 200
 
     if type(data) is not dict:
         raise BadRequest(description='Not a JSON')
@@ -96,9 +107,9 @@ def add_route(route_id=None):
 def delete_route(route_id=None):
     """Deletes route using given id.
     """
-    results = fetch_process(Route, filter, route_id)
-    if results:
-        storage.delete(results[0])
+    route = fetch_data_id(Route, route_id)
+    if route:
+        storage.delete(route)
         storage.save()
         return jsonify({}), 200
     raise NotFound()
@@ -108,13 +119,12 @@ def update_route(route_id=None):
     """
     table_cols = ('id', 'created_at', 'updated_at')
 
-    results = fetch_process(Route, filter, route_id)
+    route_old = fetch_data_id(Route, route_id)
 
-    if results:
+    if route_old:
         data = request.get_json()
         if type(data) is not dict:
             raise BadRequest(description='Not a JSON')
-        route_old = results[0]
         for key, value in data.items():
             if key not in table_cols:
                 setattr(route_old, key, value)
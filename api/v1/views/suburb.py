@@ -7,23 +7,23 @@ from backend.models import Suburb
 
 from flask import jsonify, request
 from werkzeug.exceptions import NotFound, MethodNotAllowed, BadRequest
-from .commons import (fetch_data, fetch_process,
-                      reach_endpoint, allows)
+from .commons import (fetch_data_id, collection_response, wants_page,
+                      page_response, wants_stream, stream_response,
+                      reach_endpoint, allows, create_many)
 
 def get_suburb(suburb_id=None):
     """Returns the suburb using the given id.
     """
-    sub_all = fetch_data(Suburb)
-    if not sub_all:
-        return jsonify(
-            {"error": "No suburbs found"}), 404
-    
     if suburb_id:
-        results = [v.to_dict() for v in sub_all if v.id == suburb_id]
-    else:
-        results = [v.to_dict() for v in sub_all]
+        suburb = fetch_data_id(Suburb, suburb_id)
+        return jsonify([suburb.to_dict()] if suburb else [])
+
+    if wants_stream():
+        return stream_response(Suburb)
+    if wants_page():
+        return page_response(Suburb)
 
-    return jsonify(results)
+    return collection_response(Suburb, "No suburbs found")
 
 def add_suburb(suburb_id=None):
     """Add new suburb into the system.
@@ -33,16 +33,15 @@ def add_suburb(suburb_id=None):
         raise BadRequest(description='Not a JSON')
 
     if type(data) == list and len(data) > 0:
-        i = 0
         for sub in data:
             if type(sub) is not dict:
                 raise BadRequest(description='Not a JSON')
             if 'name' not in sub:
                 raise BadRequest(description='Missing name')
-            sub_obj = Suburb(**sub)
-            sub_obj.save()
-            i += 1
-        return jsonify({"message": f"{i} suburbs added successfully"}), 201
+        results = create_many(Suburb, data)
+        i = len([r for r in results if r['status'] == 'created'])
+        return jsonify({"message": f"{i} suburbs added successfully",
+                        "results": results}), 201 if i else 200
 
     if type(data) is not dict:
         raise BadRequest(description='Not a JSON')
@@ -57,9 +56,9 @@ def add_suburb(suburb_id=None):
 def delete_suburb(suburb_id=None):
     """Deletes suburb using given id.
     """
-    results = fetch_process(Suburb, filter, suburb_id)
-    if results:
-        storage.delete(results[0])
+    suburb = fetch_data_id(Suburb, suburb_id)
+    if suburb:
+        storage.delete(suburb)
         storage.save()
         return jsonify({}), 200
     raise NotFound()
@@ -70,13 +69,12 @@ def update_suburb(suburb_id=None):
     """
     table_cols = ('id', 'created_at', 'updated_at')
 
-    results = fetch_process(Suburb, filter, suburb_id)
+    sub_old = fetch_data_id(Suburb, suburb_id)
 
-    if results:
+    if sub_old:
         data = request.get_json()
         if type(data) is not dict:
             raise BadRequest(description='Not a JSON')
-        sub_old = results[0]
         for key, value in data.items():
             if key not in table_cols:
                 setattr(sub_old, key, value)
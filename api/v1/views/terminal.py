@@ -6,24 +6,37 @@ from backend.models import storage
 from backend.models import Terminal
 from flask import jsonify, request
 from werkzeug.exceptions import NotFound, MethodNotAllowed, BadRequest
-from .commons import (fetch_data, fetch_data_id, fetch_process,
-                      reach_endpoint, allows)
+from .commons import (fetch_data, fetch_data_id, parse_include, embed,
+                      collection_response, wants_page, page_response,
+                      wants_stream, stream_response, reach_endpoint, allows,
+                      create_many)
+
+# relationships that can be embedded with include=
+terminal_includes = ('suburb', 'routes', 'agencies')
 
 
 def get_terminal(terminal_id=None):
     """Returns the terminal using the given id.
     """
-    terminals = fetch_data(Terminal)
+    include = parse_include(terminal_includes)
+    if terminal_id:
+        terminal = fetch_data_id(Terminal, terminal_id, include=include)
+        return jsonify([embed(terminal, include)] if terminal else [])
+
+    if wants_stream():
+        return stream_response(Terminal)
+    if wants_page():
+        return page_response(Terminal, include=include)
+
+    if not include:
+        return collection_response(Terminal, "No terminals found")
+
+    terminals = fetch_data(Terminal, include=include)
     if not terminals:
         return jsonify(
             {"error": "No terminals found"}), 404
 
-    if terminal_id:
-        results = [v.to_dict() for v in terminals if v.id == terminal_id]
-    else:
-        results = [v.to_dict() for v in terminals]
-
-    return jsonify(results)
+    return jsonify([embed(v, include) for v in terminals])
 
 def add_terminal(terminal_id=None):
     """Add new terminal into the system.
@@ -33,19 +46,15 @@ def add_terminal(terminal_id=None):
         raise BadRequest(description='Not a JSON')
 
     if type(data) == list and len(data) > 0:
-        i = 0
-        j = 0
         for sub in data:
             if type(sub) is not dict:
                 raise BadRequest(description='Not a JSON')
             if 'name' not in sub:
                 raise BadRequest(description='Missing name')
-            terminal = storage.get_or_create(Terminal, **sub)
-            if terminal:
-                terminal.save()
-                j += 1
-            i += 1
-        return jsonify({"message": f"[{j}/{i} terminals added successfully"}), 201
+        results = create_many(Terminal, data)
+        j = len([r for r in results if r['status'] == 'created'])
+        return jsonify({"message": f"{j}/{len(data)} terminals added successfully",
+                        "results": results}), 201 if j else 200
 
     if type(data) is not dict:
         raise BadRequest(description='Not a JSON')
@@ -59,9 +68,9 @@ def add_terminal(terminal_id=None):
 def delete_terminal(terminal_id=None):
     """Deletes terminal using given id.
     """
-    results = fetch_process(Terminal, filter, terminal_id)
-    if results:
-        storage.delete(results[0])
+    terminal = fetch_data_id(Terminal, terminal_id)
+    if terminal:
+        storage.delete(terminal)
         storage.save()
         return jsonify({}), 200
     raise NotFound()
@@ -71,13 +80,12 @@ def update_terminal(terminal_id=None):
     """
     table_cols = ('id', 'created_at', 'updated_at')
 
-    results = fetch_process(Terminal, filter, terminal_id)
+    terminal_old = fetch_data_id(Terminal, terminal_id)
 
-    if results:
+    if terminal_old:
         data = request.get_json()
         if type(data) is not dict:
             raise BadRequest(description='Not a JSON')
-        terminal_old = results[0]
         for key, value in data.items():
             if key not in table_cols:
                 setattr(terminal_old, key, value)
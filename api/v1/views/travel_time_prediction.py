@@ -1,15 +1,23 @@
 #!/usr/bin/python3
 """Renders predicted demand info"""
 from api.v1.views import app_views
-from flask import jsonify, request
+from flask import jsonify, request, Response, stream_with_context
 from werkzeug.exceptions import NotFound, MethodNotAllowed, BadRequest
-import pandas as pd
-import joblib
+import json
 import os
+from api.v1.ml.registry import registry, ArtifactMissing
+from api.v1.ml import travel_time
+from api.v1.ml import grid as travel_grid
+from api.v1.ml.executor import Overloaded
 from backend.models import storage
 from backend.models import Route
 import datetime
 
+# largest number of inputs a batch may ask for (all routes x 7 x 24 fits)
+batch_max = int(os.getenv("UMPIRE_BATCH_MAX", 200000))
+# inputs per transform()/predict() call; results stream after each one
+batch_chunk = int(os.getenv("UMPIRE_BATCH_CHUNK", 50000))
+
 @app_views.route('/travel_time_prediction', methods=['GET'])
 def get_travel_time_prediction():
     """Returns the travel time prediction.
@@ -25,63 +33,152 @@ def get_travel_time_prediction():
     day_name = request.args.get("day_name")   
     if not route_id or not day_name:
         return jsonify({"error": "Route ID and day_name are required"}), 400
-    
+    # the grid and the cached predictions are keyed on lowercase days
+    day_name = day_name.lower()
+
     # fetch the route details
-    route = storage.get_one_by(Route, id=route_id)
+    route = storage.get(Route, route_id, include=['bus_stops'])
     if not route:
         return jsonify({"error": "Route not found"}), 404
     route_stops = route.bus_stops if route.bus_stops else []
     if not route_stops:
         return jsonify({"error": "Route has no stops"}), 404
     
-    route_type = "bus"
-    origin = route.name.split(" to ")[0] if " to " in route.name else route.name
-    destination = route.name.split(" to ")[-1] if " to " in route.name else route.name
-
     hour_of_day = datetime.datetime.now().hour
-    trip_distance_km = route.distance_km if hasattr(route, 'distance_km') else 5.0
+    error = check_input({route.id: route}, route.id, day_name, hour_of_day)
+    if error:
+        return jsonify({"error": error}), 400
 
+    # Model and feature structure, loaded once per process
+    try:
+        feature_columns = registry.get('travel_time_features')
+        travel_time.models()
+    except ArtifactMissing as e:
+        print(f"Travel time model unavailable: {e}")
+        return jsonify({"error": "Travel time model is not available"}), 503
 
-    sample_input = {
-        "route_type": route_type,
-        "hour_of_day": hour_of_day,
-        "trip_distance_km": trip_distance_km,
-        "day_name": day_name,
-        "origin": origin,
-        "destination": destination
-    }
+    # precomputed (route, day, hour) grid: an array lookup, no model run
+    prediction = None
+    if travel_grid.enabled:
+        prediction = travel_grid.grid.lookup(route.id, day_name, hour_of_day)
+    if prediction is None:
+        # memoized on the feature values and the model version
+        try:
+            prediction = travel_time.predict_cached(
+                [(route, day_name, hour_of_day)])[0]
+            print("Predicted travel time:", prediction)
+        except Overloaded:
+            return jsonify({"error": "Too many predictions in progress"}), 503
+        except TimeoutError:
+            return jsonify({"error": "Prediction timed out"}), 504
+        except Exception as e:
+            print(f"Error during prediction: {e}")
+            return jsonify({"error_prediction": "Prediction failed"}), 500
+    return jsonify({
+        "message": "Travel time prediction model loaded successfully.",
+        "feature_columns": [i for i in feature_columns],
+        "prediction": prediction
+    }), 200
 
-    # Load model and feature structure
 
-    # ur = f"https://ml-prediction-103109607498.europe-west1.run.app"
-    categories={'day_name': ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']}
-    print("Loading travel time prediction model...")
-    path = os.path.dirname(os.path.abspath(__file__))
-    loaded_model = joblib.load(os.path.join(path, "ml_model_travel_time_rf_travel_time_model.joblib"))
-    feature_columns = joblib.load(os.path.join(path, "ml_model_travel_time_travel_time_features.joblib"))
-    preprocessor = joblib.load(os.path.join(path, "ml_model_travel_time_travel_time_preprocessor.joblib"))
-    print("Model loaded successfully.")
+def batch_inputs(body):
+    """Returns the (route_id, day_name, hour_of_day) inputs of a batch
+    request, either listed or as a cross product"""
+    if not isinstance(body, dict):
+        raise BadRequest(description="Not a JSON")
+    if 'inputs' in body:
+        inputs = body['inputs']
+        if not isinstance(inputs, list) or \
+                not all(isinstance(i, dict) for i in inputs):
+            raise BadRequest(description="inputs must be a list of objects")
+        hour = datetime.datetime.now().hour
+        return [(i.get('route_id'), i.get('day_name'),
+                 i.get('hour_of_day', hour)) for i in inputs]
+    route_ids = body.get('route_ids')
+    if route_ids is None:
+        route_ids = [route.id for route in storage.all(Route).values()]
+    day_names = body.get('days', travel_time.days)
+    hours = body.get('hours', travel_time.hours)
+    for name, value in (('route_ids', route_ids), ('days', day_names),
+                        ('hours', hours)):
+        if not isinstance(value, (list, tuple)):
+            raise BadRequest(description="{} must be a list".format(name))
+    count = len(route_ids) * len(day_names) * len(hours)
+    if count > batch_max:
+        raise BadRequest(description="batch of {} inputs is over {}".format(
+            count, batch_max))
+    return [(route_id, day_name, hour) for route_id in route_ids
+            for day_name in day_names for hour in hours]
 
-    # Convert sample_input to a pandas DataFrame
-    sample_input_df = pd.DataFrame([sample_input], columns=list(sample_input))
-    # Ensure the DataFrame has the correct feature order as expected by the preprocessor
-    sample_input_df = sample_input_df[feature_columns]  # Reorder columns to match feature_columns
-    # Apply the preprocessor to transform the input data
-    try:
-        processed_input = preprocessor.transform(sample_input_df)
-    except Exception as e:
-        print(f"Error during preprocessing: {e}")
-        return jsonify({"error_preprocessor": "Preprocessing failed"}), 500
-    
-    # Make predictions using the loaded model
+
+def check_input(routes, route_id, day_name, hour_of_day):
+    """Returns the error of one batch input, or None"""
+    if type(route_id) != str or route_id not in routes:
+        return "Route not found"
+    if type(day_name) != str or day_name.lower() not in travel_time.days:
+        return "Invalid day_name"
+    if type(hour_of_day) != int or not 0 <= hour_of_day <= 23:
+        return "Invalid hour_of_day"
+    return None
+
+
+@app_views.route('/travel_time_prediction/batch', methods=['POST'])
+def post_travel_time_batch():
+    """Predicts many travel times in one call.
+    Body, either a list of inputs:
+        {"inputs": [{"route_id": .., "day_name": .., "hour_of_day": ..}]}
+    or a cross product (route_ids defaults to every route, days to the
+    whole week, hours to 0-23):
+        {"route_ids": [..], "days": [..], "hours": [..]}
+    Streams one NDJSON line per input, in order, with its index, its
+    values and either the prediction or an error.
+    """
+    inputs = batch_inputs(request.get_json(silent=True))
+    if len(inputs) > batch_max:
+        raise BadRequest(description="batch of {} inputs is over {}".format(
+            len(inputs), batch_max))
     try:
-        prediction = loaded_model.predict(processed_input)
-        print("Predicted travel time:", prediction[0])  # Assuming regression output (single value)
-    except Exception as e:
-        print(f"Error during prediction: {e}")
-        return jsonify({"error_prediction": "Prediction failed"}), 500
-    return jsonify({
-        "message": "Travel time prediction model loaded successfully.",
-        "feature_columns": [i for i in feature_columns],
-        "prediction": prediction[0]
-    }), 200
\ No newline at end of file
+        travel_time.models()
+    except ArtifactMissing as e:
+        print(f"Travel time model unavailable: {e}")
+        return jsonify({"error": "Travel time model is not available"}), 503
+
+    # every route of the batch in one query
+    route_ids = list(dict.fromkeys(i[0] for i in inputs
+                                   if isinstance(i[0], str)))
+    routes = {route.id: route
+              for route in storage.get_many(Route, route_ids)}
+
+    def generate():
+        for start in range(0, len(inputs), batch_chunk):
+            chunk = inputs[start:start + batch_chunk]
+            errors = [check_input(routes, *i) for i in chunk]
+            valid = [(routes[r], d.lower(), h)
+                     for (r, d, h), error in zip(chunk, errors) if not error]
+            values = None
+            if valid and travel_grid.enabled:
+                values = travel_grid.grid.lookup_many(valid)
+            if values is None and valid:
+                try:
+                    values = travel_time.predict_cached(valid)
+                except (Overloaded, TimeoutError) as e:
+                    # headers are sent: report it on the chunk's lines
+                    failed = "Prediction unavailable: {}".format(
+                        e or "timed out")
+                    errors = [error or failed for error in errors]
+                    valid = []
+            predictions = iter(values if valid else ())
+            lines = []
+            for n, ((route_id, day_name, hour), error) in \
+                    enumerate(zip(chunk, errors), start):
+                row = {"index": n, "route_id": route_id,
+                       "day_name": day_name, "hour_of_day": hour}
+                if error:
+                    row["error"] = error
+                else:
+                    row["prediction"] = float(next(predictions))
+                lines.append(json.dumps(row) + '\n')
+            yield ''.join(lines)
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
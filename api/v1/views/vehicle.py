@@ -8,24 +8,30 @@ from backend.models import Vehicle
 from flask import jsonify, request
 from werkzeug.exceptions import NotFound, MethodNotAllowed, BadRequest
 
-from .commons import (fetch_data, fetch_data_id, fetch_process,
-                      reach_endpoint, allows)
+from .commons import (fetch_data, fetch_data_id,
+                      wants_page, page_response, wants_stream,
+                      stream_response, reach_endpoint, allows,
+                      create_many)
 
 
 def get_vehicle(vehicle_id=None):
     """Returns the vehicle using the given id.
     """
+    if vehicle_id:
+        vehicle = fetch_data_id(Vehicle, vehicle_id)
+        return jsonify([vehicle.to_dict()] if vehicle else [])
+
+    if wants_stream():
+        return stream_response(Vehicle)
+    if wants_page():
+        return page_response(Vehicle)
+
     vehicles = fetch_data(Vehicle)
     if not vehicles:
         return jsonify(
             {"error": "No vehicles found"}), 404
 
-    if vehicle_id:
-        results = [v.to_dict() for v in vehicles if v.id == vehicle_id]
-    else:
-        results = [v.to_dict() for v in vehicles]
-
-    return jsonify(results)
+    return jsonify([v.to_dict() for v in vehicles])
 
 @app_views.route('/vehicle/<vehicle_Number>/capacity', methods=['GET'])
 def get_vehicle_capacity(vehicle_Number=None):
@@ -46,24 +52,20 @@ def add_vehicle(vehicle_id=None):
         raise BadRequest(description='Not a JSON')
 
     if type(data) == list and len(data) > 0:
-        i = 0
-        j = 0
         for sub in data:
             if type(sub) is not dict:
                 raise BadRequest(description='Not a JSON')
-            if 'name' not in sub:
-                raise BadRequest(description='Missing name')
-            vehicle = storage.get_or_create(Vehicle, **sub)
-            if vehicle:
-                vehicle.save()
-                j += 1
-            i += 1
-        return jsonify({"message": f"[{j}/{i} vehicles added successfully"}), 201
+            if 'vehicle_number' not in sub:
+                raise BadRequest(description='Missing vehicle_number')
+        results = create_many(Vehicle, data)
+        j = len([r for r in results if r['status'] == 'created'])
+        return jsonify({"message": f"{j}/{len(data)} vehicles added successfully",
+                        "results": results}), 201 if j else 200
 
     if type(data) is not dict:
         raise BadRequest(description='Not a JSON')
-    if 'name' not in data:
-        raise BadRequest(description='Missing name')
+    if 'vehicle_number' not in data:
+        raise BadRequest(description='Missing vehicle_number')
     vehicle = Vehicle(**data)
 
     vehicle.save()
@@ -72,9 +74,9 @@ def add_vehicle(vehicle_id=None):
 def delete_vehicle(vehicle_id=None):
     """Deletes vehicle using given id.
     """
-    results = fetch_process(Vehicle, filter, vehicle_id)
-    if results:
-        storage.delete(results[0])
+    vehicle = fetch_data_id(Vehicle, vehicle_id)
+    if vehicle:
+        storage.delete(vehicle)
         storage.save()
         return jsonify({}), 200
     raise NotFound()
@@ -84,13 +86,12 @@ def update_vehicle(vehicle_id=None):
     """
     table_cols = ('id', 'created_at', 'updated_at')
 
-    results = fetch_process(Vehicle, filter, vehicle_id)
+    vehicle_old = fetch_data_id(Vehicle, vehicle_id)
 
-    if results:
+    if vehicle_old:
         data = request.get_json()
         if type(data) is not dict:
             raise BadRequest(description='Not a JSON')
-        vehicle_old = results[0]
         for key, value in data.items():
             if key not in table_cols:
                 setattr(vehicle_old, key, value)
@@ -10,14 +10,20 @@ import folium
 from folium.features import CustomIcon
 from folium.features import DivIcon
 from folium.elements import Element
-from flask import Flask, json, jsonify, request, render_template, redirect, url_for, current_app
+from flask import Flask, g, json, jsonify, request, render_template, redirect, url_for, current_app, has_request_context
 from flask_cors import CORS
 import requests
 from werkzeug.exceptions import HTTPException
 from flasgger import Swagger
 from flasgger.utils import swag_from
 from api.v1.views import app_views
-from api.v1.views.commons import fetch_data_url  # Blueprint registration
+from api.v1.json_provider import json_provider
+from api.v1.ml import forest
+from api.v1.ml.registry import registry
+from api.v1.ml.executor import executor
+from backend.models import storage, storage_type
+from backend.models.engine import instrumentation
+from api.v1.views.commons import iter_data_url  # Blueprint registration
 
 # Read environment variables (optional: use dotenv if needed)
 HOST = os.getenv("UMPIRE_HOST", "localhost")
@@ -27,6 +33,7 @@ BSTOPS_URL = BASE_URL + "/bstops"
 TERMINALS_URL = BASE_URL + "/terminals"
 VEHICLES_URL = BASE_URL + "/vehicles"
 ROUTES_URL = BASE_URL + "/routes"
+MAP_FIELDS = ('id', 'name', 'latitude', 'longitude')
 
 if not HOST or not PORT:
     raise ValueError("UMPIRE_HOST and UMPIRE_FLASK_PORT must be set in the environment or .env file")
@@ -34,6 +41,7 @@ if not HOST or not PORT:
 # Initialize Flask app
 app = Flask(__name__)
 app.url_map.strict_slashes = False  # Globally disable strict slashes
+app.json = json_provider(app)  # orjson when installed
 
 # Register Blueprints
 app.register_blueprint(app_views)
@@ -48,12 +56,68 @@ app.config['SWAGGER'] = {
 }
 Swagger(app)
 
+# Load the ML artifacts now rather than on the first prediction
+if os.getenv("UMPIRE_MODEL_PRELOAD") == "1":
+    registry.preload()
+    forest.warm()
+# inference worker processes, when UMPIRE_INFERENCE_WORKERS > 0
+executor.start()
+
+
+# SQL statements issued while serving a request are counted and timed;
+# the summary is sent back in a header in dev mode
+SQL_HEADER = os.getenv("UMPIRE_ENV") in ("dev", "test")
 
 
-# Optional: Hook before each request (currently unused)
 @app.before_request
 def before_request():
-    pass
+    """
+    Starts counting the SQL statements of the request
+    """
+    g.query_stats = instrumentation.start()
+
+@app.after_request
+def report_queries(response):
+    """
+    Warns about requests over the query budget or with repeated
+    statements, and reports the counters in dev mode
+    """
+    token = g.pop('query_stats', None)
+    if token is None:
+        return response
+    label = '{} {}'.format(request.method, request.full_path.rstrip('?'))
+    if response.is_streamed:
+        # the body (NDJSON listings, prediction batches) queries while it
+        # is sent: the statements are checked once the response is
+        # closed, and the header, sent first, only counts those made
+        # before the body
+        stats = instrumentation.current()
+
+        def finish_stream():
+            instrumentation.finish(token)
+            instrumentation.check(stats, label)
+        response.call_on_close(finish_stream)
+        if SQL_HEADER or app.debug:
+            response.headers['X-SQL-Queries'] = stats.summary() + \
+                '; streamed=before-body'
+        return response
+    stats = instrumentation.finish(token)
+    instrumentation.check(stats, label)
+    if SQL_HEADER or app.debug:
+        response.headers['X-SQL-Queries'] = stats.summary()
+    return response
+
+@app.teardown_appcontext
+def close_storage(exception):
+    """
+    Releases the request's database session and its connection. A
+    context popped while a request is still active (an internal request
+    made by iter_data_url, an app context pushed by a view) belongs to
+    that request, which keeps using the session: only the outermost one
+    closes it
+    """
+    if storage_type == "db" and not has_request_context():
+        storage.close()
 
 # Fixed: Proper HTTP error handling
 @app.errorhandler(HTTPException)
@@ -153,37 +217,39 @@ def update_map():
         pass
 
     if user_action and user_action == 'show_terminals':
-        # Fetch terminals from the API
-        terminals = fetch_data_url(TERMINALS_URL)
-        if isinstance(terminals, list) and len(terminals) > 0:
-            for terminal in terminals:
-                # Store terminal data for JavaScript access
-                if 'latitude' in terminal and 'longitude' in terminal:
-                    terminals_data.append({
-                    'id': terminal['id'],
-                    'name': terminal['name'],
-                    'latitude': terminal['latitude'],
-                    'longitude': terminal['longitude']
-                })
-                
-                html_icon = f"""
-                            <div class="my-terminal-icon" id="icon_{terminal['id']}" 
-                                 data-lat="{terminal['latitude']}" 
-                                 data-lng="{terminal['longitude']}"
-                                 data-name="{terminal['name']}">
-                                <img src='../static/assets/terminal.png' style='width:25px;height:25px;'/>
-                            </div>
-                            """
-                folium.Marker(
-                    location=[terminal['latitude'], terminal['longitude']],
-                    popup=terminal['name'],
-                    icon=DivIcon(
-                        html=html_icon,
-                        icon_size=(30, 30),
-                        icon_anchor=(15, 15)  # center the icon
-                    )
-                ).add_to(m)
-        else:
+        # Fetch terminals from the API, streamed and projected so only
+        # the map columns are read and held
+        terminals = iter_data_url(TERMINALS_URL, fields=MAP_FIELDS)
+        found = False
+        for terminal in terminals:
+            found = True
+            # Store terminal data for JavaScript access
+            if 'latitude' in terminal and 'longitude' in terminal:
+                terminals_data.append({
+                'id': terminal['id'],
+                'name': terminal['name'],
+                'latitude': terminal['latitude'],
+                'longitude': terminal['longitude']
+            })
+            
+            html_icon = f"""
+                        <div class="my-terminal-icon" id="icon_{terminal['id']}" 
+                             data-lat="{terminal['latitude']}" 
+                             data-lng="{terminal['longitude']}"
+                             data-name="{terminal['name']}">
+                            <img src='../static/assets/terminal.png' style='width:25px;height:25px;'/>
+                        </div>
+                        """
+            folium.Marker(
+                location=[terminal['latitude'], terminal['longitude']],
+                popup=terminal['name'],
+                icon=DivIcon(
+                    html=html_icon,
+                    icon_size=(30, 30),
+                    icon_anchor=(15, 15)  # center the icon
+                )
+            ).add_to(m)
+        if not found:
             folium.Marker(
                 location=[user_lat, user_lng],
                 popup="No terminals found",
@@ -192,7 +258,7 @@ def update_map():
 
     if user_action and user_action == 'show_stops':
         # Fetch stops from the API
-        stops = fetch_data_url(BSTOPS_URL)
+        stops = iter_data_url(BSTOPS_URL, fields=MAP_FIELDS)
         for stop in stops:
             # Store stop data for JavaScript access
             stops_data.append({
@@ -28,4 +28,8 @@ if storage_type == "db":
 else:
     from backend.models.engine.file_storage import FileStorage
     storage = FileStorage()
+
+# reads of reference data are served from a cache invalidated by writes
+from backend.models.engine.cache import from_env
+storage = from_env(storage)
 storage.reload()
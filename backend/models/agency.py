@@ -12,9 +12,11 @@ STORAGE_TYPE = os.getenv("UMPIRE_TYPE_STORAGE", "file")
 
 class Agency(BaseModel, Base):
     """ The agency class, contains agency ID and name """
+    # unique business key used by get_or_create upserts
+    natural_key = 'agency_id'
     if STORAGE_TYPE == "db":
         __tablename__ = 'agencies'
-        agency_id = Column(String(20), nullable=True)
+        agency_id = Column(String(20), nullable=True, unique=True, index=True)
         name = Column(String(128), nullable=False)
         agency_url = Column(String(256), nullable=False)
         # Relationships
@@ -2,33 +2,178 @@
 """This module defines a base class for all models in our hbnb clone"""
 
 import os
+import sys
 import uuid
 from datetime import datetime
 from backend import models
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, String, DateTime
+from sqlalchemy.orm import declared_attr, configure_mappers
+from sqlalchemy.orm.attributes import manager_of_class
+from sqlalchemy import Column, String, DateTime, Index
 from dotenv import load_dotenv
 
 load_dotenv()
 
 STORAGE_TYPE = os.getenv("UMPIRE_TYPE_STORAGE", "file")
 
+# class attributes of the models that are not per-instance fields
+class_constants = ('natural_key',)
+
+
+class CompactMeta(type):
+    """File mode metaclass keeping model instances small.
+    The attribute defaults a model declares (name = "", latitude = 0.0,
+    vehicle_ids = [] ...) become __slots__, so an instance stores its
+    fields in a fixed array instead of a per-instance __dict__. The
+    defaults move to field_defaults and are served by __getattr__ while a
+    field is unset; like the __dict__ of before, only the fields that
+    were assigned are serialized. List defaults are relationship stand-ins and stay on
+    the class, except the *_ids link sets. Attributes no model
+    declares go to an _extra dict, only allocated for the instances that
+    get one.
+    """
+
+    def __new__(mcs, name, bases, namespace):
+        """Moves the field defaults of namespace into __slots__"""
+        defaults = {}
+        taken = set()
+        for base in reversed(bases):
+            defaults.update(getattr(base, 'field_defaults', {}))
+            for klass in base.__mro__:
+                taken.update(getattr(klass, '__slots__', ()))
+        slots = []
+        for key, value in list(namespace.items()):
+            if key.startswith('_') or key in class_constants:
+                continue
+            if type(value) is list and not key.endswith('_ids'):
+                continue
+            if value is None or type(value) in (str, int, float, bool, list):
+                defaults[key] = namespace.pop(key)
+                if key not in taken:
+                    slots.append(key)
+        if '_extra' not in taken:
+            slots.append('_extra')
+        namespace['__slots__'] = tuple(slots)
+        namespace['field_defaults'] = defaults
+        cls = super().__new__(mcs, name, bases, namespace)
+        # slot descriptors raise AttributeError for unset fields rather
+        # than falling back to __getattr__
+        cls.slot_getters = tuple(
+            (key, klass.__dict__[key].__get__)
+            for klass in reversed(cls.__mro__)
+            for key in klass.__dict__.get('__slots__', ()))
+        cls.slot_setters = {
+            key: klass.__dict__[key].__set__
+            for klass in reversed(cls.__mro__)
+            for key in klass.__dict__.get('__slots__', ())}
+        return cls
+
+    def fields(cls, obj):
+        """Returns the fields assigned on obj, extras included"""
+        state = {}
+        for key, get in cls.slot_getters:
+            try:
+                state[key] = get(obj)
+            except AttributeError:
+                # never assigned: read through its default, not stored
+                pass
+        extra = state.pop('_extra', None)
+        if extra:
+            state.update(extra)
+        return state
+
+
+def compact_value(value):
+    """Interns strings, and the strings of lists, so the values repeated
+    across instances (ids, suburbs, names) are stored once"""
+    if type(value) is str:
+        return sys.intern(value)
+    if type(value) is list:
+        return [sys.intern(v) if type(v) is str else v for v in value]
+    return value
+
+
+def parse_time(value):
+    """Returns a stored timestamp as a datetime"""
+    if type(value) is str:
+        return datetime.fromisoformat(value)
+    return value
+
+
 if STORAGE_TYPE == "db":
     Base = declarative_base()
+    ModelMeta = type
 else:
     Base = object
+    ModelMeta = CompactMeta
+
+
+# model class -> its to_dict() function, built on first use
+serializers = {}
+
+
+def compile_serializer(cls):
+    """Builds the to_dict() function of a model class.
+    The class name and the attributes to emit are resolved once: in db
+    mode the mapped columns, which also keeps eagerly loaded relationships
+    out (the views embed them explicitly); in file mode the instance
+    attributes. Timestamps are the only values converted.
+    """
+    name = cls.__name__
+    timestamps = ('created_at', 'updated_at')
+
+    if STORAGE_TYPE == "db":
+        columns = tuple(attr.key for attr in cls.__mapper__.column_attrs
+                        if attr.key not in timestamps)
+
+        def to_dict(obj):
+            if obj._sa_instance_state.expired_attributes:
+                # expired by a commit or rollback: reload the columns
+                for key in columns:
+                    getattr(obj, key)
+            state = obj.__dict__
+            dictionary = {'__class__': name}
+            for key in columns:
+                if key in state:
+                    dictionary[key] = state[key]
+            for key in timestamps:
+                value = state.get(key)
+                if value is not None:
+                    dictionary[key] = value.isoformat()
+            return dictionary
+    else:
+        fields = cls.fields
+
+        def to_dict(obj):
+            dictionary = fields(obj)
+            dictionary['__class__'] = name
+            for key in timestamps:
+                value = dictionary.get(key)
+                if isinstance(value, datetime):
+                    dictionary[key] = value.isoformat()
+            return dictionary
+    return to_dict
 
 
-class BaseModel:
+class BaseModel(metaclass=ModelMeta):
     """A base class for all hbnb models"""
 
     if STORAGE_TYPE == "db":
         id = Column(String(60), primary_key=True)
         created_at = Column(DateTime, nullable=False, default=datetime.utcnow())
         updated_at = Column(DateTime, nullable=False, default=datetime.utcnow())
-    
+
+        @declared_attr
+        def __table_args__(cls):
+            """Index backing keyset pagination on (created_at, id)"""
+            return (Index('ix_{}_created_at_id'.format(cls.__tablename__),
+                          'created_at', 'id'),)
+
     def __init__(self, *args, **kwargs):
         """Instantiates a new model"""
+        if STORAGE_TYPE != 'db':
+            # the fields stay unset, __getattr__ serves their defaults
+            object.__setattr__(self, '_extra', None)
         if kwargs:
             if STORAGE_TYPE != 'db':
                 kwargs.pop('__class__', None)
@@ -45,16 +190,109 @@ class BaseModel:
                 kwargs['updated_at'] = datetime.strptime(kwargs['updated_at'],
                                                          '%Y-%m-%dT%H:%M:%S.%f')
             for key, value in kwargs.items():
-                
+                if STORAGE_TYPE != 'db':
+                    value = compact_value(value)
                 setattr(self, key, value)
         else:
             self.id = str(uuid.uuid4())
             self.created_at = datetime.utcnow()
 
+    @classmethod
+    def from_record(cls, record):
+        """Builds an instance from a stored record (a to_dict() or a row):
+        an id is only generated when the record has none, timestamps are
+        parsed with fromisoformat and missing ones share a single now,
+        and the values are assigned without going through __init__.
+        """
+        id_ = record.get('id') or str(uuid.uuid4())
+        created_at = parse_time(record.get('created_at'))
+        updated_at = parse_time(record.get('updated_at'))
+        if created_at is None or updated_at is None:
+            now = datetime.utcnow()
+            created_at = created_at or now
+            updated_at = updated_at or now
+
+        if STORAGE_TYPE == "db":
+            configure_mappers()
+            obj = manager_of_class(cls).new_instance()
+            for key, value in record.items():
+                if key not in ('__class__', 'id', 'created_at', 'updated_at'):
+                    setattr(obj, key, value)
+            obj.id = id_
+            obj.created_at = created_at
+            obj.updated_at = updated_at
+            return obj
+
+        obj = object.__new__(cls)
+        setters = cls.slot_setters
+        extra = None
+        for key, value in record.items():
+            if type(value) is str:
+                value = sys.intern(value)
+            elif type(value) is list:
+                value = compact_value(value)
+            setter = setters.get(key)
+            if setter is not None:
+                setter(obj, value)
+            elif key != '__class__':
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        setters['_extra'](obj, extra)
+        setters['id'](obj, id_)
+        setters['created_at'](obj, created_at)
+        setters['updated_at'](obj, updated_at)
+        return obj
+
+    if STORAGE_TYPE != "db":
+        id = None
+        created_at = None
+        updated_at = None
+
+        def __getattr__(self, name):
+            """Returns the class default of a field that is not set, or an
+            attribute stored in the extras"""
+            defaults = type(self).field_defaults
+            if name in defaults:
+                value = defaults[name]
+                if type(value) is list:
+                    # a list of its own, kept so that appending to it
+                    # sticks; the shared default is never mutated
+                    value = []
+                    object.__setattr__(self, name, value)
+                return value
+            try:
+                return BaseModel._extra.__get__(self)[name]
+            except (AttributeError, KeyError, TypeError):
+                raise AttributeError("'{}' object has no attribute '{}'"
+                                     .format(type(self).__name__, name))
+
+        def __setattr__(self, name, value):
+            """Keeps the attributes no model declares in the extras"""
+            try:
+                object.__setattr__(self, name, value)
+            except AttributeError:
+                if hasattr(type(self), name):
+                    raise
+                try:
+                    extra = BaseModel._extra.__get__(self)
+                except AttributeError:
+                    extra = None
+                if extra is None:
+                    extra = {}
+                    object.__setattr__(self, '_extra', extra)
+                extra[name] = value
+
+        def __getstate__(self):
+            """Pickles the fields that are set, not their defaults"""
+            return (None, type(self).fields(self))
+
     def __str__(self):
         """Returns a string representation of the instance"""
         cls = type(self).__name__
-        return '[{}] ({}) {}'.format(cls, self.id, self.__dict__)
+        state = self.to_dict()
+        del state['__class__']
+        return '[{}] ({}) {}'.format(cls, self.id, state)
 
     def __repr__(self):
         """return a string representaion
@@ -72,14 +310,11 @@ class BaseModel:
 
     def to_dict(self):
         """Convert instance into dict format"""
-        dictionary = {}
-        dictionary.update(self.__dict__)
-        dictionary.update({'__class__': (str(type(self)).split('.')[-1]).split('\'')[0]})
-        dictionary['created_at'] = self.created_at.isoformat()
-        dictionary['updated_at'] = self.updated_at.isoformat()
-        if '_sa_instance_state' in dictionary.keys():
-            del dictionary['_sa_instance_state']
-        return dictionary
+        cls = type(self)
+        serializer = serializers.get(cls)
+        if serializer is None:
+            serializer = serializers[cls] = compile_serializer(cls)
+        return serializer(self)
 
     def delete(self):
         """ delete object """
@@ -3,6 +3,7 @@
 
 import os
 from dotenv import load_dotenv
+from backend import models
 from backend.models.base_model import STORAGE_TYPE, BaseModel, Base
 from sqlalchemy.orm import relationship
 from sqlalchemy import Column, Integer, String, Float, ForeignKey
@@ -28,5 +29,11 @@ class BusStop(BaseModel, Base):
         latitude = 0.0
         longitude = 0.0
         suburb_id = ""
+        route_id = ""
         suburb = None
-        routes = []
\ No newline at end of file
+        routes = []
+
+        @property
+        def suburb(self):
+            """Get the suburb the bus stop is in"""
+            return models.storage.get('Suburb', self.suburb_id)
\ No newline at end of file
@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+"""Read-through cache in front of the storage engines
+
+CachedStorage wraps DBStorage or FileStorage and answers all(), get(),
+get_one_by() and query() for the reference classes from a cache:
+    - a local tier: an in-process LRU with a TTL
+    - an optional shared tier (redis, UMPIRE_CACHE_URL) holding pickled
+      entries, so several API processes share their reads
+With FileStorage the tiers hold the instances, which the storage shares
+anyway. With DBStorage they hold detached snapshots of the column
+values, never instances bound to a session: every hit rebuilds the
+instances in the session of its own request.
+
+Every cache key carries the generation of its class. Writes through
+new(), save(), delete() and the bulk methods bump the generation of the
+classes they touch, so stale entries are never served again and simply
+age out of the LRU. With the shared tier the generations live in redis,
+which makes a write in one process invalidate the others.
+
+Settings:
+    UMPIRE_CACHE        1 to cache reads, 0 to only track generations [1]
+    UMPIRE_CACHE_SIZE   entries kept by the local tier [4096]
+    UMPIRE_CACHE_TTL    seconds an entry is served [300]
+    UMPIRE_CACHE_URL    redis url of the shared tier, unset = local only
+"""
+
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+cache_ttl = int(os.getenv("UMPIRE_CACHE_TTL", 300))
+# reference data: read constantly, written a few times a day
+cached_classes = ('Route', 'Terminal', 'Agency', 'Suburb', 'BusStop')
+
+
+def class_name(cls):
+    """Returns the name of a class given as a class or a string"""
+    return cls if type(cls) == str else cls.__name__
+
+
+class LRUCache:
+    """Thread-safe LRU mapping whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize=4096, ttl=300):
+        """Creates an empty cache"""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the value stored under key, or None"""
+        with self.__lock:
+            entry = self.__data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value = entry
+            if expires < monotonic():
+                del self.__data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.__data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        """Stores value under key, evicting the least recently used"""
+        if self.maxsize <= 0:
+            return
+        with self.__lock:
+            self.__data[key] = (monotonic() + self.ttl, value)
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry"""
+        with self.__lock:
+            self.__data.clear()
+
+    def stats(self):
+        """Returns the size and the counters of the cache"""
+        return {'size': len(self.__data), 'maxsize': self.maxsize,
+                'ttl': self.ttl, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations}
+
+    def __len__(self):
+        """Number of entries, expired ones included"""
+        return len(self.__data)
+
+
+class SharedCache:
+    """Redis backed tier: pickled values and the class generations"""
+
+    prefix = 'umpire:'
+
+    def __init__(self, url, ttl=300):
+        """Connects to the redis server at url"""
+        if redis is None:
+            raise ImportError("the redis package is needed for UMPIRE_CACHE_URL")
+        self.__client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        """Returns the value stored under key, or None"""
+        raw = self.__client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        """Stores value under key for ttl seconds"""
+        self.__client.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+
+    def generation(self, clsname):
+        """Returns the shared generation of a class"""
+        value = self.__client.hget(self.prefix + 'generations', clsname)
+        return int(value or 0)
+
+    def bump(self, clsname):
+        """Increments the shared generation of a class"""
+        self.__client.hincrby(self.prefix + 'generations', clsname, 1)
+
+
+class CachedStorage:
+    """Storage proxy serving reference reads from the cache tiers.
+    Everything it does not override is forwarded to the wrapped storage.
+    """
+
+    def __init__(self, storage, local=None, shared=None, ttl=cache_ttl):
+        """Wraps storage; local None disables caching of reads"""
+        self.ttl = ttl
+        self.__storage = storage
+        self.__local = local
+        self.__shared = shared
+        self.__generations = {}
+        self.__lock = threading.Lock()
+
+    def __getattr__(self, name):
+        """Forwards the rest of the storage API"""
+        return getattr(self.__storage, name)
+
+    # generations
+    def generation(self, cls):
+        """Returns the write generation of a class"""
+        clsname = class_name(cls)
+        if self.__shared is not None:
+            return self.__shared.generation(clsname)
+        return self.__generations.get(clsname, 0)
+
+    def shared_generations(self):
+        """Tells whether the generations are shared by every process, so
+        a write anywhere changes them; otherwise only the writes of this
+        process do, and anything derived from them must also expire"""
+        return self.__shared is not None
+
+    def bump(self, *classes):
+        """Invalidates every cached read of the given classes"""
+        for cls in classes:
+            clsname = class_name(cls)
+            with self.__lock:
+                self.__generations[clsname] = \
+                    self.__generations.get(clsname, 0) + 1
+            if self.__shared is not None:
+                self.__shared.bump(clsname)
+
+    # reads
+    def __cached(self, cls, key, load):
+        """Returns the value for key from the tiers, calling load() and
+        filling the tiers on a miss. The tiers hold frozen values, see
+        __freeze(), thawed again for every caller."""
+        clsname = class_name(cls)
+        if self.__local is None or clsname not in cached_classes:
+            return load()
+        snapshots = hasattr(self.__storage, 'snapshot')
+        if snapshots and clsname in self.__storage.dirty_classes():
+            # this request changed the class and did not commit: its
+            # view of the rows is neither shared nor served from others
+            return load()
+        key = '{}:{}:{}'.format(clsname, self.generation(clsname), key)
+        value = self.__local.get(key)
+        if value is None and self.__shared is not None:
+            value = self.__shared.get(key)
+            if value is not None:
+                self.__local.set(key, value)
+        if value is not None:
+            return self.__thaw(value)
+        loaded = load()
+        if loaded is None:
+            return None
+        value = self.__freeze(loaded)
+        if self.__shared is not None:
+            self.__shared.set(key, value)
+        self.__local.set(key, value)
+        return loaded
+
+    def __freeze(self, value):
+        """Turns a loaded instance, list or dict of instances into what
+        the tiers keep: detached snapshots of the column values when the
+        storage makes them (the ORM instances of a session must not be
+        shared between threads), the instances themselves otherwise"""
+        snapshot = getattr(self.__storage, 'snapshot', None)
+        if snapshot is None or value is None:
+            return value
+        if type(value) == dict:
+            return {k: snapshot(v) for k, v in value.items()}
+        if type(value) == list:
+            return [snapshot(v) for v in value]
+        return snapshot(value)
+
+    def __thaw(self, value):
+        """Turns a frozen value back into instances of the current
+        session"""
+        restore = getattr(self.__storage, 'restore', None)
+        if restore is None or value is None:
+            return value
+        if type(value) == dict:
+            return {k: restore(v) for k, v in value.items()}
+        if type(value) == list:
+            return [restore(v) for v in value]
+        return restore(value)
+
+    def all(self, cls=None):
+        """storage.all(), cached per class"""
+        if cls is None:
+            return self.__storage.all()
+        return dict(self.__cached(cls, 'all',
+                                  lambda: self.__storage.all(cls)))
+
+    def get(self, cls, id, include=None):
+        """storage.get(), cached unless relationships are included"""
+        if include or cls is None or id is None:
+            return self.__storage.get(cls, id, include=include)
+        return self.__cached(cls, 'get:{}'.format(id),
+                             lambda: self.__storage.get(cls, id))
+
+    def get_one_by(self, cls, include=None, **kwargs):
+        """storage.get_one_by(), cached on the filter values unless
+        relationships are included"""
+        if include:
+            return self.__storage.get_one_by(cls, include=include, **kwargs)
+        key = 'one:' + json.dumps(kwargs, sort_keys=True, default=str)
+        return self.__cached(
+            cls, key, lambda: self.__storage.get_one_by(cls, **kwargs))
+
+    def query(self, cls, filters=None, order_by=None, limit=None, offset=None,
+              include=None):
+        """storage.query(), cached unless relationships are included"""
+        def load():
+            return self.__storage.query(cls, filters=filters,
+                                        order_by=order_by, limit=limit,
+                                        offset=offset, include=include)
+        if include or cls is None:
+            return load()
+        key = 'query:' + json.dumps([filters, order_by, limit, offset],
+                                    sort_keys=True, default=str)
+        return list(self.__cached(cls, key, load))
+
+    # writes
+    def new(self, obj):
+        """storage.new(), invalidating the class of obj"""
+        self.__storage.new(obj)
+        if obj:
+            self.bump(type(obj))
+
+    def new_all(self, *args):
+        """storage.new_all(), invalidating the classes of the objects"""
+        self.__storage.new_all(*args)
+        self.bump(*{type(obj) for obj in args})
+
+    def save(self):
+        """storage.save(), invalidating every class it wrote once the
+        changes are committed"""
+        touched = self.__storage.dirty_classes()
+        self.__storage.save()
+        self.bump(*touched)
+
+    def delete(self, obj=None):
+        """storage.delete(), invalidating the class of obj"""
+        self.__storage.delete(obj)
+        if obj:
+            self.bump(type(obj))
+
+    def delete_all(self):
+        """storage.delete_all(), invalidating everything"""
+        self.__storage.delete_all()
+        self.bump(*cached_classes)
+
+    def get_or_create(self, cls, **kwargs):
+        """storage.get_or_create(), invalidating cls"""
+        try:
+            return self.__storage.get_or_create(cls, **kwargs)
+        finally:
+            self.bump(cls)
+
+    def get_or_create_many(self, cls, rows, batch_size=500):
+        """storage.get_or_create_many(), invalidating cls"""
+        try:
+            return self.__storage.get_or_create_many(cls, rows, batch_size)
+        finally:
+            self.bump(cls)
+
+    def bulk_create(self, cls, rows, batch_size=500):
+        """storage.bulk_create(), invalidating cls"""
+        try:
+            return self.__storage.bulk_create(cls, rows, batch_size)
+        finally:
+            self.bump(cls)
+
+    def reload(self):
+        """storage.reload(), dropping the local tier"""
+        self.__storage.reload()
+        if self.__local is not None:
+            self.__local.clear()
+        self.bump(*cached_classes)
+
+
+def from_env(storage):
+    """Wraps storage following the UMPIRE_CACHE* settings"""
+    local = None
+    if os.getenv("UMPIRE_CACHE", "1") == "1":
+        local = LRUCache(int(os.getenv("UMPIRE_CACHE_SIZE", 4096)), cache_ttl)
+    url = os.getenv("UMPIRE_CACHE_URL")
+    shared = SharedCache(url, cache_ttl) if url and local is not None \
+        else None
+    return CachedStorage(storage, local, shared, cache_ttl)
@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+"""Columnar, memory-mappable snapshot format for FileStorage
+
+Layout of a snapshot file:
+    MAGIC                     12 bytes
+    header length             8 bytes, little endian
+    header                    JSON, see below
+    column blocks             8-byte aligned
+
+The header maps each class name to its row count and its columns:
+    {"Route": {"count": 651,
+               "columns": {"id": {"kind": "json", "offset": .., "length": ..},
+                           "distance_km": {"kind": "f8", ...}}}}
+Float columns are stored as raw float64 arrays and read straight from the
+mapped file; every other column is one JSON array. Rows that lack an
+attribute are listed in the column's "missing" entry.
+Only the header is parsed when a snapshot is opened; the columns of a
+class are decoded the first time that class is read.
+"""
+
+import json
+import mmap
+import os
+import struct
+from array import array
+
+MAGIC = b'UMPIRE-COL1\n'
+ALIGN = 8
+
+
+def write(path, snapshot):
+    """Writes a {key: to_dict()} snapshot to path in the columnar format"""
+    by_class = {}
+    for val in snapshot.values():
+        by_class.setdefault(val['__class__'], []).append(val)
+
+    header = {}
+    blocks = []
+    offset = 0
+    for clsname, rows in by_class.items():
+        names = {}
+        for row in rows:
+            names.update(dict.fromkeys(row))
+        names.pop('__class__', None)
+        columns = {}
+        for name in names:
+            values = [row.get(name) for row in rows]
+            missing = [n for n, row in enumerate(rows) if name not in row]
+            if not missing and all(type(v) is float for v in values):
+                kind = 'f8'
+                data = array('d', values).tobytes()
+            else:
+                kind = 'json'
+                data = json.dumps(values).encode()
+            pad = -len(data) % ALIGN
+            columns[name] = {'kind': kind, 'offset': offset,
+                             'length': len(data)}
+            if missing:
+                columns[name]['missing'] = missing
+            blocks.append(data + b'\0' * pad)
+            offset += len(data) + pad
+        header[clsname] = {'count': len(rows), 'columns': columns}
+
+    raw = json.dumps(header).encode()
+    raw += b' ' * (-(len(MAGIC) + 8 + len(raw)) % ALIGN)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(raw)))
+        f.write(raw)
+        for block in blocks:
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class ColumnarSnapshot:
+    """A read-only, memory-mapped columnar snapshot"""
+
+    def __init__(self, path):
+        """Maps the file and parses its header"""
+        with open(path, 'rb') as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__map[:len(MAGIC)] != MAGIC:
+            self.__map.close()
+            raise ValueError("{} is not a columnar snapshot".format(path))
+        start = len(MAGIC) + 8
+        size, = struct.unpack('<Q', self.__map[len(MAGIC):start])
+        self.__header = json.loads(self.__map[start:start + size])
+        self.__base = start + size
+
+    def classes(self):
+        """Returns the names of the classes stored in the snapshot"""
+        return list(self.__header)
+
+    def count(self, clsname):
+        """Returns the number of rows stored for clsname"""
+        return self.__header.get(clsname, {}).get('count', 0)
+
+    def column(self, clsname, name):
+        """Decodes one column of clsname into a list"""
+        meta = self.__header[clsname]['columns'][name]
+        start = self.__base + meta['offset']
+        view = memoryview(self.__map)[start:start + meta['length']]
+        try:
+            if meta['kind'] == 'f8':
+                return view.cast('d').tolist()
+            return json.loads(bytes(view))
+        finally:
+            view.release()
+
+    def rows(self, clsname):
+        """Yields the rows of clsname as dicts, as to_dict() wrote them"""
+        meta = self.__header.get(clsname)
+        if not meta:
+            return
+        names = list(meta['columns'])
+        columns = [self.column(clsname, name) for name in names]
+        missing = {name: set(col.get('missing', ()))
+                   for name, col in meta['columns'].items()}
+        for n in range(meta['count']):
+            row = {name: values[n] for name, values in zip(names, columns)
+                   if n not in missing[name]}
+            row['__class__'] = clsname
+            yield row
+
+    def close(self):
+        """Unmaps the file"""
+        self.__map.close()
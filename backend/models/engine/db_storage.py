@@ -1,10 +1,19 @@
 #!/usr/bin/python3
 """ new class for sqlAlchemy """
 
+import json
 import os
+import uuid
+from datetime import datetime
+from itertools import chain
 from backend.models.base_model import BaseModel, Base
-from sqlalchemy.orm import sessionmaker, scoped_session
-from sqlalchemy import (create_engine)
+from sqlalchemy.orm import (sessionmaker, scoped_session, selectinload,
+                            joinedload)
+from sqlalchemy.orm.util import identity_key
+from sqlalchemy.orm.session import make_transient_to_detached
+from sqlalchemy import (create_engine, event, tuple_)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from backend.models.engine import instrumentation
 from backend.models import (
     Suburb,
     BusStop,
@@ -24,6 +33,60 @@ classes = [
     Suburb, BusStop, Agency, User, Route,
     MLModel, Terminal, Vehicle, VehicleTrip
 ]
+classes_by_name = {c.__name__: c for c in classes}
+
+def row_values(cls, row, now=None):
+    """Returns the column values of row ready for a Core INSERT: unknown
+    keys are dropped, and id and timestamps are filled in when missing"""
+    columns = cls.__table__.columns
+    values = {k: v for k, v in row.items() if k in columns}
+    if not values.get('id'):
+        values['id'] = str(uuid.uuid4())
+    now = now or datetime.utcnow()
+    for ts in ('created_at', 'updated_at'):
+        if isinstance(values.get(ts), str):
+            values[ts] = datetime.fromisoformat(values[ts])
+        elif not values.get(ts):
+            values[ts] = now
+    return values
+
+
+def load_options(cls, include):
+    """Returns the eager loading options for the relationships in include:
+    selectinload (one extra IN query per relationship) for collections,
+    joinedload for many-to-one references"""
+    options = []
+    relationships = cls.__mapper__.relationships
+    for name in include or ():
+        if name not in relationships:
+            raise KeyError("Unknown relationship: {}".format(name))
+        attr = getattr(cls, name)
+        if relationships[name].uselist:
+            options.append(selectinload(attr))
+        else:
+            options.append(joinedload(attr))
+    return options
+
+
+def pending_classes(session):
+    """Returns the names of the classes of the objects session would
+    insert, update or delete at its next flush"""
+    return {type(obj).__name__ for obj in
+            chain(session.new, session.dirty, session.deleted)}
+
+
+def record_flush(session, flush_context):
+    """after_flush hook: remembers the classes a flush wrote, since an
+    autoflush empties the pending lists long before the commit"""
+    session.info.setdefault('flushed_classes', set()).update(
+        pending_classes(session))
+
+
+def forget_flushes(session):
+    """after_commit and after_rollback hook: the flushed classes were
+    committed (or discarded)"""
+    session.info.pop('flushed_classes', None)
+
 
 class DBStorage:
     """ create tables in environmental"""
@@ -37,10 +100,28 @@ class DBStorage:
         host = os.getenv("UMPIRE_DB_HOST")
         env = os.getenv("UMPIRE_ENV")
         print("============DBStorage initialized ================")
+        # connection pool settings, tunable per deployment
+        pool_size = int(os.getenv("UMPIRE_DB_POOL_SIZE", 5))
+        max_overflow = int(os.getenv("UMPIRE_DB_MAX_OVERFLOW", 10))
+        pool_recycle = int(os.getenv("UMPIRE_DB_POOL_RECYCLE", 1800))
+        pool_timeout = int(os.getenv("UMPIRE_DB_POOL_TIMEOUT", 30))
+        statement_timeout = int(os.getenv("UMPIRE_DB_STATEMENT_TIMEOUT", 0))
+        connect_args = {}
+        if statement_timeout > 0:
+            # milliseconds, enforced by postgres on every statement
+            connect_args["options"] = "-c statement_timeout={}".format(
+                statement_timeout)
         # initializes the db storage
         self.__engine = create_engine('postgresql+psycopg2://{}:{}@{}/{}'
                                        .format(user, passwd, host, db),
-                                       pool_pre_ping=True)
+                                       pool_pre_ping=True,
+                                       pool_size=pool_size,
+                                       max_overflow=max_overflow,
+                                       pool_recycle=pool_recycle,
+                                       pool_timeout=pool_timeout,
+                                       connect_args=connect_args)
+        # per-request statement counts and timings, see instrumentation
+        instrumentation.attach(self.__engine)
         if env == "test":
             Base.metadata.drop_all(self.__engine)
 
@@ -56,7 +137,7 @@ class DBStorage:
             tables = classes
         else:
             if type(cls) == str:
-                cls = eval(cls)
+                cls = classes_by_name[cls]
             tables = [cls]
 
         for tab in tables:
@@ -84,6 +165,39 @@ class DBStorage:
         """
         self.__session.commit()
 
+    def dirty_classes(self):
+        """Returns the names of the classes changed since the last
+        commit, whether still pending or already flushed"""
+        session = self.__session
+        return pending_classes(session) | \
+            session.info.get('flushed_classes', set())
+
+    def snapshot(self, obj):
+        """Returns (class name, column values) of obj: a plain copy that
+        stays valid whatever happens to obj or its session, so it can be
+        cached and shared between threads"""
+        if obj is None:
+            return None
+        columns = type(obj).__mapper__.column_attrs
+        return (type(obj).__name__,
+                {attr.key: getattr(obj, attr.key) for attr in columns})
+
+    def restore(self, snapshot):
+        """Returns the instance of a snapshot() in the current session:
+        the one its identity map already holds, or a new persistent one
+        built from the column values without querying the database"""
+        if snapshot is None:
+            return None
+        clsname, record = snapshot
+        cls = classes_by_name[clsname]
+        session = self.__session
+        obj = session.identity_map.get(identity_key(cls, record['id']))
+        if obj is None:
+            obj = cls.from_record(record)
+            make_transient_to_detached(obj)
+            session.add(obj)
+        return obj
+
     def delete(self, obj=None):
         """delete an element in the table
         """
@@ -101,21 +215,154 @@ class DBStorage:
         """
         Base.metadata.create_all(self.__engine)
         sec = sessionmaker(bind=self.__engine, expire_on_commit=False)
-        Session = scoped_session(sec)
-        self.__session = Session()
+        event.listen(sec, 'after_flush', record_flush)
+        event.listen(sec, 'after_commit', forget_flushes)
+        event.listen(sec, 'after_rollback', forget_flushes)
+        # keep the registry rather than a single Session instance: each
+        # thread gets its own session, and close() discards it at the end
+        # of the request so identity maps do not outlive it
+        self.__session = scoped_session(sec)
 
-    def get(self, cls, id):
+    def get(self, cls, id, include=None):
         """ This method retrieves an instance from the session
         Args:
             cls (str): The class name
             id (str): The instance id
+            include (list): relationships to load eagerly
         Returns: The instance or None
         """
         if id is None or cls is None:
             return None
-        objs = self.all(cls)
-        return objs.get('{}.{}'.format(cls, id))
+        if type(cls) == str:
+            cls = classes_by_name.get(cls)
+        # Session.get() answers from the identity map when the row is
+        # already loaded and otherwise issues a single primary-key SELECT
+        return self.__session.get(cls, id, options=load_options(cls, include))
+
+    def get_many(self, cls, ids):
+        """ This method retrieves several instances by primary key
+        Args:
+            cls (str): The class name
+            ids (list): The instance ids
+        Returns: The list of instances found, in the order of ids
+        """
+        if cls is None or not ids:
+            return []
+        if type(cls) == str:
+            cls = classes_by_name.get(cls)
+        ids = list(dict.fromkeys(i for i in ids if i is not None))
+        identity_map = self.__session.identity_map
+        found = {}
+        missing = []
+        for id in ids:
+            obj = identity_map.get(identity_key(cls, id))
+            if obj is not None:
+                found[id] = obj
+            else:
+                missing.append(id)
+        if missing:
+            query = self.__session.query(cls).filter(cls.id.in_(missing))
+            for obj in query.all():
+                found[obj.id] = obj
+        return [found[id] for id in ids if id in found]
     
+    def query(self, cls, filters=None, order_by=None, limit=None, offset=None,
+              include=None):
+        """ This method runs a filtered, ordered and sliced query in the database
+        Args:
+            cls (str): The class name
+            filters (dict): attribute -> value; list values match with IN
+            order_by (str/list): attribute names, prefixed with '-' for DESC
+            limit (int): maximum number of rows
+            offset (int): number of rows to skip
+            include (list): relationships to load eagerly
+        Returns: The list of matching instances
+        """
+        if cls is None:
+            return []
+        if type(cls) == str:
+            cls = classes_by_name[cls]
+        query = self.__session.query(cls).options(*load_options(cls, include))
+        for key, value in (filters or {}).items():
+            column = getattr(cls, key)
+            if isinstance(value, (list, tuple, set)):
+                query = query.filter(column.in_(list(value)))
+            else:
+                query = query.filter(column == value)
+        if order_by:
+            if type(order_by) == str:
+                order_by = [order_by]
+            for key in order_by:
+                if key.startswith('-'):
+                    query = query.order_by(getattr(cls, key[1:]).desc())
+                else:
+                    query = query.order_by(getattr(cls, key).asc())
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.all()
+
+    def page(self, cls, limit=None, after=None, fields=None, filters=None,
+             include=None):
+        """ This method returns one keyset page ordered by (created_at, id)
+        Args:
+            cls (str): The class name
+            limit (int): maximum number of rows
+            after (tuple): (created_at, id) of the last row of the previous page
+            fields (list): column names to select; rows come back as dicts
+            filters (dict): attribute -> value equality filters
+            include (list): relationships to load eagerly, without fields
+        Returns: The list of instances, or of dicts when fields is given
+        """
+        if cls is None:
+            return []
+        if type(cls) == str:
+            cls = classes_by_name[cls]
+        if fields:
+            columns = cls.__table__.columns
+            unknown = [f for f in fields if f not in columns]
+            if unknown:
+                raise KeyError("Unknown fields: {}".format(', '.join(unknown)))
+            query = self.__session.query(*[getattr(cls, f) for f in fields])
+        else:
+            query = self.__session.query(cls)
+            query = query.options(*load_options(cls, include))
+        for key, value in (filters or {}).items():
+            query = query.filter(getattr(cls, key) == value)
+        if after:
+            query = query.filter(tuple_(cls.created_at, cls.id) > tuple_(*after))
+        query = query.order_by(cls.created_at.asc(), cls.id.asc())
+        if limit is not None:
+            query = query.limit(limit)
+        if fields:
+            return [row._asdict() for row in query.all()]
+        return query.all()
+
+    def stream(self, cls, batch_size=500, fields=None):
+        """ This method yields every row of a table, fetched in batches
+        Args:
+            cls (str): The class name
+            batch_size (int): number of rows fetched per round trip
+            fields (list): column names to select; rows come back as dicts
+        Returns: A generator of instances, or of dicts when fields is given
+        """
+        if type(cls) == str:
+            cls = classes_by_name[cls]
+        if fields:
+            columns = cls.__table__.columns
+            unknown = [f for f in fields if f not in columns]
+            if unknown:
+                raise KeyError("Unknown fields: {}".format(', '.join(unknown)))
+            query = self.__session.query(*[getattr(cls, f) for f in fields])
+        else:
+            query = self.__session.query(cls)
+        query = query.order_by(cls.created_at.asc(), cls.id.asc())
+        # yield_per streams through a server side cursor, so only one
+        # batch of rows is held in memory at a time
+        for row in query.yield_per(batch_size):
+            yield row._asdict() if fields else row
+
     def get_by(self, cls, **kwargs):
         """ This method returns a list of instances of a class that match the keyword arguments """
         if cls:
@@ -128,23 +375,151 @@ class DBStorage:
             return self.__session.query(cls).filter_by(**kwargs).all()
         return []
 
-    def get_one_by(self, cls, **kwargs):
-        """ This method returns the first instance of a class that matches the keyword arguments """
+    def get_one_by(self, cls, include=None, **kwargs):
+        """ This method returns the first instance of a class that matches the keyword arguments
+        include (list): relationships to load eagerly """
         if cls:
-            return self.__session.query(cls).filter_by(**kwargs).first()
+            query = self.__session.query(cls)
+            if include:
+                query = query.options(*load_options(cls, include))
+            return query.filter_by(**kwargs).first()
         return None
 
     def get_or_create(self, cls, **kwargs):
         """ This method returns the first instance of a class that matches the keyword arguments
-        or creates a new instance if one does not exist """
-        instance = self.get_one_by(cls, **kwargs)
-        if instance is None:
-            instance = cls(**kwargs)
-            self.new(instance)
+        or creates a new instance if one does not exist.
+        Classes declaring a natural_key are resolved with a single
+        INSERT ... ON CONFLICT (natural_key) DO UPDATE ... RETURNING, which
+        is atomic under concurrency; the row matching the key is returned
+        as stored. Neither path commits: the caller commits with save(). """
+        if type(cls) == str:
+            cls = classes_by_name[cls]
+        key = getattr(cls, 'natural_key', None)
+        if key is None or kwargs.get(key) is None:
+            instance = self.get_one_by(cls, **kwargs)
+            if instance is None:
+                instance = cls(**kwargs)
+                self.new(instance)
+            return instance
+        return self.get_or_create_many(cls, [kwargs])[0]
+
+    def get_or_create_many(self, cls, rows, batch_size=500):
+        """ This method is the batched form of get_or_create
+        Rows are upserted on the class natural_key, one multi-row
+        INSERT ... ON CONFLICT DO UPDATE ... RETURNING per batch. The
+        caller commits with save().
+        Args:
+            cls (str): The class name
+            rows (list): dicts of column values
+            batch_size (int): number of rows per statement
+        Returns: The list of instances, one per row, in the order of rows
+        """
+        if type(cls) == str:
+            cls = classes_by_name[cls]
+        key = getattr(cls, 'natural_key', None)
+        if key is None:
+            return [self.get_or_create(cls, **row) for row in rows]
+        now = datetime.utcnow()
+        unique = {}
+        for row in rows:
+            if row.get(key) is None:
+                raise ValueError("{} requires {}".format(cls.__name__, key))
+            # the first row wins; postgres refuses to upsert a key twice
+            # in the same statement
+            if row[key] not in unique:
+                unique[row[key]] = row_values(cls, row, now)
+        found = {}
+        pending = list(unique.values())
+        for start in range(0, len(pending), batch_size):
+            groups = {}
+            for values in pending[start:start + batch_size]:
+                groups.setdefault(tuple(sorted(values)), []).append(values)
+            for group in groups.values():
+                stmt = pg_insert(cls).values(group)
+                # a no-op update makes RETURNING yield the existing row too
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[key], set_={key: stmt.excluded[key]})
+                stmt = stmt.returning(cls)
+                for obj in self.__session.scalars(
+                        stmt, execution_options={"populate_existing": True}):
+                    found[getattr(obj, key)] = obj
+        return [found[row[key]] for row in rows]
+
+    def bulk_create(self, cls, rows, batch_size=500):
+        """ This method inserts many rows in a single transaction
+        Rows repeated in the payload (same natural_key, or same values for
+        classes without one) are inserted once, and each batch is sent as
+        one INSERT ... ON CONFLICT DO NOTHING statement.
+        Args:
+            cls (str): The class name
+            rows (list): dicts of column values
+            batch_size (int): number of rows per INSERT statement
+        Returns: one {"id", "status"} dict per row, where status is
+            created, duplicate (repeated in rows) or exists (conflict)
+        Raises KeyError naming the keys that are not columns, before
+        anything is written
+        """
+        if type(cls) == str:
+            cls = classes_by_name[cls]
+        table = cls.__table__
+        unknown = sorted({k for row in rows for k in row
+                          if k not in table.columns and k != '__class__'})
+        if unknown:
+            raise KeyError("Unknown fields: {}".format(', '.join(unknown)))
+        natural_key = getattr(cls, 'natural_key', None)
+        now = datetime.utcnow()
+        results = []
+        seen = {}
+        pending = []
+        for row in rows:
+            values = row_values(cls, row, now)
+            if natural_key and values.get(natural_key) is not None:
+                key = values[natural_key]
+            else:
+                key = json.dumps({k: v for k, v in row.items()
+                                  if k in table.columns},
+                                 sort_keys=True, default=str)
+            if key in seen:
+                results.append({"id": seen[key], "status": "duplicate"})
+                continue
+            seen[key] = values['id']
+            results.append({"id": values['id'], "status": "created"})
+            pending.append((len(results) - 1, values))
+
+        try:
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                # executemany needs the same keys in every row, so rows
+                # with different column sets go in separate statements
+                groups = {}
+                for _, values in batch:
+                    groups.setdefault(tuple(sorted(values)), []).append(values)
+                inserted = set()
+                for group in groups.values():
+                    stmt = pg_insert(table).on_conflict_do_nothing()
+                    stmt = stmt.returning(table.c.id)
+                    inserted.update(self.__session.execute(stmt, group).scalars())
+                conflicts = [(index, values) for index, values in batch
+                             if values['id'] not in inserted]
+                for index, values in conflicts:
+                    results[index]['status'] = 'exists'
+                keys = [v[natural_key] for _, v in conflicts
+                        if natural_key and v.get(natural_key) is not None]
+                if keys:
+                    # report the id of the row that already holds the key
+                    column = getattr(cls, natural_key)
+                    existing = dict(self.__session.query(column, cls.id)
+                                    .filter(column.in_(keys)).all())
+                    for index, values in conflicts:
+                        if values.get(natural_key) in existing:
+                            results[index]['id'] = existing[values[natural_key]]
             self.save()
-        return instance
-    
+        except Exception:
+            self.__session.rollback()
+            raise
+        return results
+
     def close(self):
         """ calls remove()
         """
-        self.__session.close()
\ No newline at end of file
+        self.__session.remove()
\ No newline at end of file
@@ -2,7 +2,10 @@
 """This module defines a class to manage file storage for hbnb clone"""
 
 import json
+import os
+import threading
 from backend.models.base_model import BaseModel
+from backend.models.engine import columnar
 from backend.models import (
     Suburb,
     BusStop,
@@ -15,11 +18,64 @@ from backend.models import (
     VehicleTrip
 )
 
+classes = {
+            'BaseModel': BaseModel,
+            'Suburb': Suburb,
+            'BusStop': BusStop,
+            'Route': Route,
+            'Agency': Agency,
+            'User': User,
+            'Terminal': Terminal,
+            'Vehicle': Vehicle,
+            'VehicleTrip': VehicleTrip,
+          }
+
+# Secondary indexes kept up to date by new() and delete(); natural keys
+# are always indexed as well
+indexes = {
+            'BusStop': ('route_id', 'suburb_id'),
+            'Terminal': ('suburb_id',),
+          }
+# Many-to-many link sets: list attributes indexed by each of their ids
+link_sets = {
+            'Route': ('vehicle_ids', 'terminal_ids'),
+          }
+
+# Attributes every model has besides its declared field_defaults
+base_fields = ('id', 'created_at', 'updated_at')
+
+
+def indexed_attrs(clsname):
+    """Returns the scalar and the link set attributes indexed for clsname"""
+    scalars = indexes.get(clsname, ())
+    natural_key = getattr(classes.get(clsname), 'natural_key', None)
+    if natural_key and natural_key not in scalars:
+        scalars = scalars + (natural_key,)
+    return scalars, link_sets.get(clsname, ())
+
 
 class FileStorage:
     """This class manages storage of hbnb models in JSON format"""
     __file_path = 'data/data_src/db_file.json'
     __objects = {}
+    # class name -> {key: obj}, so per class reads never scan other classes
+    __buckets = {}
+    # (class name, attribute) -> {value: set of keys}
+    __indexes = {}
+    # key -> [(attribute, values)] the object is currently indexed under
+    __indexed = {}
+    # key -> object (None once deleted) changed since the last save()
+    __dirty = {}
+    # records appended to the journal since the last compaction
+    __journal_records = 0
+    __compact_every = int(os.getenv("UMPIRE_FILE_COMPACT_EVERY", 1000))
+    __fsync = os.getenv("UMPIRE_FILE_FSYNC", "1") == "1"
+    __lock = threading.RLock()
+    __compacting = None
+    # snapshot format written by compact(): json or columnar
+    __format = os.getenv("UMPIRE_FILE_FORMAT", "json")
+    # class name -> columnar snapshot whose rows are not materialized yet
+    __pending = {}
 
     def all(self, cls=None):
         """Returns a dictionary of models currently in storage
@@ -28,60 +84,520 @@ class FileStorage:
            Return: dict
         """
         if cls:
-            ret_dict = {}
-            all_objects = self.__objects
-            for k in all_objects:
-                clsname = k.partition('.')[0]
-                if clsname == cls.__name__:
-                    ret_dict[k] = self.__objects[k]
-            return ret_dict
+            if type(cls) != str:
+                cls = cls.__name__
+            self.__load(cls)
+            return dict(self.__buckets.get(cls, {}))
         else:
+            self.__load()
             return self.__objects
 
+    def __load(self, clsname=None):
+        """Materializes the objects of clsname (every class when None)
+           still waiting in a columnar snapshot"""
+        if not self.__pending:
+            return
+        with self.__lock:
+            names = [clsname] if clsname else list(self.__pending)
+            for name in names:
+                snap = self.__pending.pop(name, None)
+                if snap is None:
+                    continue
+                cls = classes[name]
+                for row in snap.rows(name):
+                    self.__put("{}.{}".format(name, row['id']),
+                               cls.from_record(row))
+                if snap not in self.__pending.values():
+                    snap.close()
+
     def new(self, obj):
-        """Adds new object to storage dictionary"""
+        """Adds new object to storage dictionary, (re)indexing it"""
         if obj:
-            self.__objects["{}.{}".format(type(obj).__name__, obj.id)] = obj
+            key = "{}.{}".format(type(obj).__name__, obj.id)
+            with self.__lock:
+                self.__put(key, obj)
+                self.__dirty[key] = obj
+
+    def __put(self, key, obj):
+        """Stores obj under key in the dictionary, bucket and indexes"""
+        clsname = key.partition('.')[0]
+        self.__load(clsname)
+        self.__unindex(key)
+        self.__objects[key] = obj
+        self.__buckets.setdefault(clsname, {})[key] = obj
+        self.__index(key, clsname, obj)
+
+    def __remove(self, key):
+        """Drops key from the dictionary, bucket and indexes"""
+        self.__load(key.partition('.')[0])
+        self.__unindex(key)
+        self.__objects.pop(key, None)
+        self.__buckets.get(key.partition('.')[0], {}).pop(key, None)
+
+    def __index(self, key, clsname, obj):
+        """Adds obj to the secondary indexes of its class"""
+        scalars, links = indexed_attrs(clsname)
+        entries = []
+        for attr in scalars + links:
+            value = getattr(obj, attr, None)
+            if value is None:
+                continue
+            values = list(value) if attr in links else [value]
+            index = self.__indexes.setdefault((clsname, attr), {})
+            for v in values:
+                index.setdefault(v, set()).add(key)
+            entries.append((attr, values))
+        if entries:
+            self.__indexed[key] = entries
+
+    def __unindex(self, key):
+        """Removes key from the secondary indexes"""
+        clsname = key.partition('.')[0]
+        for attr, values in self.__indexed.pop(key, ()):
+            index = self.__indexes.get((clsname, attr), {})
+            for v in values:
+                keys = index.get(v)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del index[v]
+
+    def lookup(self, cls, attr, value):
+        """Returns the objects of type cls whose indexed attribute attr
+           equals value (or, for link sets, contains value).
+           Indexes follow new() and delete(): an object changed in place
+           is re-indexed when it is saved, as BaseModel.save() calls new().
+           Args
+              cls: The class (or class name) of the objects
+              attr: The indexed attribute
+              value: The value to look up
+           Return: list
+        """
+        if type(cls) != str:
+            cls = cls.__name__
+        self.__load(cls)
+        scalars, links = indexed_attrs(cls)
+        if attr not in scalars and attr not in links:
+            return self.query(cls, filters={attr: value})
+        keys = self.__indexes.get((cls, attr), {}).get(value, ())
+        return [self.__objects[k] for k in keys]
 
     def save(self):
-        """Saves storage dictionary to file"""
-        temp = {}
-        for key, value in self.__objects.items():
-            temp[key] = value.to_dict()
-        with open(self.__file_path, 'w', encoding="UTF-8") as f:
-            json.dump(temp, f)
+        """Saves the objects changed since the last save to file.
+           Each change is appended to the journal as one JSON line
+           ({"op": "put", "key", "value"} or {"op": "del", "key"}), so a
+           save costs in proportion to the changes, not to the store.
+           Once the journal holds UMPIRE_FILE_COMPACT_EVERY records it is
+           folded into the JSON snapshot by a background thread.
+        """
+        with self.__lock:
+            if not self.__dirty:
+                return
+            lines = []
+            for key, obj in self.__dirty.items():
+                if obj is None:
+                    record = {"op": "del", "key": key}
+                else:
+                    record = {"op": "put", "key": key, "value": obj.to_dict()}
+                lines.append(json.dumps(record) + '\n')
+            with open(self.__journal_path(), 'a', encoding="UTF-8") as f:
+                f.write(''.join(lines))
+                f.flush()
+                if self.__fsync:
+                    os.fsync(f.fileno())
+            self.__dirty.clear()
+            FileStorage.__journal_records += len(lines)
+            if self.__journal_records >= self.__compact_every:
+                self.compact(wait=False)
+
+    def dirty_classes(self):
+        """Returns the names of the classes with unsaved changes"""
+        return {key.split('.')[0] for key in self.__dirty}
+
+    def compact(self, wait=True):
+        """Folds the journal into a new JSON snapshot.
+           The current state is captured and the journal rotated to
+           <journal>.old under the lock; the snapshot is then written to a
+           temporary file, fsynced and atomically renamed over the old one
+           before <journal>.old is removed. A crash at any point leaves
+           snapshot + journal(s) that reload() replays to the same state.
+           Args
+              wait: compact in the calling thread instead of a daemon thread
+        """
+        with self.__lock:
+            running = self.__compacting
+            if running is not None and running.is_alive():
+                if wait:
+                    running.join()
+                return
+            self.__load()
+            snapshot = {key: obj.to_dict()
+                        for key, obj in self.__objects.items()}
+            journal = self.__journal_path()
+            if os.path.exists(journal):
+                old = journal + '.old'
+                if os.path.exists(old):
+                    # an earlier compaction did not finish: keep its records
+                    with open(old, 'a', encoding="UTF-8") as dst, \
+                            open(journal, 'r', encoding="UTF-8") as src:
+                        dst.write(src.read())
+                    os.remove(journal)
+                else:
+                    os.replace(journal, old)
+            FileStorage.__journal_records = 0
+            if wait:
+                self.__write_snapshot(snapshot)
+            else:
+                thread = threading.Thread(target=self.__write_snapshot,
+                                          args=(snapshot,), daemon=True)
+                FileStorage.__compacting = thread
+                thread.start()
+
+    def __write_snapshot(self, snapshot):
+        """Atomically replaces the snapshot, then drops the rotated
+           journal it supersedes"""
+        path = self.__snapshot_path()
+        tmp = path + '.tmp'
+        if self.__format == 'columnar':
+            columnar.write(tmp, snapshot)
+        else:
+            with open(tmp, 'w', encoding="UTF-8") as f:
+                json.dump(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+        old = self.__journal_path() + '.old'
+        if os.path.exists(old):
+            os.remove(old)
+
+    def __snapshot_path(self):
+        """Returns the path of the snapshot in the configured format"""
+        if self.__format == 'columnar':
+            return os.path.splitext(self.__file_path)[0] + '.col'
+        return self.__file_path
+
+    def __journal_path(self):
+        """Returns the path of the append-only journal"""
+        return self.__file_path + '.journal'
 
     def reload(self):
-        """Loads storage dictionary from file"""
-        classes = {
-                    'BaseModel': BaseModel, 
-                    'Suburb': Suburb,
-                    'BusStop': BusStop,
-                    'Route': Route,
-                    'Agency': Agency,
-                    'User': User,
-                    'Terminal': Terminal,
-                    'Vehicle': Vehicle,
-                    'VehicleTrip': VehicleTrip,
-                    
-                  }
+        """Loads storage dictionary from file: the snapshot, then the
+           journal records written after it.
+           A columnar snapshot is only mapped and its header read; each
+           class is materialized on first access.
+        """
+        with self.__lock:
+            path = self.__snapshot_path()
+            if self.__format == 'columnar' and os.path.exists(path):
+                snap = columnar.ColumnarSnapshot(path)
+                for name in snap.classes():
+                    self.__pending[name] = snap
+            else:
+                # a JSON snapshot is also read when switching to columnar;
+                # the next compaction writes it in the new format
+                try:
+                    temp = {}
+                    with open(self.__file_path, 'r', encoding="UTF-8") as f:
+                        temp = json.load(f)
+                        for key, val in temp.items():
+                            cls = classes[val['__class__']]
+                            self.__put(key, cls.from_record(val))
+                except FileNotFoundError:
+                    pass
+            journal = self.__journal_path()
+            FileStorage.__journal_records = self.__replay(journal + '.old')
+            FileStorage.__journal_records += self.__replay(journal)
+            self.__dirty.clear()
+
+    def __replay(self, path):
+        """Applies the records of a journal file, returning their count.
+           A torn last line, left by a crash during a write, is cut off so
+           that later appends start on a clean line.
+        """
+        count = 0
         try:
-            temp = {}
-            with open(self.__file_path, 'r', encoding="UTF-8") as f:
-                temp = json.load(f)
-                for key, val in temp.items():
-                    self.all()[key] = classes[val['__class__']](**val)
+            with open(path, 'rb+') as f:
+                good = 0
+                for line in f:
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError("torn record")
+                        record = json.loads(line)
+                    except ValueError:
+                        f.seek(good)
+                        f.truncate()
+                        break
+                    if record['op'] == 'put':
+                        val = record['value']
+                        self.__put(record['key'],
+                                   classes[val['__class__']].from_record(val))
+                    else:
+                        self.__remove(record['key'])
+                    good += len(line)
+                    count += 1
         except FileNotFoundError:
             pass
+        return count
 
     def delete(self, obj=None):
         """ delete an existing element
         """
         if obj:
             key = "{}.{}".format(type(obj).__name__, obj.id)
-            del self.__objects[key]
+            with self.__lock:
+                self.__remove(key)
+                self.__dirty[key] = None
             self.save()
 
+    def get(self, cls, id, include=None):
+        """Returns the object of type cls with the given id, or None
+           Args
+              cls: The class (or class name) of the object
+              id: The object id
+              include: accepted for parity with DBStorage; relationships
+                 are resolved through the in-memory indexes
+        """
+        if id is None or cls is None:
+            return None
+        if type(cls) != str:
+            cls = cls.__name__
+        self.__load(cls)
+        return self.__objects.get("{}.{}".format(cls, id))
+
+    def get_many(self, cls, ids):
+        """Returns the objects of type cls whose id is in ids
+           Args
+              cls: The class (or class name) of the objects
+              ids: The object ids
+           Return: list, in the order of ids
+        """
+        if cls is None or not ids:
+            return []
+        if type(cls) != str:
+            cls = cls.__name__
+        self.__load(cls)
+        objs = []
+        for id in dict.fromkeys(ids):
+            obj = self.__objects.get("{}.{}".format(cls, id))
+            if obj is not None:
+                objs.append(obj)
+        return objs
+
+    def query(self, cls, filters=None, order_by=None, limit=None, offset=None,
+              include=None):
+        """Returns the objects of type cls matching a filtered, ordered query
+           Args
+              cls: The class (or class name) of the objects
+              filters: dict of attribute -> value; list values match any
+              order_by: attribute name(s), prefixed with '-' for descending
+              limit: maximum number of objects
+              offset: number of objects to skip
+              include: accepted for parity with DBStorage
+           Return: list
+        """
+        if cls is None:
+            return []
+        if type(cls) != str:
+            cls = cls.__name__
+        self.__load(cls)
+        filters = dict(filters or {})
+        scalars, _ = indexed_attrs(cls)
+        candidates = None
+        # narrow the candidates with the secondary indexes first
+        for key in [k for k in filters if k in scalars]:
+            value = filters.pop(key)
+            index = self.__indexes.get((cls, key), {})
+            if isinstance(value, (list, tuple, set)):
+                keys = set().union(*[index.get(v, ()) for v in value])
+            else:
+                keys = index.get(value, set())
+            candidates = keys if candidates is None else candidates & keys
+        if candidates is None:
+            objs = self.__buckets.get(cls, {}).values()
+        else:
+            objs = [self.__objects[k] for k in candidates]
+        for key, value in filters.items():
+            if isinstance(value, (list, tuple, set)):
+                value = set(value)
+                objs = [o for o in objs if getattr(o, key, None) in value]
+            else:
+                objs = [o for o in objs if getattr(o, key, None) == value]
+        objs = list(objs)
+        if order_by:
+            if type(order_by) == str:
+                order_by = [order_by]
+            # list.sort is stable, so sorting by the last key first gives
+            # the same result as a multi-column ORDER BY
+            for key in reversed(order_by):
+                desc = key.startswith('-')
+                key = key.lstrip('-')
+                objs.sort(key=lambda o: (getattr(o, key, None) is None,
+                                         getattr(o, key, None)),
+                          reverse=desc)
+        start = offset or 0
+        end = start + limit if limit is not None else None
+        return objs[start:end]
+
+    def __check_fields(self, cls, fields):
+        """Raises KeyError naming the fields cls does not declare, as
+           DBStorage does for names that are not columns"""
+        unknown = [f for f in fields if f not in base_fields and
+                   f not in cls.field_defaults]
+        if unknown:
+            raise KeyError("Unknown fields: {}".format(', '.join(unknown)))
+
+    def page(self, cls, limit=None, after=None, fields=None, filters=None,
+             include=None):
+        """Returns one keyset page of objects of type cls ordered by
+           (created_at, id)
+           Args
+              cls: The class (or class name) of the objects
+              limit: maximum number of objects
+              after: (created_at, id) of the last object of the previous page
+              fields: attribute names to project; objects come back as dicts
+              filters: dict of attribute -> value equality filters
+              include: accepted for parity with DBStorage
+           Return: list of objects, or of dicts when fields is given
+        """
+        if cls is None:
+            return []
+        if type(cls) == str:
+            cls = classes[cls]
+        if fields:
+            self.__check_fields(cls, fields)
+        objs = self.query(cls, filters=filters)
+        keys = [((o.created_at, o.id), o) for o in objs]
+        if after:
+            after = tuple(after)
+            keys = [k for k in keys if k[0] > after]
+        keys.sort(key=lambda k: k[0])
+        objs = [o for _, o in keys[:limit]]
+        if fields:
+            return [{f: getattr(o, f, None) for f in fields} for o in objs]
+        return objs
+
+    def stream(self, cls, batch_size=500, fields=None):
+        """Yields every object of type cls without building a result dict
+           Args
+              cls: The class (or class name) of the objects
+              batch_size: kept for parity with DBStorage; unused in memory
+              fields: attribute names to project; objects come back as dicts
+           Return: generator of objects, or of dicts when fields is given
+        """
+        if type(cls) != str:
+            cls = cls.__name__
+        if fields:
+            self.__check_fields(classes[cls], fields)
+        self.__load(cls)
+        bucket = self.__buckets.get(cls, {})
+        # iterate over a snapshot of the keys so writes made while a
+        # response is streaming do not break the iteration
+        for key in list(bucket):
+            obj = bucket.get(key)
+            if obj is None:
+                continue
+            if fields:
+                yield {f: getattr(obj, f, None) for f in fields}
+            else:
+                yield obj
+
+    def get_by(self, cls, **kwargs):
+        """Returns the list of objects of type cls matching kwargs"""
+        return self.query(cls, filters=kwargs)
+
+    def get_many_by(self, cls, **kwargs):
+        """Returns the list of objects of type cls matching kwargs"""
+        return self.query(cls, filters=kwargs)
+
+    def get_one_by(self, cls, include=None, **kwargs):
+        """Returns the first object of type cls matching kwargs, or None;
+           include is accepted for parity with DBStorage"""
+        objs = self.query(cls, filters=kwargs, limit=1)
+        return objs[0] if objs else None
+
+    def get_or_create(self, cls, **kwargs):
+        """Returns the first object of type cls matching kwargs, creating
+           it if it does not exist. Classes declaring a natural_key are
+           matched on that attribute only. As with DBStorage the caller
+           writes the new objects with save().
+        """
+        if type(cls) == str:
+            cls = classes[cls]
+        key = getattr(cls, 'natural_key', None)
+        if key is not None and kwargs.get(key) is not None:
+            return self.get_or_create_many(cls, [kwargs])[0]
+        instance = self.get_one_by(cls, **kwargs)
+        if instance is None:
+            instance = cls(**kwargs)
+            self.new(instance)
+        return instance
+
+    def get_or_create_many(self, cls, rows, batch_size=500):
+        """Batched get_or_create on the class natural_key; the caller
+           writes the new objects with save()
+           Args
+              cls: The class (or class name) of the objects
+              rows: dicts of attribute values
+              batch_size: kept for parity with DBStorage; unused here
+           Return: list of objects, one per row, in the order of rows
+        """
+        if type(cls) == str:
+            cls = classes[cls]
+        key = getattr(cls, 'natural_key', None)
+        if key is None:
+            return [self.get_or_create(cls, **row) for row in rows]
+        objs = []
+        for row in rows:
+            if row.get(key) is None:
+                raise ValueError("{} requires {}".format(cls.__name__, key))
+            found = self.lookup(cls, key, row[key])
+            if found:
+                obj = found[0]
+            else:
+                obj = cls.from_record(row)
+                self.new(obj)
+            objs.append(obj)
+        return objs
+
+    def bulk_create(self, cls, rows, batch_size=500):
+        """Creates many objects and writes the JSON file once
+           Args
+              cls: The class (or class name) of the objects
+              rows: dicts of attribute values
+              batch_size: kept for parity with DBStorage; unused here
+           Return: one {"id", "status"} dict per row, where status is
+              created, duplicate (repeated in rows) or exists (id or
+              natural_key taken)
+        """
+        if type(cls) == str:
+            cls = classes[cls]
+        natural_key = getattr(cls, 'natural_key', None)
+        results = []
+        seen = {}
+        for row in rows:
+            if natural_key and row.get(natural_key) is not None:
+                key = row[natural_key]
+            else:
+                key = json.dumps(row, sort_keys=True, default=str)
+            if key in seen:
+                results.append({"id": seen[key], "status": "duplicate"})
+                continue
+            if natural_key and row.get(natural_key) is not None:
+                existing = self.lookup(cls, natural_key, key)
+                if existing:
+                    seen[key] = existing[0].id
+                    results.append({"id": existing[0].id, "status": "exists"})
+                    continue
+            obj = cls.from_record(row)
+            seen[key] = obj.id
+            if "{}.{}".format(cls.__name__, obj.id) in self.__objects:
+                results.append({"id": obj.id, "status": "exists"})
+                continue
+            self.new(obj)
+            results.append({"id": obj.id, "status": "created"})
+        self.save()
+        return results
+
     def close(self):
         """deserializing the JSON file to objects
         """
@@ -89,4 +605,5 @@ class FileStorage:
 
     def get_objects(self):
         """Returns the objects dictionary"""
+        self.__load()
         return self.__objects
\ No newline at end of file
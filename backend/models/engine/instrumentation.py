@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+"""SQL statement counting and timing for DBStorage
+
+The engine events record every statement into the QueryStats of the
+current unit of work (one HTTP request), kept in a context variable so
+threads and requests never mix their counters:
+
+    token = instrumentation.start()
+    ...                                  # code that queries the database
+    stats = instrumentation.finish(token)
+    instrumentation.check(stats, 'GET /api/v1/routes')
+
+A streamed response keeps querying while its body is sent: its
+counters are finished when the response is closed (see current()).
+
+check() logs a warning when the unit of work goes over the query budget
+(UMPIRE_QUERY_BUDGET, default 50) or runs the same statement shape more
+than UMPIRE_QUERY_REPEAT times (default 10), the signature of an N+1.
+"""
+
+import logging
+import os
+import re
+from collections import Counter
+from contextvars import ContextVar
+from time import perf_counter
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+query_budget = int(os.getenv("UMPIRE_QUERY_BUDGET", 50))
+repeat_threshold = int(os.getenv("UMPIRE_QUERY_REPEAT", 10))
+# upper bounds, in milliseconds, of the timing histogram buckets
+buckets = (1, 5, 10, 50, 100, 500, 1000)
+
+_current = ContextVar('query_stats', default=None)
+
+_literals = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_params = re.compile(r"%\(\w+\)s|:\w+|\?")
+_lists = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_spaces = re.compile(r"\s+")
+
+
+def shape(statement):
+    """Reduces a statement to its shape: literals and bound parameters
+    become ?, IN lists collapse to (?), whitespace is normalized"""
+    statement = _literals.sub('?', statement)
+    statement = _params.sub('?', statement)
+    statement = _lists.sub('(?)', statement)
+    return _spaces.sub(' ', statement).strip()
+
+
+class QueryStats:
+    """Counters and timings of the statements of one unit of work"""
+
+    def __init__(self):
+        """Starts with no statements recorded"""
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest_ms = 0.0
+        self.histogram = [0] * (len(buckets) + 1)
+        self.shapes = Counter()
+
+    def record(self, statement, elapsed_ms):
+        """Adds one statement that ran for elapsed_ms"""
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.slowest_ms = max(self.slowest_ms, elapsed_ms)
+        n = 0
+        while n < len(buckets) and elapsed_ms > buckets[n]:
+            n += 1
+        self.histogram[n] += 1
+        self.shapes[shape(statement)] += 1
+
+    def repeated(self):
+        """Returns the (shape, count) pairs run more than repeat_threshold
+        times, most repeated first"""
+        return [(s, n) for s, n in self.shapes.most_common()
+                if n > repeat_threshold]
+
+    def summary(self):
+        """One line summary, used for the dev mode response header"""
+        hist = ','.join('le{}={}'.format(bound, n) for bound, n
+                        in zip(buckets + ('inf',), self.histogram) if n)
+        return 'count={}; time={:.1f}ms; max={:.1f}ms; hist={}'.format(
+            self.count, self.total_ms, self.slowest_ms, hist or '-')
+
+
+def start():
+    """Begins collecting statements for the current context"""
+    return _current.set(QueryStats())
+
+
+def current():
+    """Returns the QueryStats collecting for the current context, or None"""
+    return _current.get()
+
+
+def finish(token):
+    """Stops collecting and returns the QueryStats of the context"""
+    stats = _current.get()
+    try:
+        _current.reset(token)
+    except ValueError:
+        # the token was made in another context (a streamed response
+        # closed by the server): that context is gone with its counters
+        pass
+    return stats
+
+
+def check(stats, label):
+    """Logs a warning when stats break the query budget or repeat a
+    statement shape; returns True when they do"""
+    if stats is None:
+        return False
+    warned = False
+    if stats.count > query_budget:
+        logger.warning("%s ran %d SQL statements (budget %d, %.1fms)",
+                       label, stats.count, query_budget, stats.total_ms)
+        warned = True
+    for statement, n in stats.repeated():
+        logger.warning("%s ran the same statement %d times: %s",
+                       label, n, statement[:200])
+        warned = True
+    return warned
+
+
+def attach(engine):
+    """Hooks the cursor events of engine into the current QueryStats"""
+    # one statement runs at a time on a connection: a single start time,
+    # overwritten by the next statement, cannot pile up when one fails
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info['query_start'] = perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters,
+                             context, executemany):
+        record_statement(conn, statement)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and exception_context.statement is not None:
+            record_statement(conn, exception_context.statement)
+
+
+def record_statement(conn, statement):
+    """Records statement, which ran or failed on conn, in the current
+    QueryStats"""
+    started = conn.info.pop('query_start', None)
+    stats = _current.get()
+    if started is not None and stats is not None:
+        stats.record(statement, (perf_counter() - started) * 1000)
@@ -14,52 +14,73 @@ STORAGE_TYPE = os.getenv("UMPIRE_TYPE_STORAGE", "file")
 
 class Route(BaseModel, Base):
     """ The route class, contains city ID and name """
+    # unique business key used by get_or_create upserts
+    natural_key = 'name'
     if STORAGE_TYPE == "db":
         __tablename__ = 'routes'
-        name = Column(String(128), nullable=False)
+        name = Column(String(128), nullable=False, unique=True, index=True)
         distance_km = Column(Float, nullable=False)
         # Relationships
         bus_stops = relationship("BusStop", secondary='route_stops', back_populates="routes")
         terminals = relationship("Terminal", secondary='route_terminals', back_populates="routes")
         vehicles = relationship("Vehicle", secondary='routed_vehicles', back_populates="routes")
         agencies = relationship("Agency", secondary='route_agencies', back_populates="routes")
+
+        def add_vehicle(self, vehicle):
+            """Links vehicle to the route"""
+            if vehicle not in self.vehicles:
+                self.vehicles.append(vehicle)
+
+        def add_terminal(self, terminal):
+            """Links terminal to the route"""
+            if terminal not in self.terminals:
+                self.terminals.append(terminal)
     else:
         id = ""
         name = ""
         distance = 0.0
+        # None until known: the travel time features fall back to a default
+        distance_km = None
         travel_time = 0.0
         bus_stops = []
         vehicles = []
         terminals = []
         agencies = []
+        # link sets for the many-to-many relationships, owned by the route
+        vehicle_ids = []
+        terminal_ids = []
 
         @property
         def stops(self):
             """Get the list of bus stops for the route"""
             from backend.models.bus_stop import BusStop
             from backend import models
-            stop_lists = []
-            for stop in models.storage.all(BusStop).values():
-                if stop.route_id == self.id:
-                    stop_lists.append(stop)
-            return stop_lists
+            return models.storage.lookup(BusStop, 'route_id', self.id)
         @property
         def vehicles(self):
             """Get the list of vehicles for the route"""
             from backend.models.vehicle import Vehicle
             from backend import models
-            vehicle_lists = []
-            for vehicle in models.storage.all(Vehicle).values():
-                if self.id in [route.id for route in vehicle.routes]:
-                    vehicle_lists.append(vehicle)
-            return vehicle_lists
+            return models.storage.get_many(Vehicle, self.vehicle_ids)
         @property
         def terminals(self):
             """Get the list of terminals for the route"""
             from backend.models.terminal import Terminal
             from backend import models
-            terminal_lists = []
-            for terminal in models.storage.all(Terminal).values():
-                if self.id in [route.id for route in terminal.routes]:
-                    terminal_lists.append(terminal)
-            return terminal_lists
\ No newline at end of file
+            return models.storage.get_many(Terminal, self.terminal_ids)
+
+        def add_vehicle(self, vehicle):
+            """Links vehicle to the route, re-indexing the route so that
+            Vehicle.routes sees it"""
+            from backend import models
+            if vehicle.id not in self.vehicle_ids:
+                self.vehicle_ids = list(self.vehicle_ids) + [vehicle.id]
+                models.storage.new(self)
+
+        def add_terminal(self, terminal):
+            """Links terminal to the route, re-indexing the route so that
+            Terminal.routes sees it"""
+            from backend import models
+            if terminal.id not in self.terminal_ids:
+                self.terminal_ids = list(self.terminal_ids) + [terminal.id]
+                models.storage.new(self)
@@ -38,8 +38,4 @@ class Suburb(BaseModel, Base):
             
             """Get the list of bus stops in the suburb"""
             from backend.models.bus_stop import BusStop
-            bus_stop_lists = []
-            for bus_stop in models.storage.all(BusStop).values():
-                if bus_stop.suburb_id == self.id:
-                    bus_stop_lists.append(bus_stop)
-            return bus_stop_lists
+            return models.storage.lookup(BusStop, 'suburb_id', self.id)
@@ -16,9 +16,11 @@ STORAGE_TYPE = os.getenv("UMPIRE_TYPE_STORAGE", "file")
 
 class Terminal(BaseModel, Base):
     """ The terminal class, contains terminal ID and name """
+    # unique business key used by get_or_create upserts
+    natural_key = 'terminal_id'
     if STORAGE_TYPE == "db":
         __tablename__ = 'terminals'
-        terminal_id = Column(String(20), nullable=True)
+        terminal_id = Column(String(20), nullable=True, unique=True, index=True)
         name = Column(String(128), nullable=False)
         latitude = Column(Float, nullable=False)
         longitude = Column(Float, nullable=False)
@@ -41,8 +43,9 @@ class Terminal(BaseModel, Base):
         @property
         def routes(self):
             """Get the list of routes for the terminal"""
-            route_lists = []
-            for route in models.storage.all(Route).values():
-                if self.id in [terminal.id for terminal in route.terminals]:
-                    route_lists.append(route)
-            return route_lists
+            return models.storage.lookup(Route, 'terminal_ids', self.id)
+
+        @property
+        def suburb(self):
+            """Get the suburb the terminal is in"""
+            return models.storage.get('Suburb', self.suburb_id)
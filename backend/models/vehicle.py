@@ -16,9 +16,11 @@ src_vehicle_icon = os.path.abspath(os.path.join(wrkdir, "../../assets/bus3.png")
 
 class Vehicle(BaseModel, Base):
     """ The vehicle class, contains vehicle ID and name """
+    # unique business key used by get_or_create upserts
+    natural_key = 'vehicle_number'
     if STORAGE_TYPE == "db":
         __tablename__ = 'vehicles'
-        vehicle_number = Column(String(128), nullable=False)
+        vehicle_number = Column(String(128), nullable=False, unique=True, index=True)
         latitude = Column(Float, nullable=True)
         longitude = Column(Float, nullable=True)
         capacity = Column(Integer, nullable=False)
@@ -41,8 +43,4 @@ class Vehicle(BaseModel, Base):
             """Get the list of routes for the vehicle"""
             from backend.models.route import Route
             from backend import models
-            route_lists = []
-            for route in models.storage.all(Route).values():
-                if self.id in [vehicle.id for vehicle in route.vehicles]:
-                    route_lists.append(route)
-            return route_lists
\ No newline at end of file
+            return models.storage.lookup(Route, 'vehicle_ids', self.id)
\ No newline at end of file
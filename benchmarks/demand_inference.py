@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+"""Benchmark: demand prediction, pandas recipe vs the numpy engine
+
+Runs the demand_model_serve.py recipe (Categorical + get_dummies, one
+call per pair) and DemandEngine (numpy one-hot, one call per batch) on
+the same (agency_id, day_name) pairs, checks they predict the same
+values and prints the time per pair.
+
+    python -m benchmarks.demand_inference [pairs] [repeat]
+"""
+
+import sys
+import timeit
+import numpy as np
+import pandas as pd
+from api.v1.ml import demand
+from api.v1.ml.registry import registry
+
+
+def recipe(model, feature_columns, day_categories, agency_id, day_name):
+    """The per-pair pandas path of demand_model_serve.py"""
+    df_input = pd.DataFrame([{"agency_id": agency_id, "day_name": day_name}])
+    df_input['day_name'] = pd.Categorical(df_input['day_name'],
+                                          categories=day_categories,
+                                          ordered=True)
+    df_input = pd.get_dummies(df_input, columns=['day_name'])
+    for col in feature_columns:
+        if col not in df_input.columns:
+            df_input[col] = 0
+    return model.predict(df_input[feature_columns])[0]
+
+
+def main(count=200, repeat=5):
+    """Times both paths and prints the best run of each"""
+    model = registry.get('demand_model')
+    columns = registry.get('demand_columns')
+    days = registry.get('demand_day_categories')
+    engine = demand.engine()
+    rng = np.random.default_rng(0)
+    pairs = [(int(agency), days[day]) for agency, day in
+             zip(rng.integers(1, 60, count), rng.integers(0, 7, count))]
+
+    def per_pair():
+        return [recipe(model, columns, days, *pair) for pair in pairs]
+
+    def batched():
+        return engine.predict(pairs)
+
+    assert np.allclose(per_pair(), batched(), rtol=0, atol=1e-9)
+    print("{} pairs ({} runs), same predictions".format(count, repeat))
+    results = {}
+    for label, fn in (('get_dummies per pair', per_pair),
+                      ('numpy engine batch', batched),
+                      ('numpy engine 1 pair',
+                       lambda: engine.predict(pairs[:1]))):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        per = best / (1 if label.endswith('1 pair') else count)
+        results[label] = per
+        print("  {:<22} {:10.1f} us/pair".format(label, per * 1e6))
+    print("  speedup (batch) {:.0f}x".format(
+        results['get_dummies per pair'] / results['numpy engine batch']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,131 @@
+#!/usr/bin/python3
+"""Memory held by file-mode model instances
+
+Builds records shaped like the Accra network (bus stops, routes with their
+link sets, terminals, vehicles) the way FileStorage.reload() does and
+reports the bytes allocated per object and the resident memory added,
+both for the __slots__ models and for plain objects keeping every field
+in a __dict__, the layout the models had before. Each layout is measured
+in a fresh process.
+
+    UMPIRE_TYPE_STORAGE=file python -m benchmarks.file_storage_memory [count]
+"""
+
+import json
+import multiprocessing
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from api.v1.ml.registry import resident_bytes
+from backend.models import BusStop, Route, Terminal, Vehicle
+
+
+def make_records(count):
+    """Returns count (class, record) pairs, about half of them bus stops"""
+    start = datetime(2025, 1, 1)
+    suburbs = [str(uuid.uuid4()) for _ in range(40)]
+    vehicles = [str(uuid.uuid4()) for _ in range(count // 10)]
+    terminals = [str(uuid.uuid4()) for _ in range(count // 20)]
+    routes = [str(uuid.uuid4()) for _ in range(count // 5)]
+    records = []
+
+    def stamp(n):
+        return (start + timedelta(seconds=n)).isoformat(timespec='microseconds')
+
+    for n, id_ in enumerate(vehicles):
+        records.append((Vehicle, {'id': id_, 'name': 'Trotro',
+                                  'vehicle_number': 'GT-{}'.format(n),
+                                  'capacity': 20, 'latitude': 5.6,
+                                  'longitude': -0.18, 'assigned': False,
+                                  'created_at': stamp(n),
+                                  'updated_at': stamp(n)}))
+    for n, id_ in enumerate(terminals):
+        records.append((Terminal, {'id': id_, 'name': 'Terminal {}'.format(n),
+                                   'terminal_id': 'T{}'.format(n),
+                                   'latitude': 5.6, 'longitude': -0.18,
+                                   'suburb_id': suburbs[n % 40],
+                                   'created_at': stamp(n),
+                                   'updated_at': stamp(n)}))
+    for n, id_ in enumerate(routes):
+        records.append((Route, {'id': id_, 'name': 'Route {}'.format(n),
+                                'distance_km': 12.5,
+                                'vehicle_ids': vehicles[n % len(vehicles):][:3],
+                                'terminal_ids': terminals[n % len(terminals):][:2],
+                                'created_at': stamp(n),
+                                'updated_at': stamp(n)}))
+    while len(records) < count:
+        n = len(records)
+        records.append((BusStop, {'id': str(uuid.uuid4()),
+                                  'name': 'Stop {}'.format(n),
+                                  'latitude': 5.5 + n * 1e-4,
+                                  'longitude': -0.2 + n * 1e-4,
+                                  'suburb_id': suburbs[n % 40],
+                                  'route_id': routes[n % len(routes)],
+                                  'created_at': stamp(n),
+                                  'updated_at': stamp(n)}))
+    return records
+
+
+class DictModel:
+    """The former file-mode model layout: every field an entry of the
+    instance __dict__, timestamps parsed, strings not interned"""
+
+    def __init__(self, **kwargs):
+        """Sets the fields as BaseModel.__init__ used to"""
+        kwargs.pop('__class__', None)
+        for key in ('created_at', 'updated_at'):
+            kwargs[key] = datetime.strptime(kwargs[key],
+                                            '%Y-%m-%dT%H:%M:%S.%f')
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+def build(layout, classes, text):
+    """Returns the objects decoded from text in the given layout"""
+    decoded = json.loads(text)
+    if layout == 'dict':
+        return [DictModel(**record) for record in decoded]
+    return [cls(**record) for cls, record in zip(classes, decoded)]
+
+
+def measure(layout, count, results):
+    """Puts (traced bytes, resident bytes) of count objects in results"""
+    records = make_records(count)
+    classes = [cls for cls, _ in records]
+    text = json.dumps([record for _, record in records])
+    before = resident_bytes()
+    objects = build(layout, classes, text)
+    resident = resident_bytes() - before
+    del objects
+    tracemalloc.start()
+    # what stays allocated once the decoded snapshot is dropped
+    objects = build(layout, classes, text)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.put((size, resident))
+
+
+def main(count=5000):
+    """Prints the memory taken by count objects in both layouts"""
+    context = multiprocessing.get_context('spawn')
+    sizes = {}
+    for layout in ('dict', 'slots'):
+        results = context.Queue()
+        child = context.Process(target=measure,
+                                args=(layout, count, results))
+        child.start()
+        sizes[layout] = results.get()
+        child.join()
+        size, resident = sizes[layout]
+        print("{:5} {} objects: {:.2f} MiB traced, {:.0f} bytes per object,"
+              " {:.2f} MiB resident".format(layout, count, size / 2 ** 20,
+                                            size / count,
+                                            resident / 2 ** 20))
+    print("slots take {:.0%} of the traced and {:.0%} of the resident memory"
+          " of dicts".format(sizes['slots'][0] / sizes['dict'][0],
+                             sizes['slots'][1] / max(sizes['dict'][1], 1)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+"""Benchmark: inline inference vs the process pool executor
+
+Threads call the demand model continuously, as prediction requests
+would, while another thread times a small pure-Python task standing in
+for a CRUD request. Inline, the model holds the GIL and the small task
+waits; with workers it runs in other processes. The predictions are
+checked to be the same either way, and the batch counter shows how many
+concurrent requests were merged into one predict() call.
+
+    python -m benchmarks.inference_executor [workers] [threads] [seconds]
+"""
+
+import json
+import statistics
+import sys
+import threading
+from time import perf_counter, sleep
+import numpy as np
+from api.v1.ml.executor import InferenceExecutor, Overloaded
+
+days = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+        'saturday', 'sunday')
+
+
+def crud_like():
+    """A few hundred microseconds of pure Python work"""
+    rows = [{'id': str(n), 'name': 'stop {}'.format(n), 'latitude': 5.6,
+             'longitude': -0.18} for n in range(100)]
+    return json.dumps(rows)
+
+
+def run(executor, threads, seconds):
+    """Loads executor from threads; returns (p50 and p99 of the small
+    task in ms, predictions made, requests rejected)"""
+    stop = threading.Event()
+    made = [0]
+    rejected = [0]
+
+    def predictor(seed):
+        rng = np.random.default_rng(seed)
+        while not stop.is_set():
+            pairs = [(int(a), days[d]) for a, d in
+                     zip(rng.integers(1, 60, 8), rng.integers(0, 7, 8))]
+            try:
+                executor.predict('demand', pairs)
+                made[0] += len(pairs)
+            except Overloaded:
+                rejected[0] += 1
+                sleep(0.001)
+
+    workers = [threading.Thread(target=predictor, args=(n,))
+               for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    samples = []
+    started = perf_counter()
+    while perf_counter() - started < seconds:
+        t = perf_counter()
+        crud_like()
+        samples.append(perf_counter() - t)
+        sleep(0.005)
+    stop.set()
+    for thread in workers:
+        thread.join()
+    samples.sort()
+    return (statistics.median(samples) * 1000,
+            samples[int(len(samples) * 0.99) - 1] * 1000, made[0], rejected[0])
+
+
+def main(workers=2, threads=8, seconds=5):
+    """Runs both setups and prints the latency of the small task"""
+    pairs = [(5, 'monday'), (12, 'friday'), (40, 'sunday')]
+    inline = InferenceExecutor(workers=0)
+    pooled = InferenceExecutor(workers=workers, batch_wait=0.002)
+    pooled.start()
+    assert np.allclose(inline.predict('demand', pairs),
+                       pooled.predict('demand', pairs), rtol=0, atol=1e-9)
+    crud_like()
+    quiet = []
+    for _ in range(200):
+        t = perf_counter()
+        crud_like()
+        quiet.append(perf_counter() - t)
+    print("small task alone: p50 {:.2f}ms".format(
+        statistics.median(quiet) * 1000))
+    print("{} prediction threads, {}s each".format(threads, seconds))
+    for label, executor in (('inline', inline),
+                            ('{} workers'.format(workers), pooled)):
+        p50, p99, made, rejected = run(executor, threads, seconds)
+        print("  {:<10} small task p50 {:6.2f}ms p99 {:7.2f}ms, "
+              "{} predictions, {} rejected".format(label, p50, p99, made,
+                                                   rejected))
+    stats = pooled.stats()
+    print("  micro-batching: {} requests in {} predict() calls".format(
+        stats['requests'], stats['batches']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+"""Benchmark: building model instances from stored records
+
+Compares cls(**record), the path FileStorage.reload() used to take, with
+BaseModel.from_record() on records shaped like the Accra network.
+
+    python -m benchmarks.model_construction [count] [repeat]
+"""
+
+import sys
+import timeit
+from benchmarks.file_storage_memory import make_records
+
+
+def main(count=5000, repeat=10):
+    """Times both construction paths and prints the best run of each"""
+    records = make_records(count)
+
+    def init():
+        return [cls(**record) for cls, record in records]
+
+    def from_record():
+        return [cls.from_record(record) for cls, record in records]
+
+    assert [o.to_dict() for o in init()] == \
+        [o.to_dict() for o in from_record()]
+    print("{} records ({} runs)".format(count, repeat))
+    results = {}
+    for label, fn in (('cls(**record)', init),
+                      ('cls.from_record', from_record)):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        results[label] = best
+        print("  {:<18} {:8.2f} ms  {:6.2f} us/object".format(
+            label, best * 1000, best * 1e6 / count))
+    print("  speedup {:.1f}x".format(results['cls(**record)'] /
+                                     results['cls.from_record']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
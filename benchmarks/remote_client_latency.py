@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""Latency of the remote prediction client against an injected slowdown
+
+Starts benchmarks.stub_prediction_server and checks, with asserts, that
+PredictionClient:
+    - reuses its connections (vs a new requests.post per call)
+    - coalesces identical concurrent calls into one backend request
+    - bounds the latency of a call when the backend slows down
+    - fails fast once the circuit is open, and closes it on recovery
+    - ends a call at its deadline even when the read timeout is longer
+
+    python -m benchmarks.remote_client_latency
+"""
+
+import statistics
+import threading
+from time import perf_counter, sleep
+import requests
+from api.v1.ml.client import PredictionClient, CircuitBreaker, CircuitOpen
+from benchmarks.stub_prediction_server import start
+
+payload = {"agency_id": 5, "day_name": "monday"}
+
+
+def timed(fn):
+    """Returns (seconds taken by fn(), its exception or None)"""
+    started = perf_counter()
+    try:
+        fn()
+        error = None
+    except requests.exceptions.RequestException as e:
+        error = e
+    return perf_counter() - started, error
+
+
+def percentiles(samples):
+    """p50 and p99 in milliseconds"""
+    samples = sorted(samples)
+    return (statistics.median(samples) * 1000,
+            samples[int(len(samples) * 0.99) - 1] * 1000)
+
+
+def main(calls=200):
+    """Runs the scenarios and prints their latencies"""
+    server, url = start()
+    control = url + '_control'
+    client = PredictionClient(url, CircuitBreaker(failures=3, reset=0.5),
+                              timeout=(0.2, 0.3), deadline=1.0, retries=1,
+                              backoff=0.05)
+
+    # healthy backend: pooled session vs a connection per call
+    naive = [timed(lambda: requests.post(url, json=payload))[0]
+             for _ in range(calls)]
+    pooled = [timed(lambda: client.post(payload))[0] for _ in range(calls)]
+    print("healthy, {} calls".format(calls))
+    print("  requests.post   p50 {:6.2f}ms  p99 {:6.2f}ms".format(
+        *percentiles(naive)))
+    print("  pooled client   p50 {:6.2f}ms  p99 {:6.2f}ms".format(
+        *percentiles(pooled)))
+
+    # identical calls in flight together reach the backend once
+    requests.post(control, json={"delay": 0.2})
+    before = server.requests
+    threads = [threading.Thread(target=client.post, args=(payload,))
+               for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("coalescing: 20 identical calls, {} backend request(s)".format(
+        server.requests - before))
+    assert server.requests - before < 20
+
+    # slowdown past the read timeout: bounded calls, then fail fast
+    requests.post(control, json={"delay": 2.0})
+    slow = [timed(lambda: client.post(payload)) for _ in range(3)]
+    fast = [timed(lambda: client.post(payload)) for _ in range(20)]
+    print("backend slowed to 2s, read timeout 0.3s, 1 retry")
+    print("  failing calls   max {:6.0f}ms".format(
+        max(t for t, _ in slow) * 1000))
+    print("  circuit open    max {:6.2f}ms".format(
+        max(t for t, _ in fast) * 1000))
+    assert all(error is not None for _, error in slow)
+    assert all(t < client.deadline + 0.3 for t, _ in slow)
+    assert all(isinstance(error, CircuitOpen) for _, error in fast)
+    assert max(t for t, _ in fast) < 0.01
+
+    # recovery: after the reset delay one trial call closes the circuit
+    requests.post(control, json={"delay": 0})
+    sleep(0.6)
+    data, status = client.post(payload)
+    print("recovered: status {}, circuit {}".format(status,
+                                                    client.breaker.state))
+    assert status == 200 and client.breaker.state == 'closed'
+    print(client.stats())
+
+    # read timeouts longer than the deadline: attempts are cut short
+    requests.post(control, json={"delay": 2.0})
+    bounded = PredictionClient(url, CircuitBreaker(failures=10),
+                               timeout=(0.2, 0.8), deadline=1.0, retries=1,
+                               backoff=0.01)
+    took, error = timed(lambda: bounded.post(payload))
+    print("read timeout 0.8s, deadline 1s: call failed after {:.0f}ms"
+          .format(took * 1000))
+    assert error is not None and took < bounded.deadline + 0.2
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
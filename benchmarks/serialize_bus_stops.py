@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+"""Microbenchmark: encoding a /bstops listing of 2,300 BusStop objects
+
+Compares the former to_dict() + json module path with the compiled
+per-class serializer + the orjson Flask provider.
+
+    python -m benchmarks.serialize_bus_stops [count] [repeat]
+"""
+
+import json
+import sys
+import timeit
+from datetime import datetime, timedelta
+from flask import Flask
+from backend.models import BusStop
+from api.v1.json_provider import json_provider
+
+
+def legacy_to_dict(obj):
+    """to_dict() as it was before the compiled serializers"""
+    dictionary = {}
+    # file mode instances have slots rather than a __dict__
+    state = getattr(obj, '__dict__', None)
+    dictionary.update(state if state is not None else type(obj).fields(obj))
+    dictionary.update({'__class__': (str(type(obj)).split('.')[-1]).split('\'')[0]})
+    dictionary['created_at'] = obj.created_at.isoformat()
+    dictionary['updated_at'] = obj.updated_at.isoformat()
+    if '_sa_instance_state' in dictionary.keys():
+        del dictionary['_sa_instance_state']
+    return dictionary
+
+
+def make_stops(count):
+    """Builds count bus stops shaped like the Accra data"""
+    start = datetime(2025, 1, 1)
+    return [BusStop(name='Stop {}'.format(n),
+                    latitude=5.5 + n * 1e-4, longitude=-0.2 + n * 1e-4,
+                    suburb_id=str(n % 40),
+                    created_at=start + timedelta(seconds=n),
+                    updated_at=start + timedelta(seconds=n))
+            for n in range(count)]
+
+
+def main(count=2300, repeat=20):
+    """Times both paths and prints the best run of each"""
+    stops = make_stops(count)
+    app = Flask(__name__)
+    provider = json_provider(app)
+
+    def legacy():
+        return json.dumps([legacy_to_dict(s) for s in stops], sort_keys=True)
+
+    def compiled():
+        return provider.dumps([s.to_dict() for s in stops])
+
+    assert json.loads(legacy()) == json.loads(compiled())
+    print("{} BusStop objects, {} ({} runs)".format(
+        count, type(provider).__name__, repeat))
+    results = {}
+    for label, fn in (('to_dict + json', legacy),
+                      ('compiled + provider', compiled)):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        results[label] = best
+        print("  {:<22} {:8.2f} ms".format(label, best * 1000))
+    print("  speedup {:.1f}x".format(results['to_dict + json'] /
+                                     results['compiled + provider']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
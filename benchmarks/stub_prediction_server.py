@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""Local stand-in for the remote prediction service
+
+Answers POST / like the demand service, {"predicted_demand": ..}, after
+an injectable delay; POST /_control {"delay": seconds, "status": code}
+changes the behaviour of the running server (status 200 = healthy).
+
+    python -m benchmarks.stub_prediction_server [port] [delay]
+"""
+
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Request handler reading its behaviour from the server"""
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, as the real service
+    disable_nagle_algorithm = True  # headers and body go out separately
+
+    def do_POST(self):
+        """Answers a prediction or a control request"""
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        server = self.server
+        if self.path == '/_control':
+            server.delay = float(body.get('delay', server.delay))
+            server.status = int(body.get('status', server.status))
+            return self.__reply(200, {"delay": server.delay,
+                                      "status": server.status})
+        with server.lock:
+            server.requests += 1
+        sleep(server.delay)
+        if server.status != 200:
+            return self.__reply(server.status, {"error": "injected"})
+        demand = float(body.get('agency_id', 0)) * 0.5 + \
+            len(body.get('day_name', ''))
+        self.__reply(200, {"predicted_demand": demand})
+
+    def __reply(self, status, data):
+        """Sends data as a JSON response"""
+        raw = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        try:
+            self.wfile.write(raw)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client timed out and went away
+
+    def log_message(self, format, *args):
+        """Quiet"""
+
+
+def start(port=0, delay=0.0):
+    """Runs a stub server in a daemon thread; returns (server, url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.status = 200
+    server.requests = 0
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}/'.format(server.server_address[1])
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8099
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.0
+    server, url = start(port, delay)
+    print("stub prediction service on {}".format(url))
+    threading.Event().wait()
@@ -49,7 +49,12 @@ def get_name_from_csv_by_id(id_, id_col_name, df):
 
 def association_with_routes(route_obj, parent_obj):
     if route_obj and parent_obj:
-        if route_obj not in parent_obj.routes:
+        # the route owns its vehicle and terminal links
+        if isinstance(parent_obj, Vehicle):
+            route_obj.add_vehicle(parent_obj)
+        elif isinstance(parent_obj, Terminal):
+            route_obj.add_terminal(parent_obj)
+        elif route_obj not in parent_obj.routes:
             parent_obj.routes.append(route_obj)
             storage.new(parent_obj)
 
@@ -158,9 +163,9 @@ def load_suburb():
         df_suburb = df_suburb[required_columns]  # Keep only required columns
         df_suburb = df_suburb.drop_duplicates(subset=required_columns)
 
-        for _, row in df_suburb.iterrows():
-            suburb = Suburb(**row.to_dict())
-            suburb.save()
+        for row in df_suburb.to_dict(orient='records'):
+            storage.new(Suburb.from_record(row))
+        storage.save()
         print(f"Suburbs loaded: {len(df_suburb)}")
     else:
         print(f"Suburb source file not found: {src_suburb}")
@@ -184,9 +189,9 @@ def load_routes():
         df_route = df_route[required_columns]  # Keep only required columns
         df_route = df_route.drop_duplicates(subset=required_columns)
 
-        for _, row in df_route.iterrows():
-            route = Route(**row.to_dict())
-            route.save()
+        # route names repeat in the source; upsert on the natural key
+        storage.get_or_create_many(Route, df_route.to_dict(orient='records'))
+        storage.save()
         print(f"Routes loaded: {len(df_route)}")
     else:
         print(f"Route source file not found: {src_route}")
@@ -226,8 +231,8 @@ def load_terminals():
                     row['suburb_id'] = suburb_obj.id
             # ---------------------------------------
             row.rename({'stop_id': 'terminal_id'}, inplace=True)
-            terminal = Terminal(**row.to_dict())
-            terminal.save()
+            storage.new(Terminal.from_record(row.to_dict()))
+        storage.save()
         print(f"Terminals loaded: {len(df_terminal)}")
     else:
         print(f"Terminal source file not found: {src_terminal}")
@@ -311,10 +316,16 @@ def load_bus_stops():
                                                                       [get_obj_through_csv_by_id(
                                                                           i, ['name', 'latitude', 'longitude'],
                                                                           df_bus_stop, 'stop_id', BusStop) for i in x])
-        df_route_stops['route_id'] = df_route_stops['route_id'].apply(lambda x: 
-                                                                      get_obj_through_csv_by_id(
-                                                                          x, ['name', 'distance_km'],
-                                                                          df_route, 'route_id', Route)) 
+        # Routes are upserted on name in batches rather than one by one
+        # one route per route_id: a repeated id in the routes csv fails here
+        route_rows = df_route_stops[['route_id']].merge(
+            df_route[['route_id', 'name', 'distance_km']],
+            on='route_id', how='left', validate='many_to_one')
+        unknown = route_rows.loc[route_rows['name'].isna(), 'route_id']
+        if not unknown.empty:
+            raise ValueError(f"Unknown route_id in route stops: {list(unknown)}")
+        route_rows = route_rows[['name', 'distance_km']]
+        df_route_stops['route_id'] = storage.get_or_create_many(Route, route_rows.to_dict(orient='records'))
         # Create routes and their respective bus stops  
         for _, row in df_route_stops.iterrows():
             route_obj = row['route_id']
@@ -345,8 +356,8 @@ def load_vehicles():
     df_veh = df_veh.drop_duplicates(subset=required_columns)
     df_veh = df_veh[required_columns]
 
-    for _, row in df_veh.iterrows():
-        vehicle = storage.get_or_create(Vehicle, **row.to_dict())
+    # one upsert per batch on vehicle_number instead of a query per row
+    storage.get_or_create_many(Vehicle, df_veh.to_dict(orient='records'))
     storage.save()
 
     print(f"Vehicles loaded: {len(df_veh)}")